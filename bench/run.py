@@ -0,0 +1,271 @@
+"""
+    End-to-end crawl benchmark against the local fixture server.
+
+        python -m bench.run                          # run and compare with bench/baseline.json
+        python -m bench.run --counts 12 48 120       # post counts per stage
+        python -m bench.run --save-baseline          # record the current numbers as the baseline
+        python -m bench.run --archive capture.ndjson.gz
+
+    Stages: profile, posts (network), posts_modal, posts_full, comments,
+    details (post pages in the tab pool) and hashtag (two overlapping tag
+    feeds, with details). Every stage reports posts/sec, WebDriver commands
+    per post, the peak Python heap (tracemalloc) and the peak RSS of the
+    browser processes. A stage that is slower, chattier or heavier than the
+    baseline by more than the tolerance fails the run (exit status 1); without
+    a baseline file the run refuses to start (exit status 2), and stages the
+    baseline has no numbers for are listed as not compared.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import redirect_stdout
+
+from inscrawler import InsCrawler
+from inscrawler.fetch import fetch_comments
+from inscrawler.fetch import fetch_details_batch
+from inscrawler.settings import settings
+
+from .server import FixtureServer
+from .server import FixtureSite
+
+BASELINE = os.path.join(os.path.dirname(__file__), "baseline.json")
+DEFAULT_COUNTS = [12, 48]
+TOLERANCE = 0.25
+
+
+class RssSampler(object):
+    """Samples the resident memory of the browser process tree from /proc."""
+
+    def __init__(self, pid, interval=0.2):
+        self.pid = pid
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def children(pid):
+        pids = [pid]
+        for task in os.listdir("/proc/%d/task" % pid):
+            try:
+                with open("/proc/%d/task/%s/children" % (pid, task)) as f:
+                    for child in f.read().split():
+                        pids.extend(RssSampler.children(int(child)))
+            except OSError:
+                pass
+        return pids
+
+    @staticmethod
+    def rss(pid):
+        try:
+            with open("/proc/%d/status" % pid) as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return 0
+
+    def sample(self):
+        try:
+            total = sum(self.rss(pid) for pid in self.children(self.pid))
+        except OSError:
+            return
+        self.peak = max(self.peak, total)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self.peak = 0
+        if os.path.isdir("/proc/%d" % self.pid):
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._stop.clear()
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+
+def measure(metrics, sampler, fn):
+    """Runs fn() and returns (result, seconds, webdriver commands, heap peak, browser rss peak)."""
+    commands = sum(metrics.commands.values())
+    tracemalloc.start()
+    with sampler:
+        start = time.time()
+        result = fn()
+        elapsed = time.time() - start
+    _, heap_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    commands = sum(metrics.commands.values()) - commands
+    return result, elapsed, commands, heap_peak, sampler.peak
+
+
+def stage_profile(crawler, site, handle, count):
+    crawler.get_user_profile(handle)
+    return 1
+
+
+def stage_posts(crawler, site, handle, count):
+    crawler.browser.get("%s/%s/" % (InsCrawler.URL, handle))
+    return len(list(crawler._get_posts_from_network(count, handle)))
+
+
+def stage_posts_modal(crawler, site, handle, count):
+    crawler.browser.get("%s/%s/" % (InsCrawler.URL, handle))
+    return len(list(crawler._get_posts(count, handle)))
+
+
+def stage_posts_full(crawler, site, handle, count):
+    crawler.browser.get("%s/%s/" % (InsCrawler.URL, handle))
+    return len(list(crawler._get_posts_full(count, handle)))
+
+
+def stage_comments(crawler, site, handle, count):
+    fetched = 0
+    for node in site.nodes(handle)[:count]:
+        crawler.browser.get("%s/%s/p/%s/" % (InsCrawler.URL, handle, node["code"]))
+        post = {}
+        fetch_comments(crawler.browser, post)
+        fetched += 1
+    return fetched
+
+
+def stage_details(crawler, site, handle, count):
+    posts = [
+        {"key": "%s/%s/p/%s/" % (InsCrawler.URL, handle, node["code"])}
+        for node in site.nodes(handle)[:count]
+    ]
+    fetch_details_batch(crawler.browser, posts)
+    return sum(1 for post in posts if post.get("username"))
+
+
+def stage_hashtag(crawler, site, handle, count):
+    # Two feeds sharing a third of their posts
+    return len(crawler.get_posts_by_tags([handle + "a", handle + "b"], count))
+
+
+STAGES = {
+    "profile": stage_profile,
+    "posts": stage_posts,
+    "posts_modal": stage_posts_modal,
+    "posts_full": stage_posts_full,
+    "comments": stage_comments,
+    "details": stage_details,
+    "hashtag": stage_hashtag,
+}
+
+
+def run(stages, counts, archive=None, has_screen=False, comments_per_post=24):
+    site = FixtureSite(archive, comments_per_post=comments_per_post)
+    server = FixtureServer(site).start()
+    InsCrawler.URL = server.url
+    settings.fetch_comments = True
+    settings.fetch_details = True
+
+    results = {}
+    try:
+        # The fixture server never throttles; measure the crawler, not the pacing
+        # (nor the profile cache)
+        crawler = InsCrawler(has_screen=has_screen, use_session=False, rate=1000, profile_ttl=0)
+        browser_pid = crawler.browser.driver.service.process.pid
+        sampler = RssSampler(browser_pid)
+
+        for name in stages:
+            for count in counts:
+                # A fresh handle per run keeps the stages independent of each other
+                handle = "bench%s%d" % (name.replace("_", ""), count)
+                posts, elapsed, commands, heap, rss = measure(
+                    crawler.browser.metrics, sampler, lambda: STAGES[name](crawler, site, handle, count)
+                )
+                key = "%s/%d" % (name, count)
+                results[key] = {
+                    "posts": posts,
+                    "seconds": round(elapsed, 3),
+                    "posts_per_sec": round(posts / elapsed, 2) if elapsed else None,
+                    "commands_per_post": round(commands / posts, 2) if posts else None,
+                    "heap_peak_mb": round(heap / 2 ** 20, 2),
+                    "browser_rss_mb": round(rss / 2 ** 20, 1),
+                }
+                sys.stderr.write("%-20s %s\n" % (key, json.dumps(results[key])))
+        crawler.close()
+    finally:
+        server.stop()
+    return results
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """Returns the regressions of `results` against `baseline` as readable lines."""
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if not base:
+            continue
+        checks = [
+            # metric, higher is better
+            ("posts_per_sec", True),
+            ("commands_per_post", False),
+            ("heap_peak_mb", False),
+            ("browser_rss_mb", False),
+        ]
+        for metric, higher_is_better in checks:
+            now, then = result.get(metric), base.get(metric)
+            if not now or not then:
+                continue
+            change = (now - then) / then
+            if (higher_is_better and change < -tolerance) or (
+                not higher_is_better and change > tolerance
+            ):
+                regressions.append(
+                    "%s %s: %s -> %s (%+.0f%%)" % (key, metric, then, now, change * 100)
+                )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Crawl benchmark against a local fixture server")
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES))
+    parser.add_argument("--counts", nargs="+", type=int, default=DEFAULT_COUNTS)
+    parser.add_argument("--archive", help="serve timeline nodes recorded with --capture")
+    parser.add_argument("--comments", type=int, default=24, help="comments per post")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument("--debug", action="store_true")
+    args = parser.parse_args(argv)
+    if not args.save_baseline and not os.path.exists(args.baseline):
+        # Nothing to compare with: a run would pass whatever it measured
+        parser.error("no baseline at %s, record one with --save-baseline" % args.baseline)
+
+    # The crawler's progress output would drown the report
+    with redirect_stdout(sys.stderr):
+        results = run(args.stages, args.counts, args.archive, args.debug, args.comments)
+
+    print(json.dumps(results, indent=2))
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf8") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+        sys.stderr.write("Saved baseline to %s\n" % args.baseline)
+        return 0
+
+    with open(args.baseline, encoding="utf8") as f:
+        baseline = json.load(f)
+    for key in sorted(set(results) - set(baseline)):
+        sys.stderr.write("NO BASELINE %s, not compared\n" % key)
+    regressions = compare(results, baseline, args.tolerance)
+    for line in regressions:
+        sys.stderr.write("REGRESSION %s\n" % line)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
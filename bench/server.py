@@ -0,0 +1,444 @@
+"""
+    Local Instagram-like fixture server for benchmarks.
+
+    It serves the pages and XHRs the crawler relies on, using the same CSS
+    classes and GraphQL shapes as the live site:
+
+        /accounts/login/             login form
+        /{handle}/                   profile header, grid and the embedded first timeline page
+        /graphql/query               timeline pages (POST, the profile scroll handler fires it)
+        /{handle}/p/{code}/          post page (?modal=1 returns the modal fragment)
+        /explore/tags/{tag}/         hashtag grid mixing several handles, one shared by every tag
+        /static/...                  images (with Range support) and scripts
+
+    A handle ending in digits has that many posts (bench120 has 120). Posts
+    are synthetic unless a capture archive (inscrawler.capture) is given, in
+    which case the recorded timeline nodes are served instead.
+"""
+import copy
+import html
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+from inscrawler.graphql import TIMELINE
+from inscrawler.graphql import find_connections
+from inscrawler.graphql import iter_nodes
+
+PAGE_SIZE = 12
+DEFAULT_POSTS = 24
+
+PIXEL = (
+    b"GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04\x01\x00"
+    b"\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D\x01\x00;"
+)
+
+APP_JS = r"""
+(function() {
+    var grid = document.getElementById("grid");
+    var state = JSON.parse(document.getElementById("state").textContent);
+    var loading = false;
+
+    function cell(node) {
+        var div = document.createElement("div");
+        div.className = "x1lliihq v1Nh3";
+        div.innerHTML = '<a href="/' + state.handle + '/p/' + node.code + '/">' +
+            '<img src="/static/' + node.code + '.gif" alt=""></a>';
+        return div;
+    }
+
+    function loadMore() {
+        if (loading || !state.has_next) { return; }
+        loading = true;
+        var xhr = new XMLHttpRequest();
+        xhr.open("POST", "/graphql/query");
+        xhr.setRequestHeader("Content-Type", "application/x-www-form-urlencoded");
+        xhr.onload = function() {
+            var conn = JSON.parse(xhr.responseText).data[state.connection];
+            conn.edges.forEach(function(e) { grid.appendChild(cell(e.node)); });
+            state.has_next = conn.page_info.has_next_page;
+            state.cursor = conn.page_info.end_cursor;
+            loading = false;
+        };
+        xhr.send("fb_api_req_friendly_name=PolarisProfilePostsQuery&handle=" +
+                 encodeURIComponent(state.handle) + "&after=" + state.cursor);
+    }
+
+    window.addEventListener("scroll", function() {
+        if (window.innerHeight + window.scrollY >= document.body.scrollHeight - 50) {
+            loadMore();
+        }
+    });
+
+    document.addEventListener("click", function(ev) {
+        var a = ev.target.closest && ev.target.closest("#grid a");
+        if (a) {
+            ev.preventDefault();
+            var xhr = new XMLHttpRequest();
+            xhr.open("GET", a.getAttribute("href") + "?modal=1");
+            xhr.onload = function() {
+                var old = document.getElementById("modal");
+                if (old) { old.remove(); }
+                var wrap = document.createElement("div");
+                wrap.id = "modal";
+                wrap.innerHTML = xhr.responseText;
+                document.body.appendChild(wrap);
+            };
+            xhr.send();
+            return;
+        }
+        if (ev.target.closest && ev.target.closest("svg[aria-label='Close']")) {
+            var modal = document.getElementById("modal");
+            if (modal) { modal.remove(); }
+        }
+    });
+})();
+"""
+
+POST_JS = r"""
+(function() {
+    function comment(i, reply) {
+        var li = document.createElement("li");
+        li.className = "gElp9";
+        li.innerHTML = '<a class="FPmhX" href="/user' + i + '/">user' + i + '</a>' +
+            '<span>' + (reply ? 'reply ' : 'comment ') + i + ' @friend' + i + ' #tag' + (i % 7) + '</span>' +
+            '<a class="gU-I7" href="' + location.pathname + 'c/' + (reply ? 'r' : '') + i + '/">' +
+            '<time datetime="2025-02-01T10:00:00.000Z"></time></a>' +
+            (reply ? '' : '<button class="EizgU">View replies</button>');
+        return li;
+    }
+    function thread(i) {
+        var ul = document.createElement("ul");
+        ul.className = "Mr508";
+        ul.appendChild(comment(i, false));
+        var replies = document.createElement("li");
+        replies.innerHTML = '<ul class="TCSYW"></ul>';
+        ul.appendChild(replies);
+        return ul;
+    }
+    document.addEventListener("click", function(ev) {
+        var more = ev.target.closest && ev.target.closest("button.more");
+        if (more) {
+            var list = more.parentNode.querySelector(".comments");
+            var shown = list.querySelectorAll("ul.Mr508").length - 1;
+            var total = parseInt(more.getAttribute("data-total"), 10);
+            setTimeout(function() {
+                for (var i = shown; i < Math.min(shown + 12, total); i++) {
+                    list.appendChild(thread(i));
+                }
+                if (shown + 12 >= total) { more.remove(); }
+            }, 30);
+            return;
+        }
+        var replies = ev.target.closest && ev.target.closest("button.EizgU");
+        if (replies) {
+            var li = replies.parentNode;
+            var i = parseInt(li.querySelector(".FPmhX").textContent.replace("user", ""), 10);
+            setTimeout(function() {
+                li.parentNode.querySelector("ul.TCSYW").appendChild(comment(100000 + i, true));
+                replies.remove();
+            }, 10);
+        }
+    });
+})();
+"""
+
+COMMENT_THREAD = (
+    '<ul class="Mr508"><li class="gElp9"><a class="FPmhX" href="/user%(i)d/">user%(i)d</a>'
+    "<span>comment %(i)d @friend%(i)d #tag%(tag)d</span>"
+    '<a class="gU-I7" href="%(url)sc/%(i)d/"><time datetime="2025-02-01T10:00:00.000Z"></time></a>'
+    '<button class="EizgU">View replies</button></li>'
+    '<li><ul class="TCSYW"></ul></li></ul>'
+)
+
+
+def synthetic_node(handle, i):
+    code = "B%s%05d" % (re.sub(r"\W", "", handle)[:6], i)
+    return {
+        "id": "%d_1" % (10 ** 12 + i),
+        "pk": str(10 ** 12 + i),
+        "code": code,
+        "taken_at": 1738490236 - i * 3600,
+        "media_type": 1,
+        "product_type": "feed",
+        "caption": {"text": "Post %d by %s with @friend%d #bench" % (i, handle, i % 5)},
+        "user": {"username": handle},
+        "image_versions2": {
+            "candidates": [{"url": "/static/%s.gif" % code, "width": 1080, "height": 1080}]
+        },
+        "coauthor_producers": [],
+        "usertags": {"in": [{"user": {"username": "tagged%d" % (i % 3)}}]},
+        "like_count": 100 + i,
+        "comment_count": 10,
+    }
+
+
+class FixtureSite(object):
+    def __init__(self, archive=None, comments_per_post=24):
+        self.comments_per_post = comments_per_post
+        self.recorded = []
+        if archive:
+            from inscrawler.capture import read_archive
+
+            for entry in read_archive(archive):
+                for conn in find_connections(entry["body"], TIMELINE):
+                    self.recorded.extend(iter_nodes(conn))
+        self.cache = {}
+
+    @staticmethod
+    def post_count(handle):
+        match = re.search(r"(\d+)$", handle)
+        return int(match.group(1)) if match else DEFAULT_POSTS
+
+    def nodes(self, handle):
+        if handle not in self.cache:
+            count = self.post_count(handle)
+            if self.recorded:
+                nodes = []
+                for i in range(count):
+                    node = copy.deepcopy(self.recorded[i % len(self.recorded)])
+                    node["code"] = "%s%d" % (node.get("code", "R"), i)
+                    node["user"] = {"username": handle}
+                    nodes.append(node)
+            else:
+                nodes = [synthetic_node(handle, i) for i in range(count)]
+            self.cache[handle] = nodes
+        return self.cache[handle]
+
+    def node(self, handle, code):
+        for node in self.nodes(handle):
+            if node["code"] == code:
+                return node
+        return None
+
+    def timeline(self, handle, after=0):
+        nodes = self.nodes(handle)
+        page = nodes[after:after + PAGE_SIZE]
+        return {
+            "data": {
+                TIMELINE: {
+                    "edges": [{"node": node} for node in page],
+                    "page_info": {
+                        "has_next_page": after + PAGE_SIZE < len(nodes),
+                        "end_cursor": str(after + PAGE_SIZE),
+                    },
+                }
+            }
+        }
+
+    @staticmethod
+    def media(name):
+        """A small GIF per file name: the same pixel, padded with a comment unique to the name."""
+        comment = name.encode("utf8")[:255]
+        return PIXEL[:-1] + b"!\xfe" + bytes([len(comment)]) + comment + b"\x00;"
+
+    def grid_cells(self, handle, nodes):
+        return "".join(
+            '<div class="x1lliihq v1Nh3"><a href="/%s/p/%s/">'
+            '<img src="/static/%s.gif" alt=""></a></div>'
+            % (node["user"]["username"] if "user" in node else handle, node["code"], node["code"])
+            for node in nodes
+        )
+
+    def profile_page(self, handle):
+        first = self.timeline(handle)
+        state = {
+            "handle": handle,
+            "connection": TIMELINE,
+            "cursor": str(PAGE_SIZE),
+            "has_next": first["data"][TIMELINE]["page_info"]["has_next_page"],
+        }
+        return """<!DOCTYPE html><html><head><title>%(handle)s</title></head><body>
+<header>
+  <img class="_6q-tv" src="/static/avatar.gif">
+  <h2><span>%(handle)s</span></h2>
+  <div class="-vDIg"><span>Benchmark fixture profile for %(handle)s</span></div>
+  <ul class="xc3tme8"><li><span>%(count)s</span></li><li><span>12,345</span></li><li><span>678</span></li></ul>
+</header>
+<script type="application/json">%(embedded)s</script>
+<script type="application/json" id="state">%(state)s</script>
+<main id="grid">%(cells)s</main>
+<div style="height: 1500px"></div>
+<script src="/static/app.js"></script>
+</body></html>""" % {
+            "handle": html.escape(handle),
+            "count": len(self.nodes(handle)),
+            "embedded": json.dumps({"require": [["RelayPrefetchedStreamCache", first]]}),
+            "state": json.dumps(state),
+            "cells": self.grid_cells(handle, self.nodes(handle)[:PAGE_SIZE]),
+        }
+
+    def modal(self, handle, node):
+        caption = (node.get("caption") or {}).get("text", "")
+        mentions = "".join(
+            ' <a href="/%s/">@%s</a>' % (m, m) for m in re.findall(r"@([\w\.]+)", caption)
+        )
+        taken = node.get("taken_at", 0)
+        datetime = "%s.000Z" % time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(taken))
+        url = "/%s/p/%s/" % (handle, node["code"])
+        first = min(12, self.comments_per_post)
+        comments = "".join(
+            COMMENT_THREAD % {"i": i, "tag": i % 7, "url": url} for i in range(first)
+        )
+        more = (
+            '<button class="more" data-total="%d">'
+            '<span class="glyphsSpriteCircle_add__outline__24__grey_9">+</span></button>'
+            % self.comments_per_post
+            if self.comments_per_post > first
+            else ""
+        )
+        return """<div class="x6s0dn4" role="dialog">
+  <svg aria-label="Close" width="24" height="24"><rect width="24" height="24"></rect></svg>
+  <article>
+    <div class="_aaqt _aaqu"><a href="/%(handle)s/">%(handle)s</a></div>
+    <div class="_aagv _97aPb"><img src="/static/%(code)s.gif"></div>
+    <div class="xt0psk2"><h1>%(caption)s%(mentions)s</h1></div>
+    <time class="x1p4m5qa" datetime="%(datetime)s"></time>
+    <div class="eo2As">
+      <a class="c-Yi7" href="%(url)s"><time class="_1o9PC" datetime="%(datetime)s"></time></a>
+      <div class="comments"><ul class="Mr508"><li class="gElp9"><span>%(caption)s</span></li></ul>%(comments)s</div>
+      %(more)s
+    </div>
+  </article>
+</div>""" % {
+            "handle": html.escape(handle),
+            "code": node["code"],
+            "caption": html.escape(caption),
+            "mentions": mentions,
+            "datetime": datetime,
+            "url": url,
+            "comments": comments,
+            "more": more,
+        }
+
+    def post_page(self, handle, node):
+        # The post page's own header and first comment, read by fetch_details
+        header = (
+            '<header><a class="ZIAjV" href="/%(handle)s/">%(handle)s</a>'
+            '<a class="O4GlU" href="/explore/locations/1/">Taipei</a></header>'
+            '<ul class="XQXOT"><li class="ZyFrc"><span>%(caption)s</span></li></ul>'
+            % {
+                "handle": html.escape(handle),
+                "caption": html.escape((node.get("caption") or {}).get("text", "")),
+            }
+        )
+        return (
+            "<!DOCTYPE html><html><body>%s%s<script src=\"/static/post.js\"></script>"
+            "</body></html>" % (header, self.modal(handle, node))
+        )
+
+    def tag_page(self, tag):
+        # Mix posts of a few handles, as a tag feed would; the last handle's
+        # posts show up under every tag
+        handles = ["%s_user%d%d" % (tag, i, DEFAULT_POSTS) for i in range(2)]
+        handles.append("everytag%d" % DEFAULT_POSTS)
+        nodes = []
+        for handle in handles:
+            nodes.extend(self.nodes(handle)[:PAGE_SIZE])
+        return """<!DOCTYPE html><html><body><h1>#%s</h1>
+<main id="grid">%s</main><script type="application/json" id="state">%s</script>
+<script src="/static/app.js"></script></body></html>""" % (
+            html.escape(tag),
+            self.grid_cells(tag, nodes),
+            json.dumps({"handle": tag, "connection": TIMELINE, "cursor": "0", "has_next": False}),
+        )
+
+    LOGIN_PAGE = """<!DOCTYPE html><html><body>
+<form method="GET" action="/">
+  <input name="username"><input name="password" type="password">
+  <button type="submit">Log in</button>
+</form></body></html>"""
+
+
+def make_handler(site):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def send(self, body, content_type="text/html; charset=utf-8", status=200):
+            if isinstance(body, str):
+                body = body.encode("utf8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def send_media(self, body):
+            # Ranges let the media downloader resume
+            match = re.match(r"bytes=(\d+)-$", self.headers.get("Range") or "")
+            if not match:
+                return self.send(body, "image/gif")
+            start = int(match.group(1))
+            if start >= len(body):
+                return self.send(b"", "image/gif", status=416)
+            self.send_response(206)
+            self.send_header("Content-Type", "image/gif")
+            self.send_header("Content-Range", "bytes %d-%d/%d" % (start, len(body) - 1, len(body)))
+            self.send_header("Content-Length", str(len(body) - start))
+            self.end_headers()
+            self.wfile.write(body[start:])
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            parts = [p for p in url.path.split("/") if p]
+            query = parse_qs(url.query)
+
+            if url.path == "/static/app.js":
+                return self.send(APP_JS, "application/javascript")
+            if url.path == "/static/post.js":
+                return self.send(POST_JS, "application/javascript")
+            if parts[:1] == ["static"]:
+                return self.send_media(site.media(parts[-1]))
+            if parts[:2] == ["accounts", "login"]:
+                return self.send(site.LOGIN_PAGE)
+            if not parts:
+                return self.send("<!DOCTYPE html><html><body><h1>home</h1></body></html>")
+            if parts[:2] == ["explore", "tags"] and len(parts) > 2:
+                return self.send(site.tag_page(parts[2]))
+            if len(parts) == 1:
+                return self.send(site.profile_page(parts[0]))
+            if len(parts) == 3 and parts[1] in ("p", "reel"):
+                node = site.node(parts[0], parts[2])
+                if node is None:
+                    return self.send("not found", status=404)
+                if query.get("modal"):
+                    return self.send(site.modal(parts[0], node))
+                return self.send(site.post_page(parts[0], node))
+            return self.send("not found", status=404)
+
+        def do_POST(self):
+            if urlparse(self.path).path != "/graphql/query":
+                return self.send("not found", status=404)
+            length = int(self.headers.get("Content-Length") or 0)
+            form = parse_qs(self.rfile.read(length).decode("utf8"))
+            handle = form.get("handle", [""])[0]
+            after = int(form.get("after", ["0"])[0] or 0)
+            return self.send(json.dumps(site.timeline(handle, after)), "application/json")
+
+    return Handler
+
+
+class FixtureServer(object):
+    def __init__(self, site=None, host="127.0.0.1", port=0):
+        self.site = site or FixtureSite()
+        self.httpd = ThreadingHTTPServer((host, port), make_handler(self.site))
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return "http://%s:%d" % (host, port)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
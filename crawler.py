@@ -4,9 +4,17 @@ from __future__ import unicode_literals
 import argparse
 import json
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
 from io import open
 
-from inscrawler import InsCrawler
+# The crawler, its pool and the pipeline load selenium and friends; they are
+# imported where they are used so --help and --daemon start in milliseconds
+from inscrawler.output import NdjsonWriter
+from inscrawler.resources import CATEGORIES
+from inscrawler.resources import PROFILES
+from inscrawler.settings import dump_settings
 from inscrawler.settings import override_settings
 from inscrawler.settings import prepare_override_settings
 
@@ -15,32 +23,284 @@ def usage():
     return """
         python crawler.py posts -u cal_foodie -n 100 -o ./output
         python crawler.py posts_full -u cal_foodie -n 100 -o ./output
+        python crawler.py posts -u cal_foodie,foodie_tw -n 100 -w 4 -o ./output
+        python crawler.py posts --users_file ./handles.txt -n 100 -w 4 -o ./output
+        python crawler.py posts -u cal_foodie --incremental -o ./output
+        python crawler.py posts_full -u cal_foodie -n 1000 --stream -o ./output.ndjson
         python crawler.py profile -u cal_foodie -o ./output
         python crawler.py profile_script -u cal_foodie -o ./output
         python crawler.py hashtag -t taiwan -o ./output
+        python crawler.py hashtag -t taiwan,taipei,tainan -n 200 -w 3 -o ./output
+        python crawler.py posts -u cal_foodie -n 100 --daemon -o ./output
 
         The default number for fetching posts via hashtag is 100.
     """
 
 
-def get_posts_by_user(username, number, detail, debug):
-    ins_crawler = InsCrawler(has_screen=debug)
-    return ins_crawler.get_user_posts(username, number, detail)
+def get_posts_by_user(
+    username, number, detail, debug, incremental=False, **crawler_kwargs
+):
+    from inscrawler import InsCrawler
 
+    with InsCrawler(has_screen=debug, **crawler_kwargs) as ins_crawler:
+        return ins_crawler.get_user_posts(username, number, detail, incremental)
 
-def get_profile(username):
-    ins_crawler = InsCrawler()
-    return ins_crawler.get_user_profile(username)
 
+def get_posts_by_users(
+    usernames, number, detail, debug, workers, incremental=False, **crawler_kwargs
+):
+    from inscrawler.pool import CrawlerPool
 
-def get_profile_from_script(username):
-    ins_cralwer = InsCrawler()
-    return ins_cralwer.get_user_profile_from_script_shared_data(username)
+    pool = CrawlerPool(workers=workers, has_screen=debug, **crawler_kwargs)
+    posts = pool.crawl_users(usernames, number, detail, incremental)
+    pool.report()
+    return posts
 
 
-def get_posts_by_hashtag(tag, number, debug,handle):
-    ins_crawler = InsCrawler(has_screen=debug)
-    return ins_crawler.get_latest_posts_by_tag(tag, number,handle)
+def add_db_sink(pipeline, batch_size=500):
+    """Loads posts into Postgres (see save_to_db.py) while the crawl goes on."""
+    # Imported here so crawling without --db needs no database driver
+    from save_to_db import BulkLoader
+    from save_to_db import create_pool
+
+    loader = BulkLoader(create_pool(), batch_size=batch_size)
+
+    def finish():
+        loader.finish()
+        loader.report()
+
+    pipeline.add_sink("db", loader.add, batch_size=batch_size, on_close=finish)
+
+
+def make_stream_pipeline(writer, db=False, media_dir=None):
+    """
+        The pipeline streamed posts go through: text parsing, then the
+        media download if `media_dir` is set, then `writer` and, with `db`,
+        Postgres. Returns it with its MediaDownloader, if any.
+    """
+    from inscrawler.media import MediaDownloader
+    from inscrawler.pipeline import Pipeline
+    from inscrawler.pipeline import parse_text
+
+    pipeline = Pipeline()
+    pipeline.add_transform("text", parse_text)
+    downloader = None
+    if media_dir is not None:
+        downloader = MediaDownloader(media_dir or None)
+        # Runs before the sinks so the records they get carry local paths
+        pipeline.add_transform("media", downloader.download_post, workers=downloader.workers)
+    pipeline.add_sink("file", writer.write)
+    if db:
+        add_db_sink(pipeline)
+    return pipeline, downloader
+
+
+def stream_posts_by_users(
+    usernames,
+    number,
+    detail,
+    debug,
+    workers,
+    incremental,
+    filepath,
+    db=False,
+    media_dir=None,
+    **crawler_kwargs
+):
+    """
+        Writes every post as an NDJSON line the moment it is crawled. Posts go
+        through a pipeline, so text parsing, the file and the database work
+        while the browsers keep crawling.
+    """
+    from inscrawler import InsCrawler
+    from inscrawler.pool import CrawlerPool
+
+    # Keep progress messages out of the record stream when it goes to stdout
+    with NdjsonWriter(filepath) as writer, redirect_stdout(sys.stderr):
+        pipeline, downloader = make_stream_pipeline(writer, db, media_dir)
+        with pipeline:
+            if len(usernames) > 1 or workers > 1:
+                pool = CrawlerPool(
+                    workers=workers,
+                    has_screen=debug,
+                    queue_size=pipeline.maxsize,
+                    **crawler_kwargs
+                )
+                pool.stream_users(usernames, pipeline.put, number, detail, incremental)
+                pool.report()
+            else:
+                with InsCrawler(has_screen=debug, **crawler_kwargs) as ins_crawler:
+                    for post in ins_crawler.iter_user_posts(
+                        usernames[0], number, detail, incremental
+                    ):
+                        pipeline.put(post)
+        pipeline.report()
+        if downloader:
+            downloader.close()
+            downloader.report()
+
+
+def download_media(posts, media_dir):
+    """Downloads the media of already crawled posts, adding their local paths."""
+    from inscrawler.media import MediaDownloader
+
+    downloader = MediaDownloader(media_dir or None)
+    with ThreadPoolExecutor(max_workers=downloader.workers) as executor:
+        posts = list(executor.map(downloader.download_post, posts))
+    downloader.close()
+    downloader.report()
+    return posts
+
+
+def read_usernames(args):
+    usernames = []
+    if args.username:
+        usernames.extend(args.username.split(","))
+    if args.users_file:
+        with open(args.users_file, encoding="utf8") as f:
+            usernames.extend(f.read().split())
+
+    handles = []
+    for username in usernames:
+        username = username.strip().lstrip("@")
+        if username and username not in handles:
+            handles.append(username)
+    return handles
+
+
+def read_tags(args):
+    tags = []
+    for tag in args.tag.split(","):
+        tag = tag.strip().lstrip("#")
+        if tag and tag not in tags:
+            tags.append(tag)
+    return tags
+
+
+def get_profile(username, **crawler_kwargs):
+    from inscrawler import InsCrawler
+
+    with InsCrawler(**crawler_kwargs) as ins_crawler:
+        return ins_crawler.get_user_profile(username)
+
+
+def get_profile_from_script(username, **crawler_kwargs):
+    from inscrawler import InsCrawler
+
+    with InsCrawler(**crawler_kwargs) as ins_cralwer:
+        return ins_cralwer.get_user_profile_from_script_shared_data(username)
+
+
+def get_posts_by_hashtags(tags, number, debug, workers, **crawler_kwargs):
+    from inscrawler import InsCrawler
+    from inscrawler.pool import CrawlerPool
+
+    if len(tags) > 1 and workers > 1:
+        pool = CrawlerPool(workers=workers, has_screen=debug, **crawler_kwargs)
+        posts = pool.crawl_tags(tags, number)
+        pool.report()
+        return posts
+
+    with InsCrawler(has_screen=debug, **crawler_kwargs) as ins_crawler:
+        return ins_crawler.get_posts_by_tags(tags, number)
+
+
+def run_in_daemon(args):
+    """
+        Runs the crawl in the warm browsers of a running daemon (see
+        inscrawler/daemon.py) instead of starting a browser and logging in.
+        Crawler options (--rate, --resources, ...) are the daemon's own;
+        the fetch settings go with every request.
+    """
+    from inscrawler.client import call
+
+    # Files a crawler writes while it crawls: the daemon's crawlers serve
+    # every client, they can't write them for one request
+    unsupported = [
+        flag
+        for flag, value in (
+            ("--capture", args.capture),
+            ("--metrics", args.metrics),
+            ("--likers_output", args.likers_output),
+            ("--comments_output", args.comments_output),
+        )
+        if value
+    ]
+    if unsupported:
+        parser.error("%s can't be used with --daemon" % ", ".join(unsupported))
+
+    settings = dump_settings()
+
+    if args.mode in ["posts", "posts_full"]:
+        usernames = read_usernames(args)
+        if not usernames:
+            arg_required(args, ["username"])
+        detail = args.mode == "posts_full"
+
+        # One request per handle; the daemon queues them for its free browsers
+        workers = min(len(usernames), max(args.workers, 4))
+        if args.stream:
+            with NdjsonWriter(args.output) as writer, redirect_stdout(sys.stderr):
+                pipeline, downloader = make_stream_pipeline(writer, args.db, args.media)
+                lock = threading.Lock()
+
+                def put(post):
+                    # Every request streams on a thread of its own
+                    with lock:
+                        pipeline.put(post)
+
+                def crawl(username):
+                    call(
+                        "iter_user_posts",
+                        username,
+                        args.number,
+                        detail,
+                        args.incremental,
+                        settings=settings,
+                        on_record=put,
+                    )
+
+                with pipeline:
+                    with ThreadPoolExecutor(max_workers=workers) as executor:
+                        list(executor.map(crawl, usernames))
+                pipeline.report()
+                if downloader:
+                    downloader.close()
+                    downloader.report()
+            return
+
+        def crawl(username):
+            return call(
+                "get_user_posts",
+                username,
+                args.number,
+                detail,
+                args.incremental,
+                settings=settings,
+            )
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            posts = [post for handle_posts in executor.map(crawl, usernames) for post in handle_posts]
+    elif args.mode == "profile":
+        arg_required(args, ["username"])
+        # --profile_ttl here is this request's staleness limit, not the daemon's ttl
+        profile = call("get_user_profile", args.username, args.profile_ttl, settings=settings)
+        return output(profile, args.output)
+    elif args.mode == "profile_script":
+        arg_required(args, ["username"])
+        return output(
+            call("get_user_profile_from_script_shared_data", args.username, settings=settings),
+            args.output,
+        )
+    elif args.mode == "hashtag":
+        arg_required(args, ["tag"])
+        posts = call("get_posts_by_tags", read_tags(args), args.number or 100, settings=settings)
+    else:
+        return usage()
+
+    if args.media is not None:
+        posts = download_media(posts, args.media)
+    output(posts, args.output)
 
 
 def arg_required(args, fields=[]):
@@ -66,9 +326,92 @@ if __name__ == "__main__":
     )
     parser.add_argument("-n", "--number", type=int, help="number of returned posts")
     parser.add_argument("-u", "--username", help="instagram's username")
-    parser.add_argument("-t", "--tag", help="instagram's tag name")
+    parser.add_argument(
+        "--users_file", help="file with instagram usernames, one per line"
+    )
+    parser.add_argument(
+        "-w", "--workers", type=int, default=1, help="number of browser workers"
+    )
+    parser.add_argument(
+        "-t", "--tag", help="instagram's tag name (comma separated for several)"
+    )
     parser.add_argument("-o", "--output", help="output file name(json format)")
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="write posts as NDJSON lines while crawling (appends to the output file)",
+    )
+    parser.add_argument(
+        "--db",
+        action="store_true",
+        help="with --stream, also load the posts into Postgres while crawling",
+    )
+    parser.add_argument(
+        "--media",
+        nargs="?",
+        const="",
+        metavar="DIR",
+        help="download every post's media into DIR (default ~/.inscrawler/media)",
+    )
     parser.add_argument("--debug", action="store_true")
+    parser.add_argument(
+        "--capture",
+        help="archive every captured GraphQL response to this file (.ndjson.gz)",
+    )
+    parser.add_argument(
+        "--metrics",
+        help="write a JSON metrics summary to this file and Prometheus text next to it (.prom)",
+    )
+    parser.add_argument(
+        "--resources",
+        choices=sorted(PROFILES),
+        help="resource profile to block requests by (default: the mode's own, 'none' loads everything)",
+    )
+    parser.add_argument(
+        "--block",
+        help="comma separated resource categories (%s) or URL patterns to block as well"
+        % ", ".join(sorted(CATEGORIES)),
+    )
+    parser.add_argument(
+        "--likers_output",
+        help="with --fetch_likers, append likers to this NDJSON file as they are collected",
+    )
+    parser.add_argument(
+        "--comments_output",
+        help="with --fetch_comments, append comments to this NDJSON file page by page",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        help="navigations, scrolls and clicks per second per browser (default: no limit"
+        " until the site throttles)",
+    )
+    parser.add_argument(
+        "--global_rate",
+        type=float,
+        help="the same, shared by every crawler process on this machine",
+    )
+    parser.add_argument(
+        "--tabs",
+        type=int,
+        default=4,
+        help="tabs per browser that post pages (--fetch_details) load in side by side",
+    )
+    parser.add_argument(
+        "--profile_ttl",
+        type=int,
+        help="seconds a profile is served from the shared profile cache (default 3600, 0 to skip the cache)",
+    )
+    parser.add_argument(
+        "--daemon",
+        action="store_true",
+        help="run the crawl in a running crawl daemon (python -m inscrawler.daemon serve)",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only fetch posts newer than the ones seen in earlier incremental runs",
+    )
 
     prepare_override_settings(parser)
 
@@ -76,24 +419,88 @@ if __name__ == "__main__":
 
     override_settings(args)
 
+    if args.db and not args.stream:
+        parser.error("--db needs --stream")
+
+    if args.daemon:
+        from inscrawler.exceptions import DaemonError
+
+        try:
+            run_in_daemon(args)
+        except DaemonError as e:
+            sys.stderr.write("%s\n" % e)
+            sys.exit(1)
+        sys.exit()
+
+    crawler_kwargs = {
+        "capture_path": args.capture,
+        "metrics_path": args.metrics,
+        "resources": args.resources or (args.mode if args.mode in PROFILES else None),
+        "block": args.block,
+        "likers_path": args.likers_output,
+        "comments_path": args.comments_output,
+        "rate": args.rate,
+        "global_rate": args.global_rate,
+        "tabs": args.tabs,
+        "profile_ttl": args.profile_ttl,
+    }
+
     if args.mode in ["posts", "posts_full"]:
-        arg_required("username")
-        output(
-            get_posts_by_user(
-                args.username, args.number, args.mode == "posts_full", args.debug
-            ),
-            args.output,
-        )
+        usernames = read_usernames(args)
+        if not usernames:
+            arg_required(args, ["username"])
+
+        detail = args.mode == "posts_full"
+        if args.stream:
+            stream_posts_by_users(
+                usernames,
+                args.number,
+                detail,
+                args.debug,
+                args.workers,
+                args.incremental,
+                args.output,
+                args.db,
+                args.media,
+                **crawler_kwargs
+            )
+            sys.exit()
+
+        if len(usernames) > 1 or args.workers > 1:
+            posts = get_posts_by_users(
+                usernames,
+                args.number,
+                detail,
+                args.debug,
+                args.workers,
+                args.incremental,
+                **crawler_kwargs
+            )
+        else:
+            posts = get_posts_by_user(
+                usernames[0],
+                args.number,
+                detail,
+                args.debug,
+                args.incremental,
+                **crawler_kwargs
+            )
+        if args.media is not None:
+            posts = download_media(posts, args.media)
+        output(posts, args.output)
     elif args.mode == "profile":
-        arg_required("username")
-        output(get_profile(args.username), args.output)
+        arg_required(args, ["username"])
+        output(get_profile(args.username, **crawler_kwargs), args.output)
     elif args.mode == "profile_script":
-        arg_required("username")
-        output(get_profile_from_script(args.username), args.output)
+        arg_required(args, ["username"])
+        output(get_profile_from_script(args.username, **crawler_kwargs), args.output)
     elif args.mode == "hashtag":
-        arg_required("tag")
-        output(
-            get_posts_by_hashtag(args.tag, args.number or 100, args.debug,args.username), args.output
+        arg_required(args, ["tag"])
+        posts = get_posts_by_hashtags(
+            read_tags(args), args.number or 100, args.debug, args.workers, **crawler_kwargs
         )
+        if args.media is not None:
+            posts = download_media(posts, args.media)
+        output(posts, args.output)
     else:
         usage()
@@ -1 +1,7 @@
-from .crawler import InsCrawler
+def __getattr__(name):
+    # Importing the crawler loads selenium; only pay for it when it is used
+    if name == "InsCrawler":
+        from .crawler import InsCrawler
+
+        return InsCrawler
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
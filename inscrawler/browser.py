@@ -1,4 +1,8 @@
 import os
+import shutil
+import threading
+import weakref
+from contextlib import contextmanager
 
 from selenium import webdriver
 from selenium.common.exceptions import NoSuchElementException
@@ -10,11 +14,24 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
 from selenium.webdriver.chrome.service import Service
 import json,time
-from fake_useragent import UserAgent
-from .utils import randmized_sleep
+from . import scripts
+from .metrics import Metrics
+from .network import GraphQLStream
+from .scheduler import Scheduler
+from .tabs import TabPool
+
+
+class _LogHold(object):
+    """A performance log reader that never reads, see Browser.hold_performance_log."""
+
 
 class Browser:
-    def __init__(self, has_screen):
+    # Performance log entries kept until every reader has seen them
+    PERFORMANCE_BACKLOG = 50000
+    # Paced actions between two reads of the performance log for throttling
+    THROTTLE_CHECK_EVERY = 10
+
+    def __init__(self, has_screen, resource_policy=None, scheduler=None, tabs=4):
         chrome_options = Options()
         
         if not has_screen:
@@ -27,13 +44,173 @@ class Browser:
         chrome_options.add_argument("--auto-open-devtools-for-tabs") 
         chrome_options.add_argument("--enable-logging")
         chrome_options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+        # Only network events reach the performance log
+        chrome_options.add_experimental_option(
+            "perfLoggingPrefs", {"enableNetwork": True, "enablePage": False}
+        )
         
         self.driver = webdriver.Chrome(
-            service=Service("/opt/homebrew/bin/chromedriver"),
+            service=Service(self.chromedriver_path()),
             options=chrome_options,
         )
 
         self.driver.implicitly_wait(5)
+        self.metrics = Metrics()
+        self.metrics.instrument(self.driver)
+        self.wait_stats = {}
+        # Optional capture.CaptureRecorder that archives every GraphQL response
+        self.recorder = None
+        self.resource_policy = None
+        # Every navigation, scroll and click goes through pace()
+        self.scheduler = scheduler or Scheduler()
+        self._paced = 0
+        # Extra tabs for loading several pages at once, opened on first use
+        self.tabs = TabPool(self, tabs)
+        # Incremental reader of the GraphQL responses, see get_network_logs
+        self._graphql = None
+        # Entries read from chromedriver, the first one's position, and every
+        # reader's next position; a reader that is garbage collected stops counting
+        self._performance_backlog = []
+        self._performance_base = 0
+        self._performance_readers = weakref.WeakKeyDictionary()
+        # Open holds, newest last, see hold_performance_log
+        self._performance_holds = []
+        self._performance_lock = threading.RLock()
+        if resource_policy:
+            self.set_resource_policy(resource_policy)
+
+    @staticmethod
+    def chromedriver_path():
+        """$CHROMEDRIVER, else the chromedriver on PATH, else the Homebrew one."""
+        return (
+            os.environ.get("CHROMEDRIVER")
+            or shutil.which("chromedriver")
+            or "/opt/homebrew/bin/chromedriver"
+        )
+
+    @property
+    def graphql(self):
+        # Created on first use, from the oldest entry kept: the page loaded
+        # before the first get_network_logs call counts
+        if self._graphql is None:
+            self._graphql = GraphQLStream(self, since=self._performance_base)
+        return self._graphql
+
+    def set_resource_policy(self, policy):
+        """Blocks the requests `policy` rules out, from the next request on."""
+        self.resource_policy = policy
+        # CDP commands only reach the focused tab: every open tab gets its own
+        self.prepare_tab()
+        self.tabs.prepare()
+
+    def prepare_tab(self):
+        """Applies the resource policy to the focused tab, before it loads anything."""
+        if self.resource_policy:
+            self.resource_policy.apply(self.driver)
+
+    def _drain_performance_log(self):
+        with self._performance_lock:
+            entries = self.driver.get_log("performance")
+            for entry in entries:
+                self.scheduler.observe(entry["message"])
+                if self.resource_policy:
+                    self.resource_policy.observe(entry["message"])
+            self._performance_backlog.extend(entries)
+            self._trim_performance_log(
+                self._performance_base + len(self._performance_backlog) - self.PERFORMANCE_BACKLOG
+            )
+
+    def _trim_performance_log(self, position):
+        """Drops the entries before `position`."""
+        drop = position - self._performance_base
+        if drop > 0:
+            del self._performance_backlog[:drop]
+            self._performance_base += drop
+
+    def _performance_end(self):
+        """Position of the next entry chromedriver will log."""
+        self._drain_performance_log()
+        return self._performance_base + len(self._performance_backlog)
+
+    def watch_performance_log(self, reader, since=None):
+        """
+            Keeps the entries from `since` on for `reader`. By default that
+            is where the newest hold starts, or else the end of the log, so a
+            reader never sees what happened before it was asked for.
+        """
+        with self._performance_lock:
+            if since is None:
+                since = (
+                    self._performance_readers.get(self._performance_holds[-1])
+                    if self._performance_holds
+                    else None
+                )
+            if since is None:
+                since = self._performance_end()
+            self._performance_readers.setdefault(reader, max(since, self._performance_base))
+
+    def release_performance_log(self, reader):
+        """Stops keeping entries for `reader`; the ones no reader needs are dropped."""
+        with self._performance_lock:
+            self._performance_readers.pop(reader, None)
+            if reader in self._performance_holds:
+                self._performance_holds.remove(reader)
+            if self._performance_readers:
+                self._trim_performance_log(min(self._performance_readers.values()))
+            else:
+                self._trim_performance_log(
+                    self._performance_base + len(self._performance_backlog)
+                )
+
+    def hold_performance_log(self):
+        """
+            Marks the end of the log and keeps every entry from there on
+            until release_performance_log. Readers created in the meantime
+            start at the mark: take the hold before opening a page and its
+            readers see all of the page's requests and none of the ones
+            before.
+        """
+        with self._performance_lock:
+            hold = _LogHold()
+            self.watch_performance_log(hold, self._performance_end())
+            self._performance_holds.append(hold)
+            return hold
+
+    @contextmanager
+    def keep_performance_log(self, hold=None):
+        """
+            hold_performance_log for the length of the block, or the given
+            `hold` released when the block ends.
+        """
+        hold = hold or self.hold_performance_log()
+        try:
+            yield hold
+        finally:
+            self.release_performance_log(hold)
+
+    def performance_log(self, reader):
+        """
+            Chrome's performance log entries `reader` (a GraphQLStream, say)
+            hasn't read yet. Every reader has its own position, see
+            watch_performance_log; an entry is dropped once every reader has
+            read it, so no reader loses what another one filtered out.
+        """
+        with self._performance_lock:
+            self._drain_performance_log()
+            start = max(self._performance_readers.get(reader, 0), self._performance_base)
+            entries = self._performance_backlog[start - self._performance_base:]
+            self._performance_readers[reader] = self._performance_base + len(
+                self._performance_backlog
+            )
+            self._trim_performance_log(min(self._performance_readers.values()))
+            return entries
+
+    def resource_report(self):
+        """Requests loaded and blocked by the resource policy, with the bytes saved."""
+        if not self.resource_policy:
+            return None
+        self._drain_performance_log()
+        return self.resource_policy.report()
 
     def enable_network_logging(self):
         """Enable Network Logging using Chrome DevTools Protocol (CDP)."""
@@ -59,92 +236,105 @@ class Browser:
             print(f"❌ Error enabling network logging: {e}")
 
 
-    def get_network_logs(self):
-        """Retrieves GraphQL XHR network logs from Instagram and saves them to a file."""
-        try:
-            logs = self.driver.get_log("performance")  # Get browser performance logs
-            print(f"🔍 Captured {len(logs)} network events.")  
-            graphql_logs = []
-
-            for log_entry in logs:
-                try:
-                    log_message = json.loads(log_entry["message"])["message"]
-
-                    # ✅ Ensure log_message is valid
-                    if not log_message or not isinstance(log_message, dict):
-                        continue
-
-                    # ✅ Check if it's a network response event
-                    if log_message.get("method", "") == "Network.responseReceived":
-                        params = log_message.get("params", {})
-                        
-                        # ✅ Ensure params is valid
-                        if not params or not isinstance(params, dict):
-                            continue
-
-                        response_url = params.get("response", {}).get("url", "")
-                        resource_type = params.get("type", "")
-
-                        # ✅ Filter only **XHR requests**
-                        if resource_type != "XHR":
-                            continue  # Skip non-XHR requests
-
-                        print(f"🔗 Captured XHR Request: {response_url}")  # Debugging output
-
-                        # ✅ Filter only GraphQL requests
-                        if "graphql/query" in response_url:
-                            request_id = params.get("requestId")
-                            print(f"📡 GraphQL Request ID: {request_id}")  # Debugging output
-
-                            # Fetch full response using Chrome DevTools Protocol (CDP)
-                            raw_response = self.driver.execute_cdp_cmd(
-                                "Network.getResponseBody", {"requestId": request_id}
-                            )
-
-                            # ✅ Ensure raw_response is valid before parsing JSON
-                            if not raw_response or "body" not in raw_response:
-                                print(f"⚠️ Skipping empty response for {request_id}")
-                                continue
-
-                            graphql_data = json.loads(raw_response.get("body", "{}"))
-
-                            # ✅ Append raw GraphQL response to the list
-                            graphql_logs.append(graphql_data)
-
-                except Exception as e:
-                    print(f"⚠️ Skipping invalid log entry: {e}")
-                    continue  # Skip and continue with the next log
-
-            if graphql_logs:
-                print("✅ Extracted GraphQL XHR Post Data.")
-                
-                # ✅ Dump all responses to a JSON file
-                file_name = "graphql_logs.json"
-                with open(file_name, "w", encoding="utf-8") as file:
-                    json.dump(graphql_logs, file, indent=2)
-
-                print(f"📂 GraphQL responses saved to {file_name}")
-            else:
-                print("⚠️ No valid GraphQL logs found.")
-
-            return graphql_logs
-
-        except Exception as e:
-            print(f"❌ Error capturing GraphQL XHR response: {e}")
-            return []
+    def get_network_logs(self, file_name=None):
+        """
+            GraphQL responses finished since the last call, read through the
+            browser's GraphQLStream. Also written to `file_name` if given.
+        """
+        graphql_logs = [entry["body"] for entry in self.graphql.poll()]
+
+        if graphql_logs and file_name:
+            with open(file_name, "w", encoding="utf-8") as file:
+                json.dump(graphql_logs, file, indent=2)
+            print(f"📂 GraphQL responses saved to {file_name}")
+
+        return graphql_logs
+
+    def get_embedded_json(self, marker):
+        """Parses the JSON script tags the page shipped with that mention `marker`."""
+        texts = self.driver.execute_script(
+            "var marker = arguments[0];"
+            "return Array.prototype.slice.call("
+            "  document.querySelectorAll('script[type=\"application/json\"]')"
+            ").map(function(s) { return s.textContent; })"
+            ".filter(function(t) { return t.indexOf(marker) >= 0; });",
+            marker,
+        )
 
+        payloads = []
+        for text in texts or []:
+            try:
+                payloads.append(json.loads(text))
+            except ValueError:
+                continue
+        return payloads
 
     @property
     def page_height(self):
         return self.driver.execute_script("return document.body.scrollHeight")
 
+    def pace(self, kind="request"):
+        """
+            Waits for the scheduler's go-ahead before an action that sends
+            requests. Every few actions the performance log is read so a
+            throttled response slows the crawl down.
+        """
+        self._paced += 1
+        if self._paced % self.THROTTLE_CHECK_EVERY == 0:
+            self._drain_performance_log()
+        with self.metrics.stage("pace"):
+            self.scheduler.acquire(kind)
+
     def get(self, url):
+        self.pace("navigate")
         self.driver.get(url)
+        # A block shows on the navigation itself, back off before the next one
+        self._drain_performance_log()
 
     @property
     def current_url(self):
         return self.driver.current_url
 
+    def get_cookies(self):
+        return self.driver.get_cookies()
+
+    def set_cookies(self, cookies):
+        """Sets cookies through CDP, which works before the domain has been visited."""
+        cdp_cookies = []
+        for cookie in cookies:
+            cdp_cookie = {
+                "name": cookie["name"],
+                "value": cookie["value"],
+                "domain": cookie.get("domain", ".instagram.com"),
+                "path": cookie.get("path", "/"),
+                "secure": cookie.get("secure", True),
+                "httpOnly": cookie.get("httpOnly", False),
+            }
+            if cookie.get("expiry"):
+                cdp_cookie["expires"] = cookie["expiry"]
+            if cookie.get("sameSite"):
+                cdp_cookie["sameSite"] = cookie["sameSite"]
+            cdp_cookies.append(cdp_cookie)
+
+        self.driver.execute_cdp_cmd("Network.setCookies", {"cookies": cdp_cookies})
+
+    def get_local_storage(self):
+        return self.driver.execute_script(
+            "var items = {};"
+            "for (var i = 0; i < localStorage.length; i++) {"
+            "  var k = localStorage.key(i); items[k] = localStorage.getItem(k);"
+            "}"
+            "return items;"
+        )
+
+    def set_local_storage(self, items):
+        if items:
+            self.driver.execute_script(
+                "var items = arguments[0];"
+                "for (var k in items) { localStorage.setItem(k, items[k]); }",
+                items,
+            )
+
     def implicitly_wait(self, t):
         self.driver.implicitly_wait(t)
 
@@ -156,9 +346,12 @@ class Browser:
                 EC.presence_of_element_located((By.CSS_SELECTOR, css_selector))
             )
 
+        start = time.perf_counter()
         try:
             return obj.find_element(By.CSS_SELECTOR, css_selector)
         except NoSuchElementException:
+            # A miss costs the whole implicit wait
+            self.metrics.miss(css_selector, time.perf_counter() - start)
             return None
 
     def find(self, css_selector, elem=None, waittime=0):
@@ -172,33 +365,257 @@ class Browser:
         except TimeoutException:
             return None
 
+        start = time.perf_counter()
         try:
-            return obj.find_elements(By.CSS_SELECTOR, css_selector)
+            elems = obj.find_elements(By.CSS_SELECTOR, css_selector)
         except NoSuchElementException:
+            elems = None
+        if not elems:
+            self.metrics.miss(css_selector, time.perf_counter() - start)
+        return elems
+
+    def _record_wait(self, label, elapsed, timed_out):
+        stats = self.wait_stats.setdefault(
+            label, {"count": 0, "total_sec": 0.0, "max_sec": 0.0, "timeouts": 0}
+        )
+        stats["count"] += 1
+        stats["total_sec"] += elapsed
+        stats["max_sec"] = max(stats["max_sec"], elapsed)
+        if timed_out:
+            stats["timeouts"] += 1
+
+    def wait_until(self, condition, timeout=10, label=None, poll=0.1):
+        """
+            Polls `condition(driver)` until it returns something truthy or the
+            deadline passes. Returns that value, or None on timeout. Every call
+            is recorded in `wait_stats` under `label`.
+        """
+        label = label or getattr(condition, "__name__", "wait")
+        start = time.time()
+        timed_out = False
+        try:
+            return WebDriverWait(self.driver, timeout, poll_frequency=poll).until(
+                condition
+            )
+        except TimeoutException:
+            timed_out = True
             return None
+        finally:
+            self._record_wait(label, time.time() - start, timed_out)
+
+    def wait_for(self, css_selector, timeout=10, label=None):
+        """Waits for an element to be in the DOM; queried in JS so implicit waits don't apply."""
+        return self.wait_until(
+            lambda driver: driver.execute_script(
+                "return document.querySelector(arguments[0]);", css_selector
+            ),
+            timeout,
+            label or "element %s" % css_selector,
+        )
+
+    def wait_for_gone(self, css_selector, timeout=10, label=None):
+        return self.wait_until(
+            lambda driver: driver.execute_script(
+                "return !document.querySelector(arguments[0]);", css_selector
+            ),
+            timeout,
+            label or "gone %s" % css_selector,
+        )
+
+    def wait_for_change(self, probe, action=None, timeout=5, label="change"):
+        """
+            Runs `action` (if any) and waits until `probe()` returns something
+            different from what it returned before the action.
+        """
+        before = probe()
+        if action:
+            action()
+        return self.wait_until(lambda driver: probe() != before, timeout, label)
+
+    def wait_for_network_idle(self, idle=0.5, timeout=10, label="network_idle"):
+        """Returns once the page is loaded and no resource has finished for `idle` seconds."""
+        state = {"count": None, "since": time.time()}
+
+        def network_idle(driver):
+            count = driver.execute_script(
+                "return document.readyState === 'complete' ?"
+                " performance.getEntriesByType('resource').length : -1;"
+            )
+            now = time.time()
+            if count != state["count"]:
+                state["count"], state["since"] = count, now
+                return False
+            return count >= 0 and now - state["since"] >= idle
+
+        return self.wait_until(network_idle, timeout, label)
+
+    def xhr_mark(self, url_part):
+        """Number of XHR/fetch calls to `url_part` completed so far, see wait_for_xhr."""
+        return self.driver.execute_script(
+            "performance.setResourceTimingBufferSize(100000);"
+            "var part = arguments[0];"
+            "return performance.getEntriesByType('resource').filter(function(e) {"
+            "  return (e.initiatorType === 'xmlhttprequest' ||"
+            "          e.initiatorType === 'fetch') && e.name.indexOf(part) >= 0;"
+            "}).length;",
+            url_part,
+        )
+
+    def wait_for_xhr(self, url_part, after=0, timeout=10, label=None):
+        """Waits until more than `after` XHR/fetch calls to `url_part` have completed."""
+        return self.wait_until(
+            lambda driver: self.xhr_mark(url_part) > after,
+            timeout,
+            label or "xhr %s" % url_part,
+        )
+
+    def wait_report(self):
+        """Wait time per label, slowest first."""
+        report = {}
+        for label, stats in sorted(
+            self.wait_stats.items(), key=lambda item: -item[1]["total_sec"]
+        ):
+            report[label] = dict(
+                stats,
+                total_sec=round(stats["total_sec"], 3),
+                max_sec=round(stats["max_sec"], 3),
+            )
+        return report
+
+    def count(self, css_selector):
+        return self.driver.execute_script(
+            "return document.querySelectorAll(arguments[0]).length;", css_selector
+        )
+
+    def attrs(self, css_selector, name):
+        """One round trip for attribute `name` of every element matching the selector."""
+        return self.driver.execute_script(
+            "var name = arguments[1];"
+            "return Array.prototype.map.call("
+            "  document.querySelectorAll(arguments[0]),"
+            "  function(e) { return e.getAttribute(name); });",
+            css_selector,
+            name,
+        )
+
+    def extract(self, script, *args):
+        """Runs one of the `scripts` extractors and returns its JSON result."""
+        return self.driver.execute_script(script, *args)
+
+    def extract_when(self, script, ready, timeout=5, label="extract"):
+        """
+            Re-runs an extractor until `ready(result)` holds, so waiting and
+            reading share the same round trips. Returns the last result.
+        """
+        result = {}
+
+        def extracted(driver):
+            result["value"] = self.extract(script)
+            return ready(result["value"])
+
+        self.wait_until(extracted, timeout, label)
+        return result.get("value") or self.extract(script)
+
+    def extract_post(self, timeout=5):
+        return self.extract_when(
+            scripts.POST_MODAL,
+            lambda post: post["timestamp"],
+            timeout,
+            label="extract_post",
+        )
 
-    def scroll_down(self, wait=0.3):
+    def extract_comments(self):
+        return self.extract(scripts.POST_COMMENTS)
+
+    def extract_profile(self, timeout=20):
+        return self.extract_when(
+            scripts.PROFILE_HEADER,
+            lambda profile: len(profile["statistics"]) >= 3,
+            timeout,
+            label="extract_profile",
+        )
+
+    def grid_posts(self, css_selector):
+        """{href, pinned} of every grid cell matching `css_selector`."""
+        return self.extract(scripts.GRID_POSTS, css_selector)
+
+    def click_link(self, css_selector, href):
+        self.pace("click")
+        return self.extract(scripts.CLICK_LINK, css_selector, href)
+
+    def comments_page(self, buttons_css, timeout=3):
+        """
+            Comments rendered since the previous call, then clicks every
+            button of `buttons_css` and waits up to `timeout` for what they
+            load; see scripts.COMMENTS_PAGE. One round trip per page.
+        """
+        self.pace("click")
+        self.driver.set_script_timeout(timeout + 5)
+        start = time.time()
+        page = self.driver.execute_async_script(
+            scripts.COMMENTS_PAGE, int(timeout * 1000), buttons_css
+        )
+        self._record_wait("comments_page", time.time() - start, False)
+        return page
+
+    def new_rows(self, css_selector, timeout=3):
+        """
+            Rows (links) of `css_selector` rendered since the previous call, as
+            {href, title, img}; waits up to `timeout` for some, then scrolls the
+            last row into view. One round trip per call.
+        """
+        self.pace("scroll")
+        self.driver.set_script_timeout(timeout + 5)
+        start = time.time()
+        rows = self.driver.execute_async_script(
+            scripts.NEW_ROWS, css_selector, int(timeout * 1000)
+        )
+        self._record_wait("rows %s" % css_selector, time.time() - start, not rows)
+        return rows
+
+    def scroll_down(self, wait=0.3, timeout=5):
+        """Scrolls to the bottom and returns as soon as new content lands or the network goes quiet."""
+        self.pace("scroll")
+        height = self.page_height
         self.driver.execute_script("window.scrollTo(0, document.body.scrollHeight)")
-        randmized_sleep(wait)
+        grew = self.wait_until(
+            lambda driver: self.page_height > height, timeout=wait, label="scroll_grow"
+        )
+        if not grew:
+            self.wait_for_network_idle(idle=wait, timeout=timeout, label="scroll_idle")
 
     def scroll_up(self, offset=-1, wait=2):
+        """Scrolls up and waits up to `wait` for what that loads."""
+        self.pace("scroll")
         if offset == -1:
             self.driver.execute_script("window.scrollTo(0, 0)")
         else:
             self.driver.execute_script("window.scrollBy(0, -%s)" % offset)
-        randmized_sleep(wait)
+        self.wait_for_network_idle(idle=0.3, timeout=wait, label="scroll_up_idle")
 
     def js_click(self, elem):
+        self.pace("click")
         self.driver.execute_script("arguments[0].click();", elem)
 
     def open_new_tab(self, url):
-        self.driver.execute_script("window.open('%s');" %url)
-        self.driver.switch_to.window(self.driver.window_handles[1])
+        self.pace("navigate")
+        self._opener = self.driver.current_window_handle
+        before = set(self.driver.window_handles)
+        # Opened blank so the resource policy is in place before the page loads
+        self.driver.execute_script("window.open('about:blank');")
+        new = [h for h in self.driver.window_handles if h not in before]
+        self.driver.switch_to.window(new[0] if new else self.driver.window_handles[-1])
+        self.prepare_tab()
+        self.driver.execute_script("window.location.href = arguments[0];", url)
 
     def close_current_tab(self):
         self.driver.close()
 
-        self.driver.switch_to.window(self.driver.window_handles[0])
+        # Back to the tab that opened this one, not to whatever tab is first
+        opener = getattr(self, "_opener", None)
+        if opener not in self.driver.window_handles:
+            opener = self.driver.window_handles[0]
+        self.driver.switch_to.window(opener)
 
     def __del__(self):
         try:
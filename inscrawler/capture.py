@@ -0,0 +1,190 @@
+"""
+    Offline record/replay of captured GraphQL responses.
+
+    An archive is gzip-compressed NDJSON, one captured response per line:
+    {"ts", "url", "request_id", "status", "operation", "body"}. Every flush
+    of the recorder ends a gzip member, so the archive of a crawl that was
+    killed reads fine up to its last flush. Replaying an archive runs the
+    same parsers the crawler uses, without a browser.
+
+        python -m inscrawler.capture replay capture.ndjson.gz > posts.ndjson
+        python -m inscrawler.capture stats capture.ndjson.gz
+        python -m inscrawler.capture import graphql_logs.json capture.ndjson.gz
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+from collections import Counter
+from urllib.parse import parse_qs
+
+from .graphql import timeline_posts
+
+
+def operation_name(post_data=None, body=None):
+    """GraphQL operation of a request: the friendly name it was sent with, else the root data key."""
+    if post_data:
+        names = parse_qs(post_data).get("fb_api_req_friendly_name")
+        if names:
+            return names[0]
+    if isinstance(body, dict) and isinstance(body.get("data"), dict):
+        keys = list(body["data"].keys())
+        if keys:
+            return keys[0]
+    return None
+
+
+def is_truncated(path):
+    """Whether the archive's last gzip member was cut off, by a killed crawl say."""
+    with gzip.open(path, "rb") as f:
+        try:
+            while f.read(1 << 20):
+                pass
+        except EOFError:
+            return True
+    return False
+
+
+def repair_archive(path):
+    """Rewrites a truncated archive with its complete records; returns how many were kept."""
+    if not os.path.exists(path) or not is_truncated(path):
+        return None
+    tmp_path = path + ".tmp"
+    count = 0
+    with gzip.open(tmp_path, "wt", encoding="utf8") as f:
+        for entry in read_archive(path):
+            f.write(json.dumps(entry, separators=(",", ":")) + "\n")
+            count += 1
+    os.replace(tmp_path, path)
+    return count
+
+
+class CaptureRecorder(object):
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.count = 0
+        # Appending after a cut-off member would make the new records unreadable
+        kept = repair_archive(path)
+        if kept is not None:
+            sys.stderr.write("Repaired truncated archive %s, kept %d records\n" % (path, kept))
+
+    def record(self, body, url=None, request_id=None, status=None, operation=None):
+        entry = {
+            "ts": round(time.time(), 3),
+            "url": url,
+            "request_id": request_id,
+            "status": status,
+            "operation": operation or operation_name(body=body),
+            "body": body,
+        }
+        if self.file is None:
+            self.file = gzip.open(self.path, "at", encoding="utf8")
+        self.file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        self.count += 1
+
+    def flush(self):
+        """Ends the current gzip member: what was recorded so far survives a crash."""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_archive(*paths):
+    """Every record of the archives; a truncated last member yields its complete records."""
+    for path in paths:
+        with gzip.open(path, "rt", encoding="utf8") as f:
+            try:
+                for line in f:
+                    if not line.endswith("\n"):
+                        # Cut off mid-record
+                        break
+                    if line.strip():
+                        yield json.loads(line)
+            except EOFError:
+                sys.stderr.write("%s is truncated, read up to its last complete record\n" % path)
+
+
+def timeline_parser(entry):
+    posts, _ = timeline_posts(entry["body"])
+    return posts
+
+
+PARSERS = {"timeline": timeline_parser}
+
+
+def replay(paths, parsers=None, sink=None, operations=None):
+    """
+        Feeds every archived response through `parsers` (name -> fn(entry) ->
+        records) and passes each record to `sink(name, record)`. Returns
+        throughput stats for the run.
+    """
+    parsers = parsers or PARSERS
+    counts = Counter()
+    entries = 0
+    start = time.time()
+
+    for entry in read_archive(*paths):
+        if operations and entry.get("operation") not in operations:
+            continue
+        entries += 1
+        for name, parse in parsers.items():
+            for record in parse(entry) or []:
+                counts[name] += 1
+                if sink:
+                    sink(name, record)
+
+    elapsed = time.time() - start
+    return {
+        "entries": entries,
+        "records": dict(counts),
+        "seconds": round(elapsed, 4),
+        "entries_per_sec": round(entries / elapsed, 1) if elapsed else None,
+        "records_per_sec": round(sum(counts.values()) / elapsed, 1) if elapsed else None,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay captured GraphQL responses")
+    parser.add_argument("command", choices=["replay", "stats", "import"])
+    parser.add_argument("archives", nargs="+")
+    parser.add_argument("--operation", action="append", help="only replay these operations")
+    args = parser.parse_args(argv)
+
+    if args.command == "import":
+        # Convert an old graphql_logs.json dump into an archive
+        *sources, target = args.archives
+        with CaptureRecorder(target) as recorder:
+            for source in sources:
+                with open(source, encoding="utf8") as f:
+                    for body in json.load(f):
+                        recorder.record(body)
+        print("Imported %d responses into %s" % (recorder.count, target))
+        return
+
+    if args.command == "stats":
+        ops = Counter(e.get("operation") for e in read_archive(*args.archives))
+        for op, count in ops.most_common():
+            print("%8d  %s" % (count, op))
+        return
+
+    def sink(name, record):
+        sys.stdout.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    stats = replay(args.archives, sink=sink, operations=args.operation)
+    sys.stderr.write(json.dumps(stats) + "\n")
+
+
+if __name__ == "__main__":
+    main()
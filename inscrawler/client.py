@@ -0,0 +1,54 @@
+"""
+    Thin client of the crawl daemon (see daemon.py). It imports nothing but
+    the standard library, so a request starts in milliseconds and the crawl
+    runs in the daemon's warm, logged-in browsers.
+
+    The protocol is newline-delimited JSON over a Unix socket: one request
+    {"method", "args", "settings"}, answered by any number of {"record"}
+    lines and then one {"result"} or {"error"} line.
+"""
+import json
+import os
+import socket
+
+from .exceptions import DaemonError
+from .utils import state_path
+
+
+def socket_path():
+    """$INSCRAWLER_DAEMON, or daemon.sock in the state directory."""
+    return os.environ.get("INSCRAWLER_DAEMON") or state_path("daemon.sock")
+
+
+def request(message, path=None):
+    """Sends one request and yields the daemon's replies as they arrive."""
+    path = path or socket_path()
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError as e:
+        sock.close()
+        raise DaemonError("No crawl daemon listening on %s (%s)" % (path, e))
+
+    with sock, sock.makefile("rwb") as f:
+        f.write(json.dumps(message).encode("utf8") + b"\n")
+        f.flush()
+        for line in f:
+            yield json.loads(line)
+
+
+def call(method, *args, settings=None, on_record=None, path=None):
+    """
+        Runs InsCrawler.`method`(*args) in the daemon and returns its result.
+        Records of generator methods go to `on_record` as they stream in.
+    """
+    message = {"method": method, "args": args, "settings": settings}
+    for reply in request(message, path):
+        if "record" in reply:
+            if on_record:
+                on_record(reply["record"])
+        elif "error" in reply:
+            raise DaemonError(reply["error"])
+        elif "result" in reply:
+            return reply["result"]
+    raise DaemonError("The daemon closed the connection without a result")
@@ -0,0 +1,82 @@
+"""
+    Expands and reads the comments of the open post a page at a time.
+
+    Each round trip harvests the comments rendered since the previous one
+    and clicks every "load more" and "view replies" button at once, then
+    waits in the page for what they load. The comment pages the clicks
+    fetch are also read from the network capture. Comments are keyed by
+    their id (the permalink id in the page, the pk in the responses, which
+    are the same), and every new one goes to the sink right away. A comment
+    rendered without a permalink gets a made-up id in the page; it is
+    matched by author, text and time instead.
+"""
+from .graphql import comment_pages
+from .network import GraphQLStream
+
+MORE_BUTTONS = "button .glyphsSpriteCircle_add__outline__24__grey_9, .eo2As .EizgU"
+# Prefix of the ids scripts.COMMENTS_PAGE makes up for comments without a permalink
+SYNTHETIC_ID = "dom"
+
+
+def content_key(comment):
+    """Who said what, when; the same for a comment read in the page and in a response."""
+    text = " ".join((comment["comment"] or "").split())
+    # Page times have milliseconds, response times whole seconds
+    return comment["author"], text, (comment["timestamp"] or "")[:19]
+
+
+class CommentEngine(object):
+    def __init__(self, browser, sink, timeout=3, max_idle=2):
+        """
+            `sink(comment)` gets every new comment as {id, author, comment,
+            timestamp, parent}. Expansion ends when no button is left, or
+            after `max_idle` rounds that loaded nothing new.
+        """
+        self.browser = browser
+        self.sink = sink
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.seen = set()
+        # Content keys of every comment sent, and of those sent with a made-up id
+        self.contents = set()
+        self.synthetic = set()
+        self.stream = GraphQLStream(browser)
+
+    def emit(self, comments):
+        found = 0
+        for comment in comments:
+            key = content_key(comment)
+            if comment["id"].startswith(SYNTHETIC_ID):
+                if key in self.contents:
+                    continue
+                self.synthetic.add(key)
+            elif comment["id"] in self.seen or key in self.synthetic:
+                continue
+            self.seen.add(comment["id"])
+            self.contents.add(key)
+            self.sink(comment)
+            found += 1
+        return found
+
+    def harvest_network(self):
+        found = 0
+        for entry in self.stream.poll():
+            found += self.emit(comment_pages(entry["body"]))
+        return found
+
+    def run(self):
+        """Streams every comment of the post to the sink; returns how many there were."""
+        idle = 0
+        try:
+            while True:
+                page = self.browser.comments_page(MORE_BUTTONS, self.timeout)
+                found = self.emit(page["comments"])
+                found += self.harvest_network()
+                if not page["more"]:
+                    break
+                idle = 0 if found else idle + 1
+                if idle >= self.max_idle:
+                    break
+        finally:
+            self.stream.close()
+        return len(self.seen)
@@ -9,11 +9,14 @@ import time
 import traceback
 from builtins import open
 from time import sleep
+from urllib.parse import urljoin
 
 from tqdm import tqdm
 
 from .secret import secret
+from . import scripts
 from .browser import Browser
+from .capture import CaptureRecorder
 from .exceptions import RetryException
 from .fetch import fetch_caption
 from .fetch import fetch_comments
@@ -21,10 +24,22 @@ from .fetch import fetch_datetime
 from .fetch import fetch_imgs
 from .fetch import fetch_likers
 from .fetch import fetch_likes_plays
-from .fetch import fetch_details
+from .fetch import fetch_details_batch
+from .graphql import TIMELINE
+from .graphql import TIMELINE_OPERATIONS
+from .graphql import timeline_posts
+from .index import SeenIndex
+from .network import GraphQLStream
+from .output import NdjsonWriter
+from .profiles import DEFAULT_TTL
+from .profiles import ProfileCache
+from .resources import ResourcePolicy
+from .scheduler import Scheduler
+from .session import AUTH_COOKIE
+from .session import SessionStore
 from .utils import instagram_int
-from .utils import randmized_sleep
-from .utils import retry
+from .utils import merge_tag_posts
+from .utils import RetryPolicy
 
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
@@ -65,31 +80,108 @@ class Logging(object):
 
 
 class InsCrawler(Logging):
-    URL = "https://www.instagram.com"
+    # Overridable so the crawler can be pointed at a local fixture server
+    URL = os.environ.get("INSCRAWLER_URL", "https://www.instagram.com")
     RETRY_LIMIT = 10
-
-    def __init__(self, has_screen=False):
+    # Seconds the crawl of one handle or tag may spend retrying before retries give up
+    RETRY_BUDGET = 600
+    # Post links of a tag feed's grid
+    TAG_GRID_LINKS = "main a[href*='/p/'], main a[href*='/reel/']"
+
+    def __init__(
+        self,
+        has_screen=False,
+        use_session=True,
+        capture_path=None,
+        metrics_path=None,
+        resources=None,
+        block=None,
+        likers_path=None,
+        comments_path=None,
+        rate=None,
+        global_rate=None,
+        tabs=4,
+        profile_ttl=None,
+    ):
+        """
+            `resources` names the resource profile (see resources.PROFILES) whose
+            requests are blocked, `block` adds categories or URL patterns to it.
+            With `likers_path` and `comments_path`, likers and comments are
+            appended there as NDJSON while they are collected instead of being
+            kept on the posts. `rate` caps the navigations, scrolls and clicks
+            per second of this crawler, `global_rate` those of every crawler
+            on the machine (see scheduler.Scheduler). `tabs` is the number of
+            extra tabs post pages are loaded in side by side. Profiles are
+            served from the shared profile cache for `profile_ttl` seconds
+            (default profiles.DEFAULT_TTL, 0 turns the cache off).
+        """
         super(InsCrawler, self).__init__()
-        self.browser = Browser(has_screen)
+        policy = None
+        if resources or block:
+            policy = ResourcePolicy.for_profile(resources or "none", block)
+        scheduler = Scheduler(rate, global_rate=global_rate)
+        self.browser = Browser(has_screen, policy, scheduler, tabs)
         self.page_height = 0
-        self.login()
+        if capture_path:
+            self.browser.recorder = CaptureRecorder(capture_path)
+        # Where the run's metrics summary (and its .prom twin) is written
+        self.metrics_path = metrics_path
+        self.likers_writer = NdjsonWriter(likers_path) if likers_path else None
+        self.comments_writer = NdjsonWriter(comments_path) if comments_path else None
+        self.session = SessionStore(secret["username"]) if use_session else None
+        self.profile_cache = None
+        if profile_ttl != 0:
+            self.profile_cache = ProfileCache(ttl=profile_ttl or DEFAULT_TTL)
+        self.retry_policy = RetryPolicy(
+            attempts=InsCrawler.RETRY_LIMIT, budget=InsCrawler.RETRY_BUDGET
+        )
+
+        if not self.resume_session():
+            self.login()
+
+    def resume_session(self):
+        """Restores a saved login session, costing a single page load."""
+        if not self.session:
+            return False
 
-    def _dismiss_login_prompt(self):
+        browser = self.browser
         try:
-            # Wait for the pop-up if it appears
-            WebDriverWait(self.browser.driver, 5).until(
-                EC.element_to_be_clickable((By.XPATH, "//button[contains(text(), 'Not Now')]"))
-            ).click()
+            if not self.session.restore(browser, "%s/" % InsCrawler.URL):
+                return False
+        except Exception as e:
+            print(f"Could not restore saved session: {e}")
+            return False
+
+        # An expired session is redirected to the login page and loses its cookie
+        if "/accounts/login" in browser.current_url or not browser.driver.get_cookie(
+            AUTH_COOKIE
+        ):
+            print("Saved session expired, logging in again")
+            self.session.clear()
+            return False
+
+        print("Resumed saved login session")
+        return True
+
+    def _dismiss_login_prompt(self):
+        # Wait for the pop-up if it appears
+        not_now = self.browser.wait_until(
+            EC.element_to_be_clickable((By.XPATH, "//button[contains(text(), 'Not Now')]")),
+            timeout=5,
+            label="login_prompt",
+        )
+        if not_now:
+            not_now.click()
             print("Dismissed login prompt")
-        except TimeoutException:
+        else:
             print("No login prompt detected")
 
     def login(self):
         browser = self.browser
         try:
             url = "%s/accounts/login/" % (InsCrawler.URL)
-            browser.driver.get(url)
-            time.sleep(3)  # Add a delay to reduce bot detection
+            browser.get(url)
+            browser.wait_for('input[name="username"]', 10, label="login_form")
 
             # Enter Username :
             u_input = browser.find_one('input[name="username"]')
@@ -105,7 +197,7 @@ class InsCrawler(Logging):
                 EC.element_to_be_clickable((By.XPATH, "//button[@type='submit']"))
             )
             browser.driver.execute_script("arguments[0].click();", login_btn)
-            time.sleep(1)  # Wait before interacting with elements
+            browser.wait_for_network_idle(idle=0.5, timeout=5, label="login_submit")
             login_btn.click()
 
             # Block further login prompts
@@ -114,68 +206,63 @@ class InsCrawler(Logging):
         except Exception as e:
             print(f" Error in logging in : {e}")    
 
-        @retry()
+        @self.retry_policy.wrap(timeout=30)
         def check_login():
             if browser.find_one('input[name="username"]'):
                 raise RetryException()
 
         check_login()
 
-    def get_user_profile(self, username):
-        browser = self.browser
-        url = "%s/%s/" % (InsCrawler.URL, username)
-        browser.get(url)
-        
-        time.sleep(5)  # Ensures all elements load
-
-        try:
-            # Wait for the h2 tag that contains the username
-            WebDriverWait(browser.driver, 15).until(
-                EC.presence_of_element_located((By.TAG_NAME, "h2"))
-            )
-
-            # Extract h2
-            h2_element = browser.find_one("h2")
-
-            if h2_element:
-                # Extract the span inside h2
-                name_span = h2_element.find_element(By.TAG_NAME, "span")
-                profile_name = name_span.text if name_span else "N/A"
-            else:
-                profile_name = "N/A"
-
-            # Extract bio description
-            desc = browser.find_one(".-vDIg span")  
-            bio_text = desc.text if desc else "N/A"
+        if self.session:
+            self.session.save(browser)
 
-            # Extract profile picture
-            photo = browser.find_one("._6q-tv")
-            photo_url = photo.get_attribute("src") if photo else "N/A"
+    def get_user_profile(self, username, max_age=None):
+        """
+            The profile of `username`, from the profile cache if it was
+            fetched at most `max_age` seconds ago (default: the cache's ttl).
+        """
+        profile = self._cached_profile(username, max_age)
+        if profile is None:
+            profile = self._fetch_user_profile(username)
+        return profile
 
-            # Wait for statistics section (posts, followers, following)
-            WebDriverWait(browser.driver, 20).until(
-                EC.presence_of_element_located((By.CLASS_NAME, "xc3tme8"))
-            )
-            stats_section = browser.find_one(".xc3tme8")
+    def _cached_profile(self, username, max_age=None):
+        if not self.profile_cache or max_age == 0:
+            return None
+        return self.profile_cache.get(username, max_age)
 
-            if not stats_section:
-                raise ValueError("Profile statistics section not found")
+    def _fetch_user_profile(self, username):
+        self.browser.get("%s/%s/" % (InsCrawler.URL, username))
+        return self._read_user_profile(username)
 
-            statistics = [ele.text for ele in stats_section.find_elements(By.TAG_NAME, "span")]
+    def _read_user_profile(self, username, timeout=20):
+        """
+            The profile of the page the browser is on, cached when its
+            statistics were read. With `timeout=0` it is read once without
+            waiting, and None is returned if the header isn't there yet.
+        """
+        if timeout:
+            # Header, bio, photo and statistics in one round trip per poll
+            profile = self.browser.extract_profile(timeout)
+            if not profile["name"] and not profile["statistics"]:
+                raise ValueError("Profile elements did not load in time")
+        else:
+            profile = self.browser.extract(scripts.PROFILE_HEADER)
+            if not profile or len(profile["statistics"]) < 3:
+                return None
 
-            if len(statistics) < 3:
-                raise ValueError("Profile statistics did not load correctly")
+        profile_name = profile["name"] or "N/A"
+        bio_text = profile["desc"] or "N/A"
+        photo_url = profile["photo_url"] or "N/A"
 
+        statistics = profile["statistics"]
+        if len(statistics) >= 3:
             post_num, follower_num, following_num = statistics[:3]
-
-        except TimeoutException as e:
-            raise ValueError(f"Profile elements did not load in time: {e}")
-
-        except Exception as e:
-            print(f"Error retrieving profile details: {e}")
+        else:
+            print("Error retrieving profile details: Profile statistics did not load correctly")
             post_num, follower_num, following_num = "N/A", "N/A", "N/A"
 
-        return {
+        user_profile = {
             "name": profile_name,
             "desc": bio_text,
             "photo_url": photo_url,
@@ -183,6 +270,9 @@ class InsCrawler(Logging):
             "follower_num": follower_num,
             "following_num": following_num,
         }
+        if self.profile_cache and post_num != "N/A":
+            self.profile_cache.put(username, user_profile)
+        return user_profile
 
 
     def get_user_profile_from_script_shared_data(self, username):
@@ -206,22 +296,156 @@ class InsCrawler(Logging):
             "website": user_data["external_url"],
         }
 
-    def get_user_posts(self, handle, number=None, detail=False):
-        user_profile = self.get_user_profile(handle)
-        if not number:
-            number = instagram_int(user_profile["post_num"])
+    def get_user_posts(self, handle, number=None, detail=False, incremental=False):
+        """
+            With `incremental`, only posts not crawled by earlier incremental
+            runs are returned; crawling stops at the first known post below
+            which nothing is missing (see index.SeenIndex). A run cut short by
+            `number` is continued past its gap by the next one.
+        """
+        posts = list(self.iter_user_posts(handle, number, detail, incremental))
+        if detail and posts:
+            posts.sort(key=lambda post: post.get("datetime", ""), reverse=True)
+        return posts
+
+    def iter_user_posts(self, handle, number=None, detail=False, incremental=False):
+        """Same as get_user_posts, but yields every post as soon as it is extracted."""
+        self.retry_policy.reset_budget()
+        metrics = self.browser.metrics
+        # Opened before the profile page: the timeline stream reads the
+        # page's requests and none of what the browser loaded before
+        stream = None if detail else GraphQLStream(self.browser, TIMELINE_OPERATIONS)
+        with metrics.stage("profile"):
+            self.browser.get("%s/%s/" % (InsCrawler.URL, handle))
+            if number:
+                # Only the page is needed; the cache is refreshed if its header is already there
+                self._read_user_profile(handle, timeout=0)
+            else:
+                # A cached count may be older than the newest posts: read it from the page
+                number = instagram_int(self._read_user_profile(handle)["post_num"])
 
         self._dismiss_login_prompt()
 
+        known = SeenIndex(handle) if incremental else None
+
         if detail:
-            return self._get_posts_full(number)
+            posts = self._get_posts_full(number, handle, known)
         else:
-            return self._get_posts(number,handle)
+            posts = self._get_posts_from_network(number, handle, known, stream)
 
-    def get_latest_posts_by_tag(self, tag, num,handle):
-        url = "%s/explore/tags/%s/" % (InsCrawler.URL, tag)
-        self.browser.get(url)
-        return self._get_posts(num,handle)
+        metrics.start_post()
+        try:
+            for post in posts:
+                metrics.post_done()
+                if known is not None:
+                    known.add(post["key"])
+                yield post
+                metrics.start_post()
+        finally:
+            # Whatever was yielded before a crash still counts as seen
+            if known is not None:
+                known.save()
+            for writer in (self.likers_writer, self.comments_writer):
+                if writer:
+                    writer.sync()
+            self.export_metrics()
+
+    def export_metrics(self):
+        """
+            Writes the run's metrics, including where the browser spent its
+            waiting time, what the resource policy blocked, how the scheduler
+            paced it, what retries cost, how often the profile cache hit
+            and how much the tab pool overlapped page loads, to the crawl
+            log and, if set, to `metrics_path`.
+        """
+        waits = self.browser.wait_report()
+        resources = self.browser.resource_report()
+        scheduler = self.browser.scheduler.report()
+        retries = self.retry_policy.report()
+        profiles = self.profile_cache.report() if self.profile_cache else None
+        tabs = self.browser.tabs.report()
+        metrics = self.browser.metrics
+        self.log(
+            json.dumps(
+                {"metrics": metrics.summary(waits, resources, scheduler, retries, profiles, tabs)}
+            )
+        )
+        if self.metrics_path:
+            metrics.export(
+                self.metrics_path, waits, resources, scheduler, retries, profiles, tabs
+            )
+
+    def close(self):
+        """Closes the tab pool, the capture archive and the likers and comments files."""
+        try:
+            self.browser.tabs.close()
+        except Exception:
+            # The browser may be gone already; its tabs went with it
+            pass
+        if self.browser.recorder:
+            self.browser.recorder.close()
+        for writer in (self.likers_writer, self.comments_writer):
+            if writer:
+                writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def get_latest_posts_by_tag(self, tag, num, handle=None):
+        """The latest `num` posts of a tag feed; `handle` is ignored, tag feeds mix every poster."""
+        return list(self.iter_tag_posts(tag, num))
+
+    def get_posts_by_tags(self, tags, num):
+        """
+            Up to `num` posts of every tag, one record per post with all the
+            tags it was found under. Details are only fetched once per post.
+        """
+        seen = set()
+        posts = []
+        for tag in tags:
+            posts.extend(self.iter_tag_posts(tag, num, seen))
+        return merge_tag_posts(posts)
+
+    def iter_tag_posts(self, tag, num, seen=None):
+        """
+            Yields the posts of a tag feed as {"key", "img_url", "tags"} while
+            the grid loads, read straight off its links without opening any
+            post, and with fetch_details their poster, location and caption.
+            Posts whose key is in `seen` skip the details; new keys are added.
+        """
+        MAX_IDLE_ROWS = 3
+        self.retry_policy.reset_budget()
+        browser = self.browser
+        browser.get("%s/explore/tags/%s/" % (InsCrawler.URL, tag))
+        key_set = set()
+        idle = 0
+        pbar = tqdm(total=num)
+        pbar.set_description("#%s" % tag)
+
+        while len(key_set) < num and idle < MAX_IDLE_ROWS:
+            batch = []
+            for row in browser.new_rows(InsCrawler.TAG_GRID_LINKS, timeout=5):
+                key = urljoin(InsCrawler.URL + "/", row["href"] or "")
+                if key in key_set or len(key_set) >= num:
+                    continue
+                key_set.add(key)
+                batch.append({"key": key, "img_url": row.get("img") or "N/A", "tags": [tag]})
+
+            # The new rows' post pages load side by side in the tab pool
+            fetch_details_batch(
+                browser, [post for post in batch if seen is None or post["key"] not in seen]
+            )
+            for dict_post in batch:
+                if seen is not None:
+                    seen.add(dict_post["key"])
+                pbar.update(1)
+                yield dict_post
+            idle = 0 if batch else idle + 1
+
+        pbar.close()
 
     def auto_like(self, tag="", maximum=1000):
         self.login()
@@ -233,23 +457,24 @@ class InsCrawler(Logging):
         self.browser.get(url)
 
         ele_post = browser.find_one(".v1Nh3 a")
+        browser.pace("click")
         ele_post.click()
 
         for _ in range(maximum):
             heart = browser.find_one(".dCJp8 .glyphsSpriteHeart__outline__24__grey_9")
             if heart:
+                browser.pace("like")
                 heart.click()
-                randmized_sleep(2)
 
             left_arrow = browser.find_one(".HBoOv")
             if left_arrow:
+                browser.pace("click")
                 left_arrow.click()
-                randmized_sleep(2)
             else:
                 break
 
-    def _get_posts_full(self, num,handle):
-        @retry()
+    def _get_posts_full(self, num, handle, known=None):
+        @self.retry_policy.wrap(timeout=15)
         def check_next_post(cur_key):
             ele_a_datetime = browser.find_one(".eo2As .c-Yi7")
 
@@ -265,42 +490,62 @@ class InsCrawler(Logging):
         browser.implicitly_wait(1)
         browser.scroll_down()
         ele_post = browser.find_one(".v1Nh3 a")
+        # Every post's streams read the log from where the post was opened:
+        # the hold is taken before the click, and before each next post
+        hold = browser.hold_performance_log()
+        browser.pace("click")
         ele_post.click()
-        dict_posts = {}
+        seen_urls = set()
 
         pbar = tqdm(total=num)
         pbar.set_description("fetching")
         cur_key = None
 
-        all_posts = self._get_posts(num,handle)
+        all_posts = list(self._get_posts(num, handle, known))
+        num = min(num, len(all_posts))
+        pbar.total = num
         i = 1
 
         # Fetching all posts
         for _ in range(num):
             dict_post = {}
 
+            hold = hold or browser.hold_performance_log()
             # Fetching post detail
             try:
-                if(i < num):
-                    check_next_post(all_posts[i]['key'])
-                    i = i + 1
-
-                # Fetching datetime and url as key
-                ele_a_datetime = browser.find_one(".eo2As .c-Yi7")
-                cur_key = ele_a_datetime.get_attribute("href")
-                dict_post["key"] = cur_key
-                fetch_datetime(browser, dict_post)
-                fetch_imgs(browser, dict_post)
-                fetch_likes_plays(browser, dict_post)
-                fetch_likers(browser, dict_post)
-                fetch_caption(browser, dict_post)
-                fetch_comments(browser, dict_post)
-
-            except RetryException:
+                # The likers stream reads first; the comment pages the post
+                # loaded must still be there for the comments stream
+                with browser.keep_performance_log(hold):
+                    if(i < num):
+                        with browser.metrics.stage("next_post"):
+                            check_next_post(all_posts[i]['key'])
+                        i = i + 1
+
+                    # Fetching datetime and url as key
+                    ele_a_datetime = browser.find_one(".eo2As .c-Yi7")
+                    cur_key = ele_a_datetime.get_attribute("href")
+                    dict_post["key"] = cur_key
+                    fetch_datetime(browser, dict_post)
+                    fetch_imgs(browser, dict_post)
+                    fetch_likes_plays(browser, dict_post)
+                    fetch_likers(
+                        browser,
+                        dict_post,
+                        self.likers_writer.write if self.likers_writer else None,
+                    )
+                    fetch_caption(browser, dict_post)
+                    fetch_comments(
+                        browser,
+                        dict_post,
+                        self.comments_writer.write if self.comments_writer else None,
+                    )
+
+            except RetryException as e:
                 sys.stderr.write(
                     "\x1b[1;31m"
                     + "Failed to fetch the post: "
-                    + cur_key or 'URL not fetched'
+                    + (cur_key or "URL not fetched")
+                    + " (%s)" % e
                     + "\x1b[0m"
                     + "\n"
                 )
@@ -315,24 +560,118 @@ class InsCrawler(Logging):
                     + "\n"
                 )
                 traceback.print_exc()
+            hold = None
 
             self.log(json.dumps(dict_post, ensure_ascii=False))
-            dict_posts[browser.current_url] = dict_post
+            if known is not None and dict_post.get("key") in known:
+                # Crawled by an earlier run that stopped above a gap
+                continue
+            if browser.current_url not in seen_urls:
+                seen_urls.add(browser.current_url)
+                yield dict_post
 
             pbar.update(1)
 
+        if hold is not None:
+            # No post was fetched at all
+            browser.release_performance_log(hold)
         pbar.close()
-        posts = list(dict_posts.values())
-        if posts:
-            posts.sort(key=lambda post: post["datetime"], reverse=True)
-        return posts
 
 
 
-    def _get_posts(self, num,handle):
+    def _get_posts_from_network(self, num, handle, known=None, stream=None):
+        """
+        Builds post records from the timeline GraphQL payloads: the first page
+        embedded in the profile HTML, then the responses fired while scrolling.
+        No post modal is ever opened. Stops at the first non-pinned post that
+        `known` can stop at, and skips the other known posts. `stream` is a
+        timeline GraphQLStream opened before the profile page loaded.
+        """
+        MAX_IDLE_SCROLLS = 5
+        # Seconds a scroll gets to have a timeline page answered before only
+        # a request already on its way is waited for
+        XHR_WAIT = 2
+        browser = self.browser
+        # Requests in flight the long wait was already spent on
+        waited = set()
+        # Only timeline responses have their bodies fetched
+        stream = stream or GraphQLStream(browser, TIMELINE_OPERATIONS)
+        key_set = set()
+        pbar = tqdm(total=num)
+        pbar.set_description("fetching")
+
+        def collect(payloads):
+            """Returns the new posts and whether the timeline has more pages."""
+            new_posts = []
+            more = None
+            for payload in payloads:
+                page_posts, page_more = timeline_posts(payload, handle, InsCrawler.URL)
+                if not page_posts:
+                    continue
+                more = page_more
+                for post in page_posts:
+                    if known is not None and post["key"] in known:
+                        if not post.get("pinned") and known.stops_at(post["key"]):
+                            known.connect()
+                            return new_posts, False
+                        # Pinned, or crawled above a gap that is still open
+                        continue
+                    if post["key"] in key_set or len(key_set) >= num:
+                        continue
+                    key_set.add(post["key"])
+                    new_posts.append(post)
+            return new_posts, more
+
+        try:
+            new_posts, has_next = collect(browser.get_embedded_json(TIMELINE))
+            idle_scrolls = 0
+            while True:
+                for post in new_posts:
+                    pbar.update(1)
+                    yield post
+
+                if has_next is False:
+                    if known is not None:
+                        known.connect()
+                    break
+                if len(key_set) >= num:
+                    break
+
+                mark = browser.xhr_mark("graphql/query")
+                browser.scroll_down()
+                entries = []
+                if not browser.wait_for_xhr("graphql/query", after=mark, timeout=XHR_WAIT):
+                    entries = stream.poll()
+                    in_flight = set(stream.pending) - waited
+                    if in_flight:
+                        waited.update(in_flight)
+                        browser.wait_for_xhr("graphql/query", after=mark, timeout=10)
+                    elif not entries:
+                        # The scroll asked for nothing, the feed has ended (or
+                        # stalled); only has_next=False closes an index gap
+                        break
+                entries += stream.poll()
+                new_posts, more = collect(entry["body"] for entry in entries)
+                if more is not None:
+                    has_next = more
+
+                if not new_posts:
+                    idle_scrolls += 1
+                    if idle_scrolls >= MAX_IDLE_SCROLLS:
+                        break
+                else:
+                    idle_scrolls = 0
+        finally:
+            stream.close()
+
+        pbar.close()
+        print("✅ Done. Successfully fetched", len(key_set), "posts.")
+
+    def _get_posts(self, num, handle, known=None):
         """
         Extracts posts, including images, captions, collaborators, and timestamps.
         Ensures posts belong to the correct profile and prevents scraping from other profiles.
+        Stops at the first unpinned post `known` can stop at.
         """
         from selenium.webdriver.common.by import By
         from selenium.webdriver.support.ui import WebDriverWait
@@ -341,129 +680,98 @@ class InsCrawler(Logging):
         TIMEOUT = 600
         browser = self.browser
         key_set = set()
-        posts = []
         pre_post_num = 0
         wait_time = 1
+        reached_known = False
         pbar = tqdm(total=num)
 
-        profile_url_prefix = f"https://www.instagram.com/{handle}/"  # Ensure posts belong to the correct user
+        profile_url_prefix = f"{InsCrawler.URL}/{handle}/"  # Ensure posts belong to the correct user
+        MODAL_CLOSE = "div.x6s0dn4 svg[aria-label='Close']"
+        GRID_CELL = "div.x1lliihq"
 
         def close_post_modal():
             """Clicks the close button to close the post modal before navigating to the next post."""
             try:
                 close_button = WebDriverWait(browser.driver, 3).until(
-                    EC.element_to_be_clickable((By.CSS_SELECTOR, "div.x6s0dn4 svg[aria-label='Close']"))
+                    EC.element_to_be_clickable((By.CSS_SELECTOR, MODAL_CLOSE))
                 )
                 close_button.click()
                 print("✅ Closed post modal")
-                time.sleep(2)  # Allow time for the page to reset
+                browser.wait_for_gone(MODAL_CLOSE, 5, label="modal_close")
             except Exception as e:
                 print(f"⚠️ Warning: Close button not found or not clickable: {e}")
 
         def start_fetching(pre_post_num, wait_time):
             nonlocal num  # Ensure we track the remaining posts correctly
+            nonlocal reached_known
             scrolled = False  # Keep track if we need to scroll down
 
-            while len(posts) < num:
+            while len(key_set) < num:
                 # ✅ Find only posts that belong to the target profile
-                ele_posts = browser.find("div.x1lliihq")  # Updated selector for posts
-                print(f"DEBUG: Found {len(ele_posts)} posts on the page")  # Debugging output
+                grid_posts = browser.grid_posts(GRID_CELL)  # Updated selector for posts
+                print(f"DEBUG: Found {len(grid_posts)} posts on the page")  # Debugging output
 
-                for ele in ele_posts:
+                for grid_post in grid_posts:
+                    post_link = grid_post["href"]
                     try:
-                        # ✅ Extract post link and check if it belongs to the correct profile
-                        post_link = ele.find_element(By.TAG_NAME, "a").get_attribute("href")
-
-                        if not post_link.startswith(profile_url_prefix):  # Ensure it's from the target username
+                        if not post_link or not post_link.startswith(profile_url_prefix):  # Ensure it's from the target username
                             print(f"❌ Skipping non-profile post: {post_link}")
                             continue  # Skip posts from other profiles
 
+                        if known is not None and post_link in known:
+                            if not grid_post["pinned"] and known.stops_at(post_link):
+                                known.connect()
+                                reached_known = True
+                                return len(key_set), wait_time
+                            continue
+
                         if post_link not in key_set:
                             dict_post = {"key": post_link}
 
                             # ✅ Click to open the post modal
-                            browser.js_click(ele.find_element(By.TAG_NAME, "a"))
-                            time.sleep(2)  # Allow time for modal to open
-
-                            # ✅ Extract image inside the post
-                            try:
-                                img = WebDriverWait(browser.driver, 5).until(
-                                    EC.presence_of_element_located((By.CSS_SELECTOR, "div._aagv img"))
-                                )
-                                dict_post["img_url"] = img.get_attribute("src") if img else "N/A"
-                            except:
-                                dict_post["img_url"] = "N/A"
-
-                            # ✅ Extract timestamp (post date & time)
-                            try:
-                                time_elem = WebDriverWait(browser.driver, 5).until(
-                                    EC.presence_of_element_located((By.CSS_SELECTOR, "time.x1p4m5qa"))
-                                )
-                                dict_post["timestamp"] = time_elem.get_attribute("datetime")  # Format: 2025-02-02T09:57:16.000Z
-                            except Exception as e:
-                                print(f"Error extracting timestamp: {e}")
-                                dict_post["timestamp"] = "N/A"
-
-                            # ✅ Extract collaborators from the **header section** (`_aaqt _aaqu`)
-                            try:
-                                header_section = WebDriverWait(browser.driver, 5).until(
-                                    EC.presence_of_element_located((By.CSS_SELECTOR, "div._aaqt._aaqu"))
-                                )
-                                creator_links = header_section.find_elements(By.TAG_NAME, "a")
-                                creators = [link.text.strip() for link in creator_links if link.text.strip()]  # Get account names
-                            except Exception as e:
-                                print(f"Error extracting creators from header: {e}")
-                                creators = []
-
-                            # ✅ Extract caption (within post modal)
-                            try:
-                                caption_elem = WebDriverWait(browser.driver, 5).until(
-                                    EC.presence_of_element_located((By.CSS_SELECTOR, "div.xt0psk2 h1"))
-                                )
-                                dict_post["caption"] = caption_elem.text if caption_elem else "N/A"
-
-                                # ✅ Extract @mentions inside the caption
-                                collab_links = caption_elem.find_elements(By.TAG_NAME, "a")
-                                mentioned_collaborators = [link.text.strip() for link in collab_links if link.text.startswith("@")]
-
-                            except Exception as e:
-                                print(f"Error extracting caption or mentions: {e}")
-                                dict_post["caption"] = "N/A"
-                                mentioned_collaborators = []
+                            browser.click_link(GRID_CELL, post_link)
+
+                            # ✅ Extract image, timestamp, header creators, caption and
+                            # its @mentions in one round trip once the modal is up
+                            extracted = browser.extract_post()
+                            dict_post["img_url"] = extracted["img_url"] or "N/A"
+                            dict_post["timestamp"] = extracted["timestamp"] or "N/A"  # Format: 2025-02-02T09:57:16.000Z
+                            dict_post["caption"] = extracted["caption"] or "N/A"
 
                             # ✅ Ensure unique collaborators (avoid duplicates)
-                            dict_post["collaborators"] = list(set(creators + mentioned_collaborators))  # Remove duplicates
+                            dict_post["collaborators"] = list(set(extracted["creators"] + extracted["mentions"]))  # Remove duplicates
 
                             # ✅ Close the post modal before moving to the next post
                             close_post_modal()
 
                             key_set.add(dict_post["key"])
-                            posts.append(dict_post)
+                            yield dict_post
 
-                            if len(posts) >= num:
+                            if len(key_set) >= num:
                                 return pre_post_num, wait_time  # Stop if we reached the required number
 
                     except Exception as e:
                         print(f"Error extracting post data: {e}")
 
                 # ✅ Scroll down if we need more posts
-                if len(posts) < num and not scrolled:
+                if len(key_set) < num and not scrolled:
                     browser.scroll_down()
-                    time.sleep(2)
                     scrolled = True  # Ensure we don't scroll too frequently
 
             return pre_post_num, wait_time
 
         pbar.set_description("fetching")
-        while len(posts) < num and wait_time < TIMEOUT:
-            post_num, wait_time = start_fetching(pre_post_num, wait_time)
+        while len(key_set) < num and wait_time < TIMEOUT:
+            post_num, wait_time = yield from start_fetching(pre_post_num, wait_time)
             pbar.update(post_num - pre_post_num)
             pre_post_num = post_num
 
+            if reached_known:
+                break
+
             loading = browser.find_one(".W1Bne")
             if not loading and wait_time > TIMEOUT / 2:
                 break
 
         pbar.close()
-        print("✅ Done. Successfully fetched", len(posts), "posts.")
-        return posts[:num]
+        print("✅ Done. Successfully fetched", len(key_set), "posts.")
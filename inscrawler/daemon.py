@@ -0,0 +1,332 @@
+"""
+    Long-lived crawl daemon with warm browsers.
+
+    The daemon starts its worker processes once, each with one logged-in
+    InsCrawler (see pool._worker), and serves crawl requests from thin
+    clients (client.py, crawler.py --daemon) on a Unix socket. A request
+    skips the imports, the chromedriver start and the login, and only pays
+    for the crawl itself. Requests queue for the next free browser; records
+    stream back to the client while they are crawled.
+
+        python -m inscrawler.daemon serve -w 2
+        python crawler.py profile -u cal_foodie --daemon
+        python -m inscrawler.daemon status
+        python -m inscrawler.daemon stop
+"""
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import queue
+import socketserver
+import sys
+import threading
+import time
+from collections import deque
+
+from .client import call
+from .client import socket_path
+from .exceptions import DaemonError
+from .pool import LIVENESS_CHECK
+from .pool import lost_workers
+from .pool import start_worker
+from .settings import dump_settings
+
+# InsCrawler methods a client may run
+METHODS = {
+    "get_user_profile",
+    "get_user_profile_from_script_shared_data",
+    "get_user_posts",
+    "iter_user_posts",
+    "get_latest_posts_by_tag",
+    "get_posts_by_tags",
+    "iter_tag_posts",
+}
+
+
+class CrawlDaemon(object):
+    def __init__(self, workers=1, has_screen=False, path=None, **crawler_kwargs):
+        self.workers = max(1, workers)
+        self.has_screen = has_screen
+        self.path = path or socket_path()
+        self.crawler_kwargs = crawler_kwargs
+        self.results = multiprocessing.Queue()
+        # request id -> queue of the worker results for that request
+        self.channels = {}
+        # Every worker has a task queue of its own, so a killed worker can't
+        # take a lock the others need down with it; tasks wait here for the
+        # next free worker
+        self.backlog = deque()
+        self.inboxes = {}
+        self.free = []
+        # worker id -> the request handed to it; workers that got ready since
+        # they were (re)started; workers that are gone for good
+        self.running = {}
+        self.warm = set()
+        self.finished = set()
+        self.procs = {}
+        self.alive = 0
+        self.served = 0
+        self.started = time.time()
+        self.server = None
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def start_workers(self):
+        for worker_id in range(self.workers):
+            self._start(worker_id)
+        self.alive = self.workers
+        threading.Thread(target=self._dispatch, daemon=True).start()
+
+    def _start(self, worker_id):
+        self.inboxes[worker_id] = multiprocessing.Queue()
+        self.procs[worker_id] = start_worker(
+            worker_id,
+            self.inboxes[worker_id],
+            self.results,
+            self.has_screen,
+            dump_settings(),
+            self.crawler_kwargs,
+            daemon=True,
+        )
+        self._release(worker_id)
+
+    def _assign(self, worker_id, task):
+        self.running[worker_id] = task[3]
+        self.inboxes[worker_id].put(task)
+
+    def _release(self, worker_id):
+        """The worker is free: it takes the oldest waiting task, if any."""
+        with self._lock:
+            self.running.pop(worker_id, None)
+            if self.backlog:
+                self._assign(worker_id, self.backlog.popleft())
+            else:
+                self.free.append(worker_id)
+
+    def _dispatch(self):
+        """Routes every worker result to the request it answers."""
+        while True:
+            try:
+                status, worker_id, task, result, elapsed = self.results.get(
+                    timeout=LIVENESS_CHECK
+                )
+            except queue.Empty:
+                for worker_id in lost_workers(self.procs, self.finished, self.results):
+                    self._lost(worker_id)
+                continue
+
+            if status in ("done", "dead"):
+                self._gone(worker_id, status)
+                continue
+
+            if status == "ready":
+                self.warm.add(worker_id)
+                continue
+            if status == "start":
+                continue
+
+            request_id = task[3]
+            with self._lock:
+                channel = self.channels.get(request_id)
+                if status != "record":
+                    self.channels.pop(request_id, None)
+            if status != "record":
+                self._release(worker_id)
+            if channel is not None:
+                channel.put((status, result, elapsed))
+
+    def _gone(self, worker_id, status):
+        self.finished.add(worker_id)
+        self._unassign(worker_id, "the crawler didn't start, see the daemon's log")
+        self.alive -= 1
+        sys.stderr.write("Worker %d %s, %d left\n" % (worker_id, status, self.alive))
+        if not self.alive:
+            self._fail_all("no crawler left in the daemon")
+
+    def _lost(self, worker_id):
+        """
+            The worker's process exited without a word (killed, out of
+            memory, segfault): its request fails and a fresh worker takes
+            its place, unless it died before it got ready.
+        """
+        sys.stderr.write(
+            "Worker %d died (exit code %s)\n" % (worker_id, self.procs[worker_id].exitcode)
+        )
+        if worker_id not in self.warm:
+            # Like a worker that failed to start: restarting would fail the same way
+            self._gone(worker_id, "dead")
+            return
+        self.warm.discard(worker_id)
+        self._unassign(worker_id, "the crawler died, see the daemon's log")
+        self._start(worker_id)
+
+    def _unassign(self, worker_id, reason):
+        """Takes the worker off the free list and fails the request handed to it."""
+        with self._lock:
+            if worker_id in self.free:
+                self.free.remove(worker_id)
+            request_id = self.running.pop(worker_id, None)
+            channel = self.channels.pop(request_id, None)
+        if channel is not None:
+            channel.put(("error", reason, 0))
+
+    def _fail_all(self, reason):
+        with self._lock:
+            channels, self.channels = self.channels, {}
+            self.backlog.clear()
+        for channel in channels.values():
+            channel.put(("error", reason, 0))
+
+    def submit(self, method, args, settings=None):
+        """Queues a crawl; returns its id and the queue its results arrive on."""
+        if not self.alive:
+            raise DaemonError("no crawler left in the daemon")
+        with self._lock:
+            request_id = next(self._ids)
+            channel = self.channels[request_id] = queue.Queue()
+            task = (method, tuple(args), settings, request_id)
+            if self.free:
+                self._assign(self.free.pop(0), task)
+            else:
+                self.backlog.append(task)
+        return request_id, channel
+
+    def abandon(self, request_id):
+        """The client is gone: the crawl still finishes, its records are dropped."""
+        with self._lock:
+            self.channels.pop(request_id, None)
+
+    def status(self):
+        return {
+            "pid": os.getpid(),
+            "workers": self.workers,
+            "alive": self.alive,
+            "in_flight": len(self.channels),
+            "waiting": len(self.backlog),
+            "served": self.served,
+            "uptime_sec": round(time.time() - self.started, 1),
+        }
+
+    def serve_forever(self):
+        if os.path.exists(self.path):
+            try:
+                call("status", path=self.path)
+            except DaemonError:
+                # Left behind by a daemon that didn't shut down cleanly
+                os.remove(self.path)
+            else:
+                raise DaemonError("A daemon is already listening on %s" % self.path)
+
+        self.start_workers()
+        self.server = socketserver.ThreadingUnixStreamServer(self.path, make_handler(self))
+        self.server.daemon_threads = True
+        sys.stderr.write("Crawl daemon listening on %s\n" % self.path)
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            for inbox in self.inboxes.values():
+                inbox.put(None)
+            for proc in self.procs.values():
+                proc.join(30)
+                if proc.is_alive():
+                    proc.terminate()
+
+    def stop(self):
+        # shutdown() waits for serve_forever to return, so not from a handler thread
+        threading.Thread(target=self.server.shutdown).start()
+
+
+def make_handler(daemon):
+    class Handler(socketserver.StreamRequestHandler):
+        def reply(self, message):
+            self.wfile.write(json.dumps(message, ensure_ascii=False).encode("utf8") + b"\n")
+
+        def handle(self):
+            try:
+                message = json.loads(self.rfile.readline())
+            except ValueError:
+                return self.reply({"error": "bad request"})
+
+            method = message.get("method")
+            if method == "status":
+                return self.reply({"result": daemon.status()})
+            if method == "stop":
+                self.reply({"result": "stopping"})
+                return daemon.stop()
+            if method not in METHODS:
+                return self.reply({"error": "unknown method %s" % method})
+
+            try:
+                request_id, channel = daemon.submit(
+                    method, message.get("args") or [], message.get("settings")
+                )
+            except DaemonError as e:
+                return self.reply({"error": str(e)})
+
+            try:
+                while True:
+                    status, result, elapsed = channel.get()
+                    if status == "record":
+                        self.reply({"record": result})
+                        continue
+                    if status == "ok":
+                        self.reply({"result": result, "seconds": round(elapsed, 3)})
+                    else:
+                        self.reply({"error": result or "%s failed, see the daemon's log" % method})
+                    break
+            except OSError:
+                daemon.abandon(request_id)
+            daemon.served += 1
+
+    return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Crawl daemon with warm, logged-in browsers")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    serve = commands.add_parser("serve", help="start the daemon in the foreground")
+    serve.add_argument("-w", "--workers", type=int, default=1, help="number of browsers")
+    serve.add_argument("--rate", type=float, help="navigations, scrolls and clicks per second per browser")
+    serve.add_argument("--global_rate", type=float, help="the same, shared by every crawler on this machine")
+    serve.add_argument("--tabs", type=int, default=4, help="tabs per browser for post pages")
+    serve.add_argument("--resources", help="resource profile to block requests by")
+    serve.add_argument("--block", help="resource categories or URL patterns to block as well")
+    serve.add_argument("--profile_ttl", type=int, help="seconds a profile is served from the profile cache")
+    serve.add_argument("--debug", action="store_true")
+
+    commands.add_parser("status", help="workers, requests in flight and uptime")
+    commands.add_parser("stop", help="stop the daemon and its browsers")
+
+    args = parser.parse_args(argv)
+
+    try:
+        if args.command == "serve":
+            CrawlDaemon(
+                args.workers,
+                args.debug,
+                rate=args.rate,
+                global_rate=args.global_rate,
+                tabs=args.tabs,
+                resources=args.resources,
+                block=args.block,
+                profile_ttl=args.profile_ttl,
+            ).serve_forever()
+        else:
+            print(json.dumps(call(args.command)))
+    except DaemonError as e:
+        sys.stderr.write("%s\n" % e)
+        return 1
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,2 +1,6 @@
 class RetryException(Exception):
     pass
+
+
+class DaemonError(Exception):
+    pass
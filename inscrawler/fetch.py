@@ -1,6 +1,9 @@
 import re
-from time import sleep
 
+from . import scripts
+from .comments import CommentEngine
+from .likers import LikersCollector
+from .metrics import timed_stage
 from .settings import settings
 
 
@@ -33,33 +36,37 @@ def fetch_hashtags(raw_test, dict_obj):
         dict_obj["hashtags"] = hashtags
 
 
+@timed_stage()
 def fetch_datetime(browser, dict_post):
     ele_datetime = browser.find_one(".eo2As .c-Yi7 ._1o9PC")
     datetime = ele_datetime.get_attribute("datetime")
     dict_post["datetime"] = datetime
 
 
+@timed_stage()
 def fetch_imgs(browser, dict_post):
     img_urls = set()
     while True:
-        ele_imgs = browser.find("._97aPb img", waittime=10)
-
-        if isinstance(ele_imgs, list):
-            for ele_img in ele_imgs:
-                img_urls.add(ele_img.get_attribute("src"))
-        else:
+        if not browser.wait_for("._97aPb img", 10, label="post_imgs"):
             break
 
+        img_urls.update(browser.attrs("._97aPb img", "src"))
+
         next_photo_btn = browser.find_one("._6CZji .coreSpriteRightChevron")
 
         if next_photo_btn:
-            next_photo_btn.click()
-            sleep(0.3)
+            browser.wait_for_change(
+                lambda: browser.attrs("._97aPb img", "src"),
+                next_photo_btn.click,
+                timeout=3,
+                label="carousel_next",
+            )
         else:
             break
 
     dict_post["img_urls"] = list(img_urls)
 
+@timed_stage()
 def fetch_likes_plays(browser, dict_post):
     if not settings.fetch_likes_plays:
         return
@@ -84,113 +91,108 @@ def fetch_likes_plays(browser, dict_post):
     )
 
 
-def fetch_likers(browser, dict_post):
+@timed_stage()
+def fetch_likers(browser, dict_post, sink=None):
+    """
+        Without a sink the likers are stored on the post. With one, each
+        liker is written out as {"key", "username"} the moment it is found
+        and the post only keeps their count.
+    """
     if not settings.fetch_likers:
         return
     like_info_btn = browser.find_one(".EDfFK ._0mzm-.sqdOP")
+    if not like_info_btn:
+        return
+    browser.pace("click")
     like_info_btn.click()
 
-    likers = {}
-    liker_elems_css_selector = ".Igw0E ._7UhW9.xLCgt a"
-    likers_elems = list(browser.find(liker_elems_css_selector))
-    last_liker = None
-    while likers_elems:
-        for ele in likers_elems:
-            likers[ele.get_attribute("href")] = ele.get_attribute("title")
+    likers = []
 
-        if last_liker == likers_elems[-1]:
-            break
+    def on_liker(username):
+        if sink:
+            sink({"key": dict_post.get("key"), "username": username})
+        else:
+            likers.append(username)
 
-        last_liker = likers_elems[-1]
-        last_liker.location_once_scrolled_into_view
-        sleep(0.6)
-        likers_elems = list(browser.find(liker_elems_css_selector))
+    count = LikersCollector(browser, on_liker).run()
 
-    dict_post["likers"] = list(likers.values())
+    if sink:
+        dict_post["likers_count"] = count
+    else:
+        dict_post["likers"] = likers
     close_btn = browser.find_one(".WaOAr button")
-    close_btn.click()
+    if close_btn:
+        close_btn.click()
 
 
+@timed_stage()
 def fetch_caption(browser, dict_post):
-    ele_comments = browser.find(".eo2As .gElp9")
+    caption = browser.extract_comments()["caption"]
 
-    if len(ele_comments) > 0:
-
-        temp_element = browser.find("span",ele_comments[0])
-
-        for element in temp_element:
-
-            if element.text not in ['Verified',''] and 'caption' not in dict_post:
-                dict_post["caption"] = element.text
+    if caption is not None:
+        if "caption" not in dict_post:
+            dict_post["caption"] = caption
 
         fetch_mentions(dict_post.get("caption",""), dict_post)
         fetch_hashtags(dict_post.get("caption",""), dict_post)
 
 
-def fetch_comments(browser, dict_post):
+@timed_stage()
+def fetch_comments(browser, dict_post, sink=None):
+    """
+        Without a sink the comments are stored on the post. With one, each
+        comment is written out with the post's key as soon as its page
+        loads and the post only keeps their count.
+    """
     if not settings.fetch_comments:
         return
 
-    show_more_selector = "button .glyphsSpriteCircle_add__outline__24__grey_9"
-    show_more = browser.find_one(show_more_selector)
-    while show_more:
-        show_more.location_once_scrolled_into_view
-        show_more.click()
-        sleep(0.3)
-        show_more = browser.find_one(show_more_selector)
-
-    show_comment_btns = browser.find(".EizgU")
-    for show_comment_btn in show_comment_btns:
-        show_comment_btn.location_once_scrolled_into_view
-        show_comment_btn.click()
-        sleep(0.3)
-
-    ele_comments = browser.find(".eo2As .gElp9")
     comments = []
-    for els_comment in ele_comments[1:]:
-        author = browser.find_one(".FPmhX", els_comment).text
-
-        temp_element = browser.find("span", els_comment)
-
-        for element in temp_element:
-
-            if element.text not in ['Verified','']:
-                comment = element.text
-
-        comment_obj = {"author": author, "comment": comment}
 
+    def on_comment(comment_obj):
+        comment = comment_obj["comment"] or ""
         fetch_mentions(comment, comment_obj)
         fetch_hashtags(comment, comment_obj)
+        if sink:
+            sink(dict(comment_obj, key=dict_post.get("key")))
+        else:
+            comments.append(comment_obj)
 
-        comments.append(comment_obj)
+    count = CommentEngine(browser, on_comment).run()
 
-    if comments:
+    if sink:
+        dict_post["comments_count"] = count
+    elif comments:
         dict_post["comments"] = comments
 
 
-def fetch_initial_comment(browser, dict_post):
-    comments_elem = browser.find_one("ul.XQXOT")
-    first_post_elem = browser.find_one(".ZyFrc", comments_elem)
-    caption = browser.find_one("span", first_post_elem)
-
-    if caption:
-        dict_post["description"] = caption.text
-
-
+@timed_stage()
 def fetch_details(browser, dict_post):
-    if not settings.fetch_details:
-        return
-
-    browser.open_new_tab(dict_post["key"])
+    fetch_details_batch(browser, [dict_post])
 
-    username = browser.find_one("a.ZIAjV")
-    location = browser.find_one("a.O4GlU")
 
-    if username:
-        dict_post["username"] = username.text
-    if location:
-        dict_post["location"] = location.text
-
-    fetch_initial_comment(browser, dict_post)
+@timed_stage()
+def fetch_details_batch(browser, posts, timeout=10):
+    """
+        Poster, location and caption of every post, read from the post pages
+        loaded side by side in the browser's tab pool.
+    """
+    if not settings.fetch_details or not posts:
+        return
 
-    browser.close_current_tab()
+    by_key = {post["key"]: post for post in posts}
+    for key, details in browser.tabs.map(
+        list(by_key),
+        scripts.POST_DETAILS,
+        ready=lambda details: details and details["username"],
+        timeout=timeout,
+    ):
+        if not details:
+            continue
+        dict_post = by_key[key]
+        if details["username"]:
+            dict_post["username"] = details["username"]
+        if details["location"]:
+            dict_post["location"] = details["location"]
+        if details["description"]:
+            dict_post["description"] = details["description"]
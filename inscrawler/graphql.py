@@ -0,0 +1,159 @@
+"""
+    Parsers for the GraphQL payloads Instagram's web client loads, either from
+    captured XHR responses or from the JSON embedded in the page on load.
+"""
+import re
+import time
+
+TIMELINE = "xdt_api__v1__feed__user_timeline_graphql_connection"
+
+# Operations that carry timeline pages: the friendly names the profile
+# grid sends its requests with, and the root key of their responses
+TIMELINE_OPERATIONS = {
+    TIMELINE,
+    "PolarisProfilePostsQuery",
+    "PolarisProfilePostsTabContentQuery_connection",
+}
+
+# Comment pages of a post, and the replies of one comment
+COMMENTS = "xdt_api__v1__media__media_id__comments__connection"
+CHILD_COMMENTS = (
+    "xdt_api__v1__media__media_id__comments__parent_comment_id__child_comments__connection"
+)
+
+BASE_URL = "https://www.instagram.com"
+
+MEDIA_TYPES = {1: "image", 2: "video", 8: "carousel"}
+
+MENTION_RE = re.compile(r"@([\w\.]+)")
+
+
+def find_connections(obj, name):
+    """Yields every value stored under the key `name`, however deeply nested."""
+    stack = [obj]
+    while stack:
+        cur = stack.pop()
+        if isinstance(cur, dict):
+            for key, value in cur.items():
+                if key == name:
+                    if value:
+                        yield value
+                elif isinstance(value, (dict, list)):
+                    stack.append(value)
+        elif isinstance(cur, list):
+            stack.extend(cur)
+
+
+def iter_nodes(connection):
+    for edge in connection.get("edges") or []:
+        node = edge.get("node")
+        if node:
+            yield node
+
+
+def has_next_page(connection):
+    page_info = connection.get("page_info") or {}
+    return bool(page_info.get("has_next_page"))
+
+
+def _iso_time(timestamp):
+    if not timestamp:
+        return "N/A"
+    return time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime(timestamp))
+
+
+def _best_image(media):
+    candidates = (media.get("image_versions2") or {}).get("candidates") or []
+    if not candidates:
+        return None
+    best = max(candidates, key=lambda c: c.get("width", 0) * c.get("height", 0))
+    return best.get("url")
+
+
+def post_url(node, handle=None, base_url=BASE_URL):
+    handle = handle or (node.get("user") or {}).get("username")
+    kind = "reel" if node.get("product_type") == "clips" else "p"
+    return "%s/%s/%s/%s/" % (base_url, handle, kind, node.get("code"))
+
+
+def post_from_node(node, handle=None, base_url=BASE_URL):
+    """
+        Builds a post record with the same fields as InsCrawler._get_posts,
+        plus the media fields save_to_db.py expects.
+    """
+    caption = node.get("caption") or {}
+    caption_text = caption.get("text") or "N/A"
+
+    medias = node.get("carousel_media") or [node]
+    img_urls = [url for url in (_best_image(m) for m in medias) if url]
+
+    # Same convention as the modal scraper: header accounts are bare
+    # usernames and caption mentions keep their "@"
+    creators = [u.get("username") for u in node.get("coauthor_producers") or []]
+    tagged = [
+        (tag.get("user") or {}).get("username")
+        for tag in (node.get("usertags") or {}).get("in") or []
+    ]
+    mentions = ["@" + m for m in MENTION_RE.findall(caption_text)]
+    collaborators = []
+    for name in creators + tagged + mentions:
+        if name and name not in collaborators:
+            collaborators.append(name)
+
+    post = {
+        "key": post_url(node, handle, base_url),
+        "img_url": img_urls[0] if img_urls else "N/A",
+        "img_urls": img_urls,
+        "timestamp": _iso_time(node.get("taken_at") or caption.get("created_at")),
+        "caption": caption_text,
+        "collaborators": collaborators,
+        "media_id": node.get("pk") or node.get("id"),
+        "code": node.get("code"),
+        "media_type": MEDIA_TYPES.get(node.get("media_type"), "image"),
+        "likes": node.get("like_count") or 0,
+        "comment_count": node.get("comment_count") or 0,
+    }
+
+    if node.get("timeline_pinned_user_ids"):
+        post["pinned"] = True
+
+    views = node.get("play_count") or node.get("view_count")
+    if views:
+        post["views"] = views
+
+    return post
+
+
+def timeline_posts(payload, handle=None, base_url=BASE_URL):
+    """Returns (posts, has_next_page) for every timeline page found in the payload."""
+    posts = []
+    more = False
+    for connection in find_connections(payload, TIMELINE):
+        more = more or has_next_page(connection)
+        posts.extend(post_from_node(node, handle, base_url) for node in iter_nodes(connection))
+    return posts, more
+
+
+def comment_from_node(node, parent=None):
+    parent = node.get("parent_comment_id") or parent
+    return {
+        "id": str(node.get("pk") or node.get("id")),
+        "author": (node.get("user") or {}).get("username"),
+        "comment": node.get("text"),
+        "timestamp": _iso_time(node.get("created_at")),
+        "parent": str(parent) if parent else None,
+    }
+
+
+def comment_pages(payload):
+    """Comments of every comment or reply page found in the payload, replies after their parent."""
+    comments = []
+    for name in (COMMENTS, CHILD_COMMENTS):
+        for connection in find_connections(payload, name):
+            for node in iter_nodes(connection):
+                comment = comment_from_node(node)
+                comments.append(comment)
+                # Pages carry a comment's first replies inline
+                for child in node.get("preview_child_comments") or []:
+                    comments.append(comment_from_node(child, comment["id"]))
+    return comments
@@ -0,0 +1,79 @@
+import os
+
+from .utils import state_path
+
+
+class SeenIndex(object):
+    """
+        Persistent set of post keys already crawled for one handle, stored as
+        an append-only file with one post shortcode per line.
+
+        The file only holds posts the index is complete below: every post
+        older than them was crawled too, so an incremental crawl may stop at
+        the first of them. A crawl that ends before it gets there (cut short
+        by its number of posts, or a crash) leaves a gap under the posts it
+        did crawl; those are kept apart, in the .pending file, and the next
+        crawl skips them without stopping until it closes the gap.
+    """
+
+    def __init__(self, handle, path=None):
+        self.handle = handle
+        self.path = path or state_path("index", "%s.txt" % handle)
+        self.pending_path = self.path[: -len(".txt")] + ".pending.txt"
+        self.codes = self._read(self.path)
+        self.pending = self._read(self.pending_path)
+        self.new_codes = []
+        # A first crawl has nothing older to connect to, it is the baseline
+        self.connected = not self.codes and not self.pending
+
+    @staticmethod
+    def _read(path):
+        if not os.path.exists(path):
+            return set()
+        with open(path, encoding="utf8") as f:
+            return set(line.strip() for line in f if line.strip())
+
+    @staticmethod
+    def code(key):
+        """https://www.instagram.com/{handle}/p/{code}/ -> {code}"""
+        return key.rstrip("/").rsplit("/", 1)[-1]
+
+    def __contains__(self, key):
+        code = self.code(key)
+        return code in self.codes or code in self.pending
+
+    def __len__(self):
+        return len(self.codes) + len(self.pending)
+
+    def stops_at(self, key):
+        """Whether the crawl can stop at this known post: nothing below it is missing."""
+        return self.code(key) in self.codes
+
+    def connect(self):
+        """The crawl reached a post it stops at, or the end of the timeline: no gap is left."""
+        self.connected = True
+
+    def add(self, key):
+        code = self.code(key)
+        if code not in self.codes and code not in self.pending:
+            self.pending.add(code)
+            self.new_codes.append(code)
+
+    def _append(self, path, codes):
+        if codes:
+            with open(path, "a", encoding="utf8") as f:
+                f.write("".join(code + "\n" for code in codes))
+
+    def save(self):
+        if not self.connected:
+            self._append(self.pending_path, self.new_codes)
+            self.new_codes = []
+            return
+
+        # The gap is closed: the pending posts of earlier crawls join the index
+        self._append(self.path, sorted(self.pending))
+        self.codes.update(self.pending)
+        self.pending = set()
+        self.new_codes = []
+        if os.path.exists(self.pending_path):
+            os.remove(self.pending_path)
@@ -0,0 +1,69 @@
+"""
+    Collects who liked a post from its likers dialog.
+
+    Likers come from two places: the likers API responses the dialog loads
+    (read from the network capture, whole pages at a time) and the rows it
+    renders, of which each round trip only returns the ones not seen
+    before. Either way a liker is kept once, by username, and handed to the
+    sink as soon as it is found.
+"""
+from .network import GraphQLStream
+
+LIKER_ROWS = ".Igw0E ._7UhW9.xLCgt a"
+LIKERS_API = "/likers/"
+
+
+def username_from_href(href):
+    parts = [part for part in (href or "").split("/") if part]
+    return parts[-1] if parts else None
+
+
+class LikersCollector(object):
+    def __init__(self, browser, sink=None, timeout=3, max_idle=2):
+        """
+            `sink(username)` gets every new liker. Collection ends after
+            `max_idle` rounds of `timeout` seconds without a new row.
+        """
+        self.browser = browser
+        self.sink = sink
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.seen = set()
+        self.stream = GraphQLStream(browser, url_part=LIKERS_API)
+
+    def add(self, username):
+        if not username or username in self.seen:
+            return False
+        self.seen.add(username)
+        if self.sink:
+            self.sink(username)
+        return True
+
+    def harvest_network(self):
+        found = 0
+        for entry in self.stream.poll():
+            body = entry["body"]
+            if not isinstance(body, dict):
+                continue
+            for user in body.get("users") or []:
+                found += self.add(user.get("username"))
+        return found
+
+    def harvest_rows(self):
+        found = 0
+        for row in self.browser.new_rows(LIKER_ROWS, self.timeout):
+            found += self.add(row.get("title") or username_from_href(row.get("href")))
+        return found
+
+    def run(self):
+        """Collects until the dialog stops rendering new likers; returns how many were found."""
+        idle = 0
+        try:
+            while idle < self.max_idle:
+                # Rows come first: their wait is what gives the API responses time to land
+                found = self.harvest_rows()
+                found += self.harvest_network()
+                idle = 0 if found else idle + 1
+        finally:
+            self.stream.close()
+        return len(self.seen)
@@ -0,0 +1,276 @@
+"""
+    Downloads the media of crawled posts before their CDN URLs expire.
+
+    Files are stored content-addressed and sharded by their sha256:
+
+        <root>/ab/cd/abcd...ef.jpg
+
+    A download is keyed on the URL's ig_cache_key (or its path, without the
+    expiring signature), so the same picture is never fetched twice, and two
+    keys with identical content share one file. Interrupted downloads resume
+    with a Range request from their .part file.
+
+        python -m inscrawler.media posts.ndjson -o posts_with_media.ndjson --dir ./media
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import threading
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .utils import state_path
+
+CHUNK_SIZE = 64 * 1024
+EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/webp": ".webp",
+    "image/gif": ".gif",
+    "image/heic": ".heic",
+    "video/mp4": ".mp4",
+}
+
+
+def cache_key(url):
+    """What identifies a media file across the differently signed URLs it is served under."""
+    parsed = urlparse(url)
+    key = parse_qs(parsed.query).get("ig_cache_key")
+    if key:
+        return "ig:" + key[0]
+    return parsed.netloc.split(".", 1)[-1] + parsed.path
+
+
+class MediaStore(object):
+    """
+        The content-addressed directory and its index of cache key -> file,
+        an append-only NDJSON file that is read once at start.
+    """
+
+    def __init__(self, root=None):
+        self.root = root or os.path.dirname(state_path("media", "index.ndjson"))
+        self.partial_dir = os.path.join(self.root, "partial")
+        os.makedirs(self.partial_dir, exist_ok=True)
+        self.index_path = os.path.join(self.root, "index.ndjson")
+        self.entries = {}
+        self.by_hash = {}
+        self._lock = threading.Lock()
+
+        if os.path.exists(self.index_path):
+            with open(self.index_path, encoding="utf8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries[entry["key"]] = entry
+                        self.by_hash[entry["sha256"]] = entry
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry and os.path.exists(os.path.join(self.root, entry["path"])):
+            return entry
+        return None
+
+    def partial_path(self, key):
+        return os.path.join(
+            self.partial_dir, hashlib.sha1(key.encode("utf8")).hexdigest() + ".part"
+        )
+
+    def add(self, key, partial, extension):
+        """Moves a finished download into its content address and indexes it."""
+        sha = hashlib.sha256()
+        with open(partial, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        path = os.path.join(digest[:2], digest[2:4], digest + extension)
+        target = os.path.join(self.root, path)
+
+        with self._lock:
+            known = self.by_hash.get(digest)
+            if known:
+                path = known["path"]
+                os.remove(partial)
+            elif os.path.exists(target):
+                os.remove(partial)
+            else:
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(partial, target)
+
+            entry = {
+                "key": key,
+                "sha256": digest,
+                "path": path,
+                "bytes": os.path.getsize(os.path.join(self.root, path)),
+            }
+            self.entries[key] = entry
+            self.by_hash.setdefault(digest, entry)
+            with open(self.index_path, "a", encoding="utf8") as f:
+                f.write(json.dumps(entry) + "\n")
+        return entry
+
+
+class MediaDownloader(object):
+    def __init__(self, store=None, workers=8, timeout=30, retries=3):
+        self.store = store if isinstance(store, MediaStore) else MediaStore(store)
+        self.workers = workers
+        self.timeout = timeout
+        self.retries = retries
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.stats = {"downloaded": 0, "cached": 0, "resumed": 0, "failed": 0, "bytes": 0}
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def _count(self, name, n=1):
+        # Downloads and posts run on several threads at once
+        with self._lock:
+            self.stats[name] += n
+
+    def _fetch(self, url, key):
+        partial = self.store.partial_path(key)
+        for attempt in range(self.retries):
+            offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+            headers = {"Range": "bytes=%d-" % offset} if offset else {}
+            try:
+                with self.session.get(
+                    url, headers=headers, stream=True, timeout=self.timeout
+                ) as response:
+                    if response.status_code == 416:
+                        # The partial file already holds the whole body
+                        response.close()
+                    else:
+                        response.raise_for_status()
+                        resumed = offset and response.status_code == 206
+                        if resumed:
+                            self._count("resumed")
+                        with open(partial, "ab" if resumed else "wb") as f:
+                            for chunk in response.iter_content(CHUNK_SIZE):
+                                f.write(chunk)
+                                self._count("bytes", len(chunk))
+                    content_type = response.headers.get("Content-Type", "")
+                extension = EXTENSIONS.get(content_type.split(";")[0].strip())
+                if not extension:
+                    extension = os.path.splitext(urlparse(url).path)[1] or ".bin"
+                self._count("downloaded")
+                return self.store.add(key, partial, extension)
+            except (requests.RequestException, OSError) as e:
+                if attempt == self.retries - 1:
+                    raise
+                sys.stderr.write("Retrying %s: %s\n" % (url, e))
+
+    def download_async(self, url):
+        """
+            Future of the local copy of `url`, {"path", "bytes", "sha256", ...}
+            with `path` relative to the store root. Concurrent calls for the
+            same media share one download.
+        """
+        key = cache_key(url)
+        entry = self.store.get(key)
+        if entry:
+            self._count("cached")
+            future = Future()
+            future.set_result(entry)
+            return future
+
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is None:
+                future = self.executor.submit(self._fetch, url, key)
+                self._inflight[key] = future
+                future.add_done_callback(lambda _, key=key: self._inflight.pop(key, None))
+        return future
+
+    def download(self, url):
+        return self.download_async(url).result()
+
+    def download_post(self, post):
+        """Adds `media` (path and size of every image) and `img_path` to a post record."""
+        urls = [url for url in post.get("img_urls") or [post.get("img_url")] if url and url != "N/A"]
+        futures = [(url, self.download_async(url)) for url in urls]
+
+        media = []
+        for url, future in futures:
+            try:
+                entry = future.result()
+            except Exception as e:
+                self._count("failed")
+                sys.stderr.write("Failed to download %s: %s\n" % (url, e))
+                continue
+            media.append(
+                {
+                    "url": url,
+                    "path": os.path.join(self.store.root, entry["path"]),
+                    "bytes": entry["bytes"],
+                    "sha256": entry["sha256"],
+                }
+            )
+
+        if media:
+            post["media"] = media
+            post["img_path"] = media[0]["path"]
+        return post
+
+    def close(self):
+        self.executor.shutdown()
+        self.session.close()
+
+    def report(self, out=sys.stderr):
+        out.write(
+            "media: %(downloaded)s downloaded, %(cached)s already stored, "
+            "%(resumed)s resumed, %(failed)s failed, %(bytes)s bytes\n" % self.stats
+        )
+
+
+def iter_records(path):
+    """Posts of a JSON array or NDJSON crawl output."""
+    with open(path, encoding="utf8") as f:
+        first = f.read(1)
+        f.seek(0)
+        if first == "[":
+            for post in json.load(f):
+                yield post
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Download the media of crawled posts")
+    parser.add_argument("posts", help="crawl output, JSON or NDJSON")
+    parser.add_argument("-o", "--output", help="NDJSON output with local paths (default stdout)")
+    parser.add_argument("--dir", help="media directory (default ~/.inscrawler/media)")
+    parser.add_argument("-w", "--workers", type=int, default=8)
+    args = parser.parse_args(argv)
+
+    from .output import NdjsonWriter
+
+    downloader = MediaDownloader(args.dir, workers=args.workers)
+    with NdjsonWriter(args.output) as writer:
+        # A window of posts in flight keeps every connection busy and the
+        # output in input order
+        with ThreadPoolExecutor(max_workers=args.workers) as posts_executor:
+            window = deque()
+            for post in iter_records(args.posts):
+                window.append(posts_executor.submit(downloader.download_post, post))
+                if len(window) >= 2 * args.workers:
+                    writer.write(window.popleft().result())
+            while window:
+                writer.write(window.popleft().result())
+    downloader.close()
+    downloader.report()
+
+
+if __name__ == "__main__":
+    main()
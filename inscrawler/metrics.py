@@ -0,0 +1,235 @@
+"""
+    Always-on instrumentation of a crawl: WebDriver commands by name, wall
+    time per stage and per post, and time lost to find_one/find misses (an
+    implicit wait that ends with nothing found). Recording is a counter bump
+    and a perf_counter call, cheap enough to leave on in production.
+
+    A run exports a JSON summary and a Prometheus text file (for the node
+    exporter textfile collector).
+"""
+import json
+import os
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+from time import perf_counter
+
+
+class Metrics(object):
+    def __init__(self):
+        self.started = time.time()
+        self.commands = Counter()
+        self.command_sec = 0.0
+        self.stages = {}
+        self.misses = {}
+        self.posts = 0
+        self.post_sec = 0.0
+        self.post_max_sec = 0.0
+        self._last_post = perf_counter()
+
+    def instrument(self, driver):
+        """Counts every command `driver` sends to chromedriver."""
+        execute = driver.execute
+
+        def counted(command, params=None):
+            self.commands[command] += 1
+            start = perf_counter()
+            try:
+                return execute(command, params)
+            finally:
+                self.command_sec += perf_counter() - start
+
+        driver.execute = counted
+
+    @staticmethod
+    def _add(table, name, elapsed):
+        stats = table.get(name)
+        if stats is None:
+            stats = table[name] = {"count": 0, "total_sec": 0.0, "max_sec": 0.0}
+        stats["count"] += 1
+        stats["total_sec"] += elapsed
+        if elapsed > stats["max_sec"]:
+            stats["max_sec"] = elapsed
+
+    @contextmanager
+    def stage(self, name):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self._add(self.stages, name, perf_counter() - start)
+
+    def miss(self, css_selector, elapsed):
+        self._add(self.misses, css_selector, elapsed)
+
+    def start_post(self):
+        self._last_post = perf_counter()
+
+    def post_done(self):
+        """Marks a post as finished; its time is everything since the previous one."""
+        now = perf_counter()
+        elapsed = now - self._last_post
+        self._last_post = now
+        self.posts += 1
+        self.post_sec += elapsed
+        self.post_max_sec = max(self.post_max_sec, elapsed)
+
+    @staticmethod
+    def _rounded(table):
+        return {
+            name: dict(stats, total_sec=round(stats["total_sec"], 4), max_sec=round(stats["max_sec"], 4))
+            for name, stats in sorted(table.items(), key=lambda item: -item[1]["total_sec"])
+        }
+
+    def summary(
+        self, waits=None, resources=None, scheduler=None, retries=None, profiles=None, tabs=None
+    ):
+        commands = sum(self.commands.values())
+        return {
+            "started": self.started,
+            "elapsed_sec": round(time.time() - self.started, 3),
+            "posts": self.posts,
+            "post_avg_sec": round(self.post_sec / self.posts, 4) if self.posts else None,
+            "post_max_sec": round(self.post_max_sec, 4),
+            "webdriver_commands": commands,
+            "webdriver_sec": round(self.command_sec, 3),
+            "commands_per_post": round(commands / self.posts, 2) if self.posts else None,
+            "commands": dict(self.commands.most_common()),
+            "stages": self._rounded(self.stages),
+            "find_misses": self._rounded(self.misses),
+            "find_miss_sec": round(sum(s["total_sec"] for s in self.misses.values()), 3),
+            "waits": waits or {},
+            "resources": resources,
+            "scheduler": scheduler,
+            "retries": retries or {},
+            "profile_cache": profiles,
+            "tabs": tabs,
+        }
+
+    def prometheus(
+        self,
+        waits=None,
+        resources=None,
+        scheduler=None,
+        retries=None,
+        profiles=None,
+        tabs=None,
+        prefix="inscrawler",
+    ):
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append("# HELP %s_%s %s" % (prefix, name, help_text))
+            lines.append("# TYPE %s_%s %s" % (prefix, name, kind))
+            for labels, value in samples:
+                label_text = ",".join(
+                    '%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+                    for k, v in labels.items()
+                )
+                lines.append(
+                    "%s_%s%s %s" % (prefix, name, "{%s}" % label_text if label_text else "", value)
+                )
+
+        metric("run_seconds", "gauge", "Wall time of the crawl run",
+               [({}, round(time.time() - self.started, 3))])
+        metric("posts_total", "counter", "Posts crawled", [({}, self.posts)])
+        metric("post_seconds_total", "counter", "Wall time spent per post, summed",
+               [({}, round(self.post_sec, 4))])
+        metric("webdriver_commands_total", "counter", "WebDriver commands sent",
+               [({"command": c}, n) for c, n in sorted(self.commands.items())])
+        metric("webdriver_seconds_total", "counter", "Time spent in WebDriver commands",
+               [({}, round(self.command_sec, 4))])
+        metric("stage_calls_total", "counter", "Calls per crawl stage",
+               [({"stage": s}, v["count"]) for s, v in sorted(self.stages.items())])
+        metric("stage_seconds_total", "counter", "Wall time per crawl stage",
+               [({"stage": s}, round(v["total_sec"], 4)) for s, v in sorted(self.stages.items())])
+        metric("find_misses_total", "counter", "Element lookups that found nothing",
+               [({"selector": s}, v["count"]) for s, v in sorted(self.misses.items())])
+        metric("find_miss_seconds_total", "counter", "Time lost to element lookups that found nothing",
+               [({"selector": s}, round(v["total_sec"], 4)) for s, v in sorted(self.misses.items())])
+        if waits:
+            metric("wait_seconds_total", "counter", "Time spent in explicit waits",
+                   [({"label": l}, v["total_sec"]) for l, v in sorted(waits.items())])
+            metric("wait_timeouts_total", "counter", "Explicit waits that timed out",
+                   [({"label": l}, v["timeouts"]) for l, v in sorted(waits.items())])
+        if resources:
+            metric("loaded_bytes_total", "counter", "Bytes downloaded by the browser per resource type",
+                   [({"type": t}, v["bytes"]) for t, v in sorted(resources["loaded"].items())])
+            metric("blocked_requests_total", "counter", "Requests blocked by the resource policy",
+                   [({"type": t}, n) for t, n in sorted(resources["blocked"].items())])
+            metric("blocked_bytes_saved", "gauge", "Estimated bytes the blocked requests would have cost",
+                   [({}, resources["estimated_bytes_saved"])])
+        if scheduler:
+            metric("paced_requests_total", "counter", "Navigations, scrolls and clicks paced by the scheduler",
+                   [({"kind": k}, n) for k, n in sorted(scheduler["requests"].items())])
+            metric("pace_wait_seconds_total", "counter", "Time spent waiting for the scheduler",
+                   [({}, scheduler["waited_sec"])])
+            metric("throttled_total", "counter", "Throttled responses seen",
+                   [({"reason": r}, n) for r, n in sorted(scheduler["throttled"].items())])
+            metric("request_rate", "gauge", "Current limit of paced actions per second, if any",
+                   [({}, scheduler["rate"])] if scheduler["rate"] is not None else [])
+            metric("request_pace", "gauge", "Paced actions per second over the latest ones",
+                   [({}, scheduler["pace"])] if scheduler["pace"] is not None else [])
+        if retries:
+            metric("retry_attempts_total", "counter", "Attempts of retried calls",
+                   [({"call": c}, v["attempts"]) for c, v in sorted(retries.items())])
+            metric("retry_failures_total", "counter", "Retried calls that gave up",
+                   [({"call": c}, v["failures"]) for c, v in sorted(retries.items())])
+            metric("retry_seconds_total", "counter", "Time lost to failed attempts and backoff",
+                   [({"call": c}, v["retry_sec"]) for c, v in sorted(retries.items())])
+        if profiles:
+            metric("profile_cache_lookups_total", "counter", "Profile cache lookups by outcome",
+                   [({"result": r}, profiles[r]) for r in ("hits", "misses", "stale")])
+        if tabs:
+            metric("tab_pages_total", "counter", "Post pages loaded in the tab pool",
+                   [({}, tabs["pages"])])
+            metric("tab_timeouts_total", "counter", "Tab pool pages that timed out",
+                   [({}, tabs["timeouts"])])
+            metric("tab_busy_seconds_total", "counter", "Wall time the tab pool was loading pages",
+                   [({}, tabs["busy_sec"])])
+            metric("tab_load_seconds_total", "counter", "Load time of the tab pool pages, summed",
+                   [({}, tabs["load_sec"])])
+        return "\n".join(lines) + "\n"
+
+    def export(
+        self,
+        path,
+        waits=None,
+        resources=None,
+        scheduler=None,
+        retries=None,
+        profiles=None,
+        tabs=None,
+    ):
+        """
+            Writes the JSON summary to `path` and the Prometheus text to
+            `path` with a .prom extension. Both are replaced atomically so a
+            scraper never reads half a file.
+        """
+        prom_path = os.path.splitext(path)[0] + ".prom"
+        summary = self.summary(waits, resources, scheduler, retries, profiles, tabs)
+        for target, text in (
+            (path, json.dumps(summary, indent=2)),
+            (prom_path, self.prometheus(waits, resources, scheduler, retries, profiles, tabs)),
+        ):
+            tmp_path = target + ".tmp"
+            with open(tmp_path, "w", encoding="utf8") as f:
+                f.write(text)
+            os.replace(tmp_path, target)
+
+
+def timed_stage(name=None):
+    """Times a `fn(browser, ...)` as a stage of `browser.metrics`."""
+
+    def wrap(func):
+        stage = name or func.__name__
+
+        @wraps(func)
+        def wrapped_f(browser, *args, **kwargs):
+            with browser.metrics.stage(stage):
+                return func(browser, *args, **kwargs)
+
+        return wrapped_f
+
+    return wrap
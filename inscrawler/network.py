@@ -0,0 +1,166 @@
+"""
+    Streaming capture of GraphQL responses from Chrome's performance log.
+
+    Every poll only reads the log entries added since the stream's previous
+    one (each stream has its own position in the browser's log, see
+    Browser.performance_log), and entries are filtered on their raw
+    text before anything is parsed. Requests are tracked from
+    requestWillBeSent to loadingFinished; only finished ones of the wanted
+    operations have their body fetched, a few at a time.
+"""
+import json
+import re
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .capture import operation_name
+
+REQUEST_ID = re.compile(r'"requestId":\s*"([^"]+)"')
+
+
+class GraphQLStream(object):
+    def __init__(
+        self, browser, operations=None, url_part="graphql/query", workers=4,
+        sink=None, max_pending=1000, since=None,
+    ):
+        """
+            `operations` limits the capture to these GraphQL operation names
+            (friendly name or root data key). `sink` is a callable or a
+            queue (anything with put) that receives every entry. The stream
+            reads the log from `since` on, see Browser.watch_performance_log.
+        """
+        self.browser = browser
+        self.operations = set(operations) if operations else None
+        self.url_part = url_part
+        self.workers = workers
+        self.sink = sink
+        self.max_pending = max_pending
+        # requestId -> request info, oldest first, until the response finishes
+        self.pending = OrderedDict()
+        self.stats = {"entries": 0, "parsed": 0, "bodies": 0, "skipped": 0, "errors": 0}
+        browser.watch_performance_log(self, since)
+
+    def close(self):
+        """Stops reading the log; the entries only this stream still needed are dropped."""
+        self.browser.release_performance_log(self)
+
+    def _track(self, raw):
+        """Updates the pending requests from one raw log message; returns a finished requestId."""
+        if '"Network.loadingFinished"' in raw or '"Network.loadingFailed"' in raw:
+            match = REQUEST_ID.search(raw)
+            if not match or match.group(1) not in self.pending:
+                return None
+            request_id = match.group(1)
+            if '"Network.loadingFailed"' in raw:
+                self.pending.pop(request_id, None)
+                return None
+            return request_id
+
+        if self.url_part not in raw:
+            return None
+
+        self.stats["parsed"] += 1
+        message = json.loads(raw)["message"]
+        params = message.get("params", {})
+        request_id = params.get("requestId")
+
+        if message.get("method") == "Network.requestWillBeSent":
+            request = params.get("request", {})
+            if self.url_part not in request.get("url", ""):
+                return None
+            operation = operation_name(request.get("postData"))
+            if self.operations and operation and operation not in self.operations:
+                self.stats["skipped"] += 1
+                return None
+            self.pending[request_id] = {
+                "url": request.get("url"),
+                "post_data": request.get("postData"),
+                "operation": operation,
+                "status": None,
+            }
+            while len(self.pending) > self.max_pending:
+                self.pending.popitem(last=False)
+
+        elif message.get("method") == "Network.responseReceived":
+            info = self.pending.get(request_id)
+            if info is not None:
+                info["status"] = params.get("response", {}).get("status")
+        return None
+
+    def _fetch(self, request_id):
+        response = self.browser.driver.execute_cdp_cmd(
+            "Network.getResponseBody", {"requestId": request_id}
+        )
+        return json.loads(response["body"])
+
+    def _deliver(self, entry):
+        if self.sink is None:
+            return
+        if hasattr(self.sink, "put"):
+            self.sink.put(entry)
+        else:
+            self.sink(entry)
+
+    def poll(self):
+        """Delivers and returns the wanted GraphQL responses that finished since the last poll."""
+        finished = []
+        for log_entry in self.browser.performance_log(self):
+            self.stats["entries"] += 1
+            try:
+                request_id = self._track(log_entry["message"])
+            except (ValueError, KeyError):
+                self.stats["errors"] += 1
+                continue
+            if request_id:
+                finished.append((request_id, self.pending.pop(request_id)))
+
+        if not finished:
+            return []
+
+        # chromedriver runs one command per session at a time, the pool
+        # overlaps the HTTP round trips of the requests in flight
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [
+                (request_id, info, executor.submit(self._fetch, request_id))
+                for request_id, info in finished
+            ]
+
+        entries = []
+        recorder = self.browser.recorder
+        for request_id, info, future in futures:
+            try:
+                body = future.result()
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"⚠️ Could not read the response of {request_id}: {e}")
+                continue
+
+            operation = info["operation"] or operation_name(body=body)
+            if self.operations and operation not in self.operations:
+                self.stats["skipped"] += 1
+                continue
+
+            entry = {
+                "ts": round(time.time(), 3),
+                "url": info["url"],
+                "request_id": request_id,
+                "status": info["status"],
+                "operation": operation,
+                "body": body,
+            }
+            self.stats["bodies"] += 1
+            if recorder:
+                recorder.record(
+                    body,
+                    url=info["url"],
+                    request_id=request_id,
+                    status=info["status"],
+                    operation=operation,
+                )
+            self._deliver(entry)
+            entries.append(entry)
+
+        if recorder:
+            recorder.flush()
+        return entries
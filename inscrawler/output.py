@@ -0,0 +1,51 @@
+import json
+import os
+import sys
+import time
+from io import open
+
+
+class NdjsonWriter(object):
+    """
+        Appends one JSON record per line as records arrive. Each line is
+        flushed right away and the file is fsynced every `fsync_every` records
+        or `fsync_interval` seconds, so a crash loses at most that much.
+        Without a filepath the lines go to stdout.
+    """
+
+    def __init__(self, filepath=None, fsync_every=50, fsync_interval=5.0):
+        self.filepath = filepath
+        self.file = open(filepath, "a", encoding="utf8") if filepath else sys.stdout
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.count = 0
+        self._unsynced = 0
+        self._last_sync = time.time()
+
+    def write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+        self.count += 1
+        self._unsynced += 1
+
+        if self._unsynced >= self.fsync_every or (
+            time.time() - self._last_sync >= self.fsync_interval
+        ):
+            self.sync()
+
+    def sync(self):
+        if self.filepath and self._unsynced:
+            os.fsync(self.file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.time()
+
+    def close(self):
+        self.sync()
+        if self.filepath:
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
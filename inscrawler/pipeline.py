@@ -0,0 +1,261 @@
+"""
+    Producer/consumer pipeline between the crawl and what consumes its posts.
+
+    Records put into the pipeline flow through its transforms in order, then
+    fan out to every sink. Each stage has its own threads and its own
+    bounded queue, so a slow sink (a database, a download) only slows the
+    crawl once its queue is full: put() then blocks, which is the
+    backpressure that keeps memory bounded. Sinks share the record objects,
+    so only transforms may modify them.
+
+        pipeline = Pipeline()
+        pipeline.add_transform("text", parse_text)
+        pipeline.add_sink("file", writer.write)
+        pipeline.add_sink("db", loader.load_batch, batch_size=500)
+        with pipeline:
+            for post in crawler.iter_user_posts("cal_foodie"):
+                pipeline.put(post)
+        pipeline.report()
+"""
+import queue
+import sys
+import threading
+import time
+import traceback
+
+from .fetch import fetch_hashtags
+from .fetch import fetch_mentions
+
+_DONE = object()
+
+
+class StageStats(object):
+    def __init__(self, name):
+        self.name = name
+        self.records = 0
+        self.errors = 0
+        self.busy = 0.0
+        # Time spent waiting for room in the next stage's queue
+        self.blocked = 0.0
+        self.max_queue = 0
+        self.started = time.time()
+        self.finished = None
+
+    def to_dict(self):
+        elapsed = (self.finished or time.time()) - self.started
+        return {
+            "stage": self.name,
+            "records": self.records,
+            "errors": self.errors,
+            "busy_sec": round(self.busy, 3),
+            "blocked_sec": round(self.blocked, 3),
+            "max_queue": self.max_queue,
+            "records_per_sec": round(self.records / elapsed, 2) if elapsed else 0.0,
+            "records_per_busy_sec": round(self.records / self.busy, 2) if self.busy else 0.0,
+        }
+
+
+class Stage(object):
+    """
+        One pipeline step. `fn` gets one record, or a list of up to
+        `batch_size` records when batching. A transform returns the record
+        to pass on (None drops it); a sink's return value is ignored.
+        `on_close` runs once after the last record.
+    """
+
+    def __init__(
+        self, name, fn, workers=1, maxsize=100, batch_size=None,
+        batch_interval=2.0, on_close=None,
+    ):
+        self.name = name
+        self.fn = fn
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.on_close = on_close
+        self.queue = queue.Queue(maxsize)
+        self.stats = StageStats(name)
+        self.downstream = []
+        self._threads = []
+        self._running = 0
+        self._lock = threading.Lock()
+
+    def start(self):
+        self._running = self.workers
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._run, name="%s-%d" % (self.name, i), daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def put(self, record):
+        self.queue.put(record)
+        depth = self.queue.qsize()
+        if depth > self.stats.max_queue:
+            self.stats.max_queue = depth
+
+    def emit(self, record):
+        start = time.time()
+        for stage in self.downstream:
+            stage.put(record)
+        self.stats.blocked += time.time() - start
+
+    def call(self, records):
+        start = time.time()
+        try:
+            if self.batch_size:
+                result = self.fn(records)
+            else:
+                result = self.fn(records[0])
+        except Exception:
+            self.stats.errors += len(records)
+            sys.stderr.write("Pipeline stage %s failed:\n" % self.name)
+            traceback.print_exc()
+            return
+        finally:
+            self.stats.busy += time.time() - start
+
+        self.stats.records += len(records)
+        if self.downstream and not self.batch_size and result is not None:
+            self.emit(result)
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None
+            if batch:
+                timeout = max(0.0, deadline - time.time())
+            try:
+                record = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                # A slow trickle of records still gets written regularly
+                self.call(batch)
+                batch = []
+                continue
+
+            if record is _DONE:
+                break
+
+            if not self.batch_size:
+                self.call([record])
+                continue
+
+            if not batch:
+                deadline = time.time() + self.batch_interval
+            batch.append(record)
+            if len(batch) >= self.batch_size:
+                self.call(batch)
+                batch = []
+
+        if batch:
+            self.call(batch)
+        self._worker_done()
+
+    def _worker_done(self):
+        with self._lock:
+            self._running -= 1
+            last = self._running == 0
+        if not last:
+            return
+
+        if self.on_close:
+            try:
+                self.on_close()
+            except Exception:
+                self.stats.errors += 1
+                traceback.print_exc()
+        self.stats.finished = time.time()
+        for stage in self.downstream:
+            stage.close()
+
+    def close(self):
+        for _ in range(self.workers):
+            self.queue.put(_DONE)
+
+    def join(self):
+        for thread in self._threads:
+            thread.join()
+
+
+class Pipeline(object):
+    def __init__(self, maxsize=100):
+        self.maxsize = maxsize
+        self.transforms = []
+        self.sinks = []
+        self.stats = StageStats("put")
+        self._started = False
+
+    def add_transform(self, name, fn, workers=1, maxsize=None):
+        self.transforms.append(Stage(name, fn, workers, maxsize or self.maxsize))
+        return self
+
+    def add_sink(self, name, fn, workers=1, maxsize=None, batch_size=None, on_close=None):
+        self.sinks.append(
+            Stage(
+                name, fn, workers, maxsize or self.maxsize,
+                batch_size=batch_size, on_close=on_close,
+            )
+        )
+        return self
+
+    def stages(self):
+        return self.transforms + self.sinks
+
+    def start(self):
+        # Transforms feed each other in order; the last one feeds every sink
+        for stage, following in zip(self.transforms, self.transforms[1:]):
+            stage.downstream = [following]
+        if self.transforms:
+            self.transforms[-1].downstream = self.sinks
+        for stage in self.stages():
+            stage.start()
+        self.stats = StageStats("put")
+        self._started = True
+        return self
+
+    def put(self, record):
+        """Feeds one record in; blocks while the first stage's queue is full."""
+        start = time.time()
+        for stage in self.transforms[:1] or self.sinks:
+            stage.put(record)
+        self.stats.blocked += time.time() - start
+        self.stats.records += 1
+
+    def close(self):
+        """Lets every queued record drain through, then stops the stages."""
+        if not self._started:
+            return
+        for stage in self.transforms[:1] or self.sinks:
+            stage.close()
+        for stage in self.stages():
+            stage.join()
+        self.stats.finished = time.time()
+        self._started = False
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def report(self, out=sys.stderr):
+        for info in [self.stats.to_dict()] + [s.stats.to_dict() for s in self.stages()]:
+            out.write(
+                "stage %(stage)s: %(records)s records, %(errors)s errors, "
+                "%(records_per_sec)s/sec, busy %(busy_sec)ss, "
+                "blocked %(blocked_sec)ss, max queue %(max_queue)s\n" % info
+            )
+
+
+def parse_text(post):
+    """Mentions and hashtags of the caption and comments, as the settings ask for."""
+    if post.get("caption"):
+        fetch_mentions(post["caption"], post)
+        fetch_hashtags(post["caption"], post)
+    for comment in post.get("comments") or []:
+        if comment.get("comment"):
+            fetch_mentions(comment["comment"], comment)
+            fetch_hashtags(comment["comment"], comment)
+    return post
@@ -0,0 +1,310 @@
+import inspect
+import multiprocessing
+import os
+import queue
+import sys
+import time
+import traceback
+
+from .settings import dump_settings
+from .settings import load_settings
+from .utils import merge_tag_posts
+
+# Seconds between two checks for workers that died without a word
+LIVENESS_CHECK = 1.0
+
+
+def _worker(worker_id, tasks, results, has_screen, settings_values, crawler_kwargs):
+    """
+        Each worker owns one long-lived InsCrawler (one Chrome, one login)
+        and keeps pulling tasks until it receives the None sentinel. It says
+        "ready" once logged in, and announces every task with a "start"
+        result, so the parent knows which one is lost if it is killed.
+    """
+    load_settings(settings_values)
+    # The parent owns stdout for the merged output; worker chatter goes to stderr
+    sys.stdout = sys.stderr
+
+    from .crawler import InsCrawler
+
+    crawler_kwargs = dict(crawler_kwargs)
+    for name in ("capture_path", "likers_path", "comments_path"):
+        if crawler_kwargs.get(name):
+            # One file per worker, they can all be read together
+            crawler_kwargs[name] += ".%d" % worker_id
+    if crawler_kwargs.get("metrics_path"):
+        root, ext = os.path.splitext(crawler_kwargs["metrics_path"])
+        crawler_kwargs["metrics_path"] = "%s.%d%s" % (root, worker_id, ext)
+
+    try:
+        ins_crawler = InsCrawler(has_screen=has_screen, **crawler_kwargs)
+    except Exception:
+        traceback.print_exc()
+        results.put(("dead", worker_id, None, None, 0))
+        return
+    results.put(("ready", worker_id, None, None, 0))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+
+        method, args = task[0], task[1]
+        if len(task) > 2 and task[2]:
+            # Daemon tasks carry the settings of the request they came from
+            load_settings(task[2])
+        results.put(("start", worker_id, task, None, 0))
+        start = time.time()
+        try:
+            result = getattr(ins_crawler, method)(*args)
+            if inspect.isgenerator(result):
+                # Stream generator results record by record; "ok" carries the count
+                count = 0
+                for record in result:
+                    results.put(("record", worker_id, task, record, 0))
+                    count += 1
+                result = count
+            results.put(("ok", worker_id, task, result, time.time() - start))
+        except Exception:
+            traceback.print_exc()
+            results.put(("error", worker_id, task, None, time.time() - start))
+
+    ins_crawler.close()
+    results.put(("done", worker_id, None, None, 0))
+
+
+def start_worker(worker_id, tasks, results, has_screen, settings_values, crawler_kwargs, **kwargs):
+    proc = multiprocessing.Process(
+        target=_worker,
+        args=(worker_id, tasks, results, has_screen, settings_values, crawler_kwargs),
+        **kwargs
+    )
+    proc.start()
+    return proc
+
+
+def lost_workers(procs, finished, results):
+    """
+        Ids of the workers in `procs` (worker id -> Process) that exited
+        without their final "done" or "dead" result: killed, out of memory
+        or crashed in Chrome's or Python's native code. None while results
+        are waiting, since a worker's last results are sent before it exits.
+    """
+    if not results.empty():
+        return []
+    return [
+        worker_id
+        for worker_id, proc in procs.items()
+        if worker_id not in finished and proc.exitcode is not None
+    ]
+
+
+class WorkerStats(object):
+    def __init__(self, worker_id):
+        self.worker_id = worker_id
+        self.tasks = 0
+        self.errors = 0
+        self.posts = 0
+        self.busy = 0.0
+
+    @property
+    def posts_per_sec(self):
+        return self.posts / self.busy if self.busy else 0.0
+
+    def to_dict(self):
+        return {
+            "worker": self.worker_id,
+            "tasks": self.tasks,
+            "errors": self.errors,
+            "posts": self.posts,
+            "busy_sec": round(self.busy, 2),
+            "posts_per_sec": round(self.posts_per_sec, 3),
+        }
+
+
+class CrawlerPool(object):
+    """
+        Spreads crawl tasks over a pool of worker processes. A task is an
+        InsCrawler method name plus its arguments, e.g.
+        ("get_user_posts", ("cal_foodie", 10, False)).
+    """
+
+    def __init__(self, workers=2, has_screen=False, queue_size=0, **crawler_kwargs):
+        """
+            With `queue_size`, workers block once that many records are waiting
+            for the parent, so a slow consumer holds back the browsers too.
+        """
+        self.workers = max(1, workers)
+        self.has_screen = has_screen
+        self.queue_size = queue_size
+        self.crawler_kwargs = crawler_kwargs
+        self.stats = {}
+
+    def run(self, tasks, on_record=None):
+        """
+            Yields (task, result) pairs in completion order; result is None on
+            failure. Tasks whose method is a generator call on_record(task,
+            record) for every record as it arrives and yield the record count.
+        """
+        tasks = list(tasks)
+        task_queue = multiprocessing.Queue()
+        settings_values = dump_settings()
+
+        for task in tasks:
+            task_queue.put(task)
+
+        num_workers = min(self.workers, len(tasks)) or 1
+        # Room for every worker's final "done" once the parent stops reading
+        result_queue = multiprocessing.Queue(
+            max(self.queue_size, 2 * num_workers) if self.queue_size else 0
+        )
+        for _ in range(num_workers):
+            task_queue.put(None)
+
+        def start(worker_id):
+            return start_worker(
+                worker_id,
+                task_queue,
+                result_queue,
+                self.has_screen,
+                settings_values,
+                self.crawler_kwargs,
+            )
+
+        procs = {}
+        for worker_id in range(num_workers):
+            self.stats[worker_id] = WorkerStats(worker_id)
+            procs[worker_id] = start(worker_id)
+
+        # Tasks not answered yet; worker id -> the task it is on; workers
+        # that said they are done
+        unanswered = list(tasks)
+        running = {}
+        finished = set()
+        pending = len(tasks)
+        while len(finished) < len(procs) and pending:
+            try:
+                status, worker_id, task, result, elapsed = result_queue.get(
+                    timeout=LIVENESS_CHECK
+                )
+            except queue.Empty:
+                for worker_id in lost_workers(procs, finished, result_queue):
+                    sys.stderr.write(
+                        "Worker %d died (exit code %s)\n" % (worker_id, procs[worker_id].exitcode)
+                    )
+                    task = running.pop(worker_id, None)
+                    if task is not None:
+                        pending -= 1
+                        self.stats[worker_id].tasks += 1
+                        self.stats[worker_id].errors += 1
+                    if task is not None and pending:
+                        # A fresh browser takes over the rest of the queue
+                        task_queue.put(None)
+                        procs[worker_id] = start(worker_id)
+                    else:
+                        # Died starting up, like a "dead" worker, or nothing is left to do
+                        finished.add(worker_id)
+                    if task is not None:
+                        unanswered.remove(task)
+                        yield task, None
+                continue
+            stats = self.stats[worker_id]
+
+            if status in ("done", "dead"):
+                finished.add(worker_id)
+                continue
+
+            if status == "ready":
+                continue
+
+            if status == "start":
+                running[worker_id] = task
+                continue
+
+            if status == "record":
+                stats.posts += 1
+                if on_record:
+                    on_record(task, result)
+                continue
+
+            running.pop(worker_id, None)
+            pending -= 1
+            stats.tasks += 1
+            stats.busy += elapsed
+            if status == "error":
+                stats.errors += 1
+            elif isinstance(result, list):
+                stats.posts += len(result)
+
+            unanswered.remove(task)
+            yield task, result
+
+        # Every worker is gone; a killed one may have taken results it
+        # hadn't sent yet with it
+        for task in unanswered:
+            yield task, None
+
+        for proc in procs.values():
+            proc.join()
+
+    def crawl_users(self, handles, number=None, detail=False, incremental=False):
+        """Crawls every handle and merges the posts into one list, in handle order."""
+        tasks = [
+            ("get_user_posts", (handle, number, detail, incremental))
+            for handle in handles
+        ]
+        by_handle = {}
+        for task, posts in self.run(tasks):
+            handle = task[1][0]
+            if posts is None:
+                sys.stderr.write("Failed to crawl handle: %s\n" % handle)
+                continue
+            by_handle[handle] = posts
+
+        merged = []
+        for handle in handles:
+            merged.extend(by_handle.get(handle, []))
+        return merged
+
+    def stream_users(self, handles, sink, number=None, detail=False, incremental=False):
+        """Like crawl_users, but passes each post to `sink` as soon as a worker produces it."""
+        tasks = [
+            ("iter_user_posts", (handle, number, detail, incremental))
+            for handle in handles
+        ]
+        for task, count in self.run(tasks, on_record=lambda task, post: sink(post)):
+            if count is None:
+                sys.stderr.write("Failed to crawl handle: %s\n" % task[1][0])
+
+    def crawl_tags(self, tags, number=100):
+        """
+            Crawls the tag feeds side by side and merges their posts: a post
+            found under several tags is kept once, with all of them in `tags`.
+        """
+        tasks = [("get_latest_posts_by_tag", (tag, number)) for tag in tags]
+        by_tag = {}
+        for task, posts in self.run(tasks):
+            tag = task[1][0]
+            if posts is None:
+                sys.stderr.write("Failed to crawl tag: %s\n" % tag)
+                continue
+            by_tag[tag] = posts
+
+        return merge_tag_posts(post for tag in tags for post in by_tag.get(tag, []))
+
+    def report(self, out=sys.stderr):
+        total_posts, total_busy = 0, 0.0
+        for stats in self.stats.values():
+            info = stats.to_dict()
+            total_posts += stats.posts
+            total_busy += stats.busy
+            out.write(
+                "worker %(worker)s: %(tasks)s tasks, %(errors)s errors, "
+                "%(posts)s posts in %(busy_sec)ss (%(posts_per_sec)s posts/sec)\n"
+                % info
+            )
+        if total_busy:
+            out.write(
+                "pool: %s posts, %.3f posts/sec per worker\n"
+                % (total_posts, total_posts / total_busy)
+            )
@@ -0,0 +1,100 @@
+"""
+    Cache of crawled profiles, keyed by handle.
+
+    Profiles live in a small SQLite database under ~/.inscrawler, so every
+    crawler process on the machine (pool workers, the daemon, job queue
+    workers) shares what the others fetched. Entries carry the time they
+    were fetched; each caller decides how old a profile it accepts: profile
+    mode wants a recent one, a post count that only bounds a crawl can be
+    a day old.
+"""
+import json
+import sqlite3
+import threading
+import time
+
+from .utils import state_path
+
+# Seconds a cached profile is served for when the caller doesn't say
+DEFAULT_TTL = 3600
+
+SCHEMA_SQL = """
+CREATE TABLE IF NOT EXISTS profile (
+    handle TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+)
+"""
+
+
+class ProfileCache(object):
+    def __init__(self, path=None, ttl=DEFAULT_TTL):
+        self.path = path or state_path("profiles.sqlite3")
+        self.ttl = ttl
+        self.stats = {"hits": 0, "misses": 0, "stale": 0, "stores": 0}
+        self._lock = threading.Lock()
+        db = self._connect()
+        try:
+            db.execute(SCHEMA_SQL)
+        finally:
+            db.close()
+
+    def _connect(self):
+        # One short-lived connection per call: safe across threads and processes
+        db = sqlite3.connect(self.path, timeout=30)
+        db.execute("PRAGMA journal_mode=WAL")
+        return db
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def get(self, handle, max_age=None):
+        """
+            The cached profile of `handle` if it was fetched at most `max_age`
+            seconds ago (default: the cache's ttl), else None.
+        """
+        max_age = self.ttl if max_age is None else max_age
+        db = self._connect()
+        try:
+            row = db.execute(
+                "SELECT data, fetched_at FROM profile WHERE handle = ?", (handle.lower(),)
+            ).fetchone()
+        finally:
+            db.close()
+
+        if row is None:
+            self._count("misses")
+            return None
+        if time.time() - row[1] > max_age:
+            self._count("stale")
+            return None
+        self._count("hits")
+        return json.loads(row[0])
+
+    def put(self, handle, profile):
+        db = self._connect()
+        try:
+            with db:
+                db.execute(
+                    "INSERT OR REPLACE INTO profile (handle, data, fetched_at) VALUES (?, ?, ?)",
+                    (handle.lower(), json.dumps(profile, ensure_ascii=False), time.time()),
+                )
+        finally:
+            db.close()
+        self._count("stores")
+
+    def invalidate(self, handle):
+        db = self._connect()
+        try:
+            with db:
+                db.execute("DELETE FROM profile WHERE handle = ?", (handle.lower(),))
+        finally:
+            db.close()
+
+    def report(self):
+        """Lookups of this process: hits, misses, stale entries, and the hit rate."""
+        stats = dict(self.stats)
+        lookups = stats["hits"] + stats["misses"] + stats["stale"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else None
+        return stats
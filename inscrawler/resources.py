@@ -0,0 +1,144 @@
+"""
+    Which requests the browser is allowed to make. A policy blocks URL
+    patterns through CDP (Network.setBlockedURLs) before any page loads, so
+    images, videos, fonts and trackers a crawl mode never reads are not
+    downloaded at all.
+
+    Blocking is by URL pattern ("*" is a wildcard). CDP has no type-based
+    blocking without pausing every request in Fetch, which would cost a
+    round trip per request from Python, so each category is a list of
+    patterns that match its resources.
+"""
+import json
+
+CATEGORIES = {
+    "image": ["*.jpg*", "*.jpeg*", "*.png*", "*.gif*", "*.webp*", "*.heic*", "*.ico*"],
+    "media": ["*.mp4*", "*.m4a*", "*.m4v*", "*.webm*", "*.mp3*", "*.m3u8*"],
+    "font": ["*.woff*", "*.ttf*", "*.otf*", "*.eot*"],
+    "tracking": [
+        "*google-analytics.com*",
+        "*googletagmanager.com*",
+        "*doubleclick.net*",
+        "*connect.facebook.net*",
+        "*facebook.com/tr*",
+        "*/logging_client_events*",
+        "*/ajax/bz*",
+    ],
+}
+
+# Per crawl mode: what the mode never reads. Image URLs are read from the
+# DOM or GraphQL, so the images themselves are only needed to watch a
+# carousel advance in posts_full.
+PROFILES = {
+    "none": [],
+    "posts": ["image", "media", "font", "tracking"],
+    "posts_full": ["media", "font", "tracking"],
+    "profile": ["image", "media", "font", "tracking"],
+    "profile_script": ["image", "media", "font", "tracking"],
+    "hashtag": ["image", "media", "font", "tracking"],
+}
+
+# Typical transfer size per CDP resource type, used to estimate what a
+# blocked request would have cost when no request of that type loaded.
+TYPICAL_BYTES = {
+    "Image": 80000,
+    "Media": 1500000,
+    "Font": 40000,
+    "Script": 30000,
+    "Ping": 500,
+    "Other": 10000,
+}
+
+
+class ResourcePolicy(object):
+    def __init__(self, categories=(), patterns=()):
+        unknown = [c for c in categories if c not in CATEGORIES]
+        if unknown:
+            raise ValueError("Unknown resource categories: %s" % ", ".join(unknown))
+
+        self.categories = list(categories)
+        self.patterns = list(patterns)
+        self.loaded = {}
+        self.blocked = {}
+        self._types = {}
+
+    @classmethod
+    def for_profile(cls, name, extra=None):
+        """
+            The default policy of a crawl mode. `extra` is a comma separated
+            list of more categories or URL patterns to block.
+        """
+        if name not in PROFILES:
+            raise ValueError("Unknown resource profile: %s" % name)
+
+        categories = list(PROFILES[name])
+        patterns = []
+        for item in (extra or "").split(","):
+            item = item.strip()
+            if not item:
+                continue
+            if item in CATEGORIES:
+                if item not in categories:
+                    categories.append(item)
+            else:
+                patterns.append(item)
+        return cls(categories, patterns)
+
+    def blocked_urls(self):
+        urls = []
+        for category in self.categories:
+            urls.extend(CATEGORIES[category])
+        urls.extend(self.patterns)
+        return urls
+
+    def apply(self, driver):
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": self.blocked_urls()})
+
+    def observe(self, raw_message):
+        """Accounts one performance log message (the raw JSON string)."""
+        # Most messages are irrelevant, skip them before paying for json.loads
+        if not (
+            '"Network.loadingFinished"' in raw_message
+            or '"Network.loadingFailed"' in raw_message
+            or '"Network.responseReceived"' in raw_message
+        ):
+            return
+
+        message = json.loads(raw_message).get("message", {})
+        method = message.get("method")
+        params = message.get("params", {})
+        request_id = params.get("requestId")
+
+        if method == "Network.responseReceived":
+            self._types[request_id] = params.get("type", "Other")
+        elif method == "Network.loadingFinished":
+            kind = self._types.pop(request_id, "Other")
+            stats = self.loaded.setdefault(kind, {"count": 0, "bytes": 0})
+            stats["count"] += 1
+            stats["bytes"] += int(params.get("encodedDataLength") or 0)
+        elif method == "Network.loadingFailed" and params.get("blockedReason"):
+            kind = params.get("type", "Other")
+            self.blocked[kind] = self.blocked.get(kind, 0) + 1
+
+    def estimated_bytes_saved(self):
+        saved = 0
+        for kind, count in self.blocked.items():
+            loaded = self.loaded.get(kind)
+            if loaded and loaded["count"]:
+                average = loaded["bytes"] / loaded["count"]
+            else:
+                average = TYPICAL_BYTES.get(kind, TYPICAL_BYTES["Other"])
+            saved += count * average
+        return int(saved)
+
+    def report(self):
+        return {
+            "categories": self.categories,
+            "patterns": self.patterns,
+            "loaded": self.loaded,
+            "loaded_bytes": sum(s["bytes"] for s in self.loaded.values()),
+            "blocked": self.blocked,
+            "blocked_requests": sum(self.blocked.values()),
+            "estimated_bytes_saved": self.estimated_bytes_saved(),
+        }
@@ -0,0 +1,240 @@
+"""
+    Paces every navigation, scroll and click that makes the site send
+    requests.
+
+    Each paced action takes a token from the session's bucket and, when a
+    global rate is set, from a bucket shared by every crawler process on the
+    machine (its state is a small JSON file under ~/.inscrawler, updated
+    under an exclusive lock). Tokens may be borrowed: taking one from an
+    empty bucket returns how long to wait for it, so the wait is the only
+    sleep.
+
+    The session rate is adaptive (AIMD). By default it has no limit until
+    the site pushes back: a throttled response, an HTTP 429 or a soft-block
+    page seen in the network log, halves it (starting from the pace the
+    session was keeping) and pauses every session sharing the global
+    bucket, for longer on every throttle in a row. Every `recovery` paced
+    actions without one add `increase` back, up to the configured rate if
+    there is one.
+"""
+import fcntl
+import json
+import random
+import re
+import sys
+import threading
+import time
+from collections import deque
+
+from .utils import state_path
+
+# Navigations, scrolls and clicks per second; None is no limit until a throttle
+DEFAULT_RATE = None
+DEFAULT_BURST = 5
+# Paced actions the pace before a throttle is measured over, and the rate
+# to fall back to when there are too few of them
+PACE_WINDOW = 20
+FALLBACK_RATE = 1.0
+
+THROTTLED_STATUS = re.compile(r'"status":\s*429\b')
+SOFT_BLOCK = re.compile(r'"url":\s*"[^"]*/(?:challenge|accounts/suspended)/')
+
+
+def throttle_reason(raw):
+    """Why a raw performance log message shows the crawler being throttled, or None."""
+    if '"Network.responseReceived"' not in raw:
+        return None
+    if THROTTLED_STATUS.search(raw):
+        return "HTTP 429"
+    if SOFT_BLOCK.search(raw):
+        return "soft block"
+    return None
+
+
+class TokenBucket(object):
+    def __init__(self, rate, burst=None):
+        """A `rate` of None hands out tokens without limit, pauses aside."""
+        self.rate = rate
+        self.burst = burst or max(1.0, rate or 0)
+        self.state = {"tokens": self.burst, "updated": time.time(), "paused_until": 0.0}
+        self._lock = threading.Lock()
+
+    def _update(self, fn):
+        with self._lock:
+            return fn(self.state)
+
+    def _take(self, state):
+        now = time.time()
+        if self.rate is None:
+            return max(0.0, state["paused_until"] - now)
+        elapsed = max(0.0, now - state["updated"])
+        state["tokens"] = min(self.burst, state["tokens"] + elapsed * self.rate)
+        state["updated"] = now
+        state["tokens"] -= 1
+        return max(0.0, -state["tokens"] / self.rate, state["paused_until"] - now)
+
+    def take(self):
+        """Takes one token; returns how many seconds to wait before using it."""
+        return self._update(self._take)
+
+    def pause(self, seconds):
+        """Hands out no token for `seconds` from now."""
+
+        def pause(state):
+            state["paused_until"] = max(state["paused_until"], time.time() + seconds)
+
+        self._update(pause)
+
+
+class SharedTokenBucket(TokenBucket):
+    """A token bucket whose state is shared through a locked file by every process using `path`."""
+
+    def __init__(self, path, rate, burst=None):
+        super(SharedTokenBucket, self).__init__(rate, burst)
+        self.path = path
+
+    def _update(self, fn):
+        with self._lock, open(self.path, "a+", encoding="utf8") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            text = f.read()
+            try:
+                state = json.loads(text) if text.strip() else dict(self.state)
+            except ValueError:
+                state = dict(self.state)
+            result = fn(state)
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(state))
+            # Closing the file releases the lock
+        return result
+
+
+class Scheduler(object):
+    def __init__(
+        self,
+        rate=DEFAULT_RATE,
+        burst=DEFAULT_BURST,
+        global_rate=None,
+        global_burst=None,
+        min_rate=0.05,
+        decrease=0.5,
+        increase=None,
+        recovery=20,
+        cooldown=30,
+        max_pause=600,
+        jitter=0.25,
+    ):
+        """
+            `rate` is the session's ceiling in paced actions per second
+            (None for none: the first throttle sets the rate from the pace
+            of the last PACE_WINDOW actions), `global_rate` the ceiling
+            shared by every process on the machine (None for no shared
+            limit). After a throttle the rate drops by `decrease` (never
+            below `min_rate`) and everything
+            pauses for `cooldown` seconds, doubled for every throttle in a
+            row up to `max_pause`. `jitter` adds up to that fraction of an
+            interval to every wait so the pace isn't mechanical.
+        """
+        self.ceiling = rate
+        self.min_rate = min(min_rate, rate) if rate else min_rate
+        self.decrease = decrease
+        self.increase = increase or (rate / 10.0 if rate else None)
+        self.recovery = recovery
+        self.cooldown = cooldown
+        self.max_pause = max_pause
+        self.jitter = jitter
+        self.session = TokenBucket(rate, burst)
+        self.shared = None
+        if global_rate:
+            self.shared = SharedTokenBucket(
+                state_path("scheduler.json"), global_rate, global_burst
+            )
+        self.healthy = 0
+        self.streak = 0
+        self.backoff_until = 0.0
+        self.requests = {}
+        self.waited = 0.0
+        self.throttles = {}
+        # When the latest paced actions went out, for a rate to back off from
+        self.recent = deque(maxlen=PACE_WINDOW)
+        self._lock = threading.Lock()
+
+    @property
+    def rate(self):
+        return self.session.rate
+
+    def delay(self):
+        """Takes a token from every bucket; returns how long to wait for all of them."""
+        delay = self.session.take()
+        if self.shared:
+            delay = max(delay, self.shared.take())
+        if self.jitter and self.session.rate:
+            delay += random.uniform(0, self.jitter / self.session.rate)
+        return delay
+
+    def acquire(self, kind="request"):
+        """Blocks until an action of `kind` may go out; returns the seconds waited."""
+        delay = self.delay()
+        if delay:
+            time.sleep(delay)
+
+        with self._lock:
+            self.requests[kind] = self.requests.get(kind, 0) + 1
+            self.waited += delay
+            self.recent.append(time.time())
+            self.healthy += 1
+            if self.healthy >= self.recovery:
+                self.healthy = 0
+                self.streak = 0
+                rate = self.session.rate
+                if rate is not None and (self.ceiling is None or rate < self.ceiling):
+                    rate += self.increase
+                    self.session.rate = min(self.ceiling, rate) if self.ceiling else rate
+        return delay
+
+    def pace(self):
+        """Paced actions per second over the last PACE_WINDOW ones, None if unknown."""
+        if len(self.recent) < 2 or self.recent[-1] <= self.recent[0]:
+            return None
+        return (len(self.recent) - 1) / (self.recent[-1] - self.recent[0])
+
+    def throttled(self, reason):
+        """Backs off after a throttled response: lower rate, and a pause for every session."""
+        with self._lock:
+            self.throttles[reason] = self.throttles.get(reason, 0) + 1
+            self.healthy = 0
+            # The responses of one burst all come back throttled; back off once for them
+            if time.time() < self.backoff_until:
+                return
+            self.streak += 1
+            rate = self.session.rate or self.pace() or FALLBACK_RATE
+            self.increase = self.increase or rate / 10.0
+            self.session.rate = max(self.min_rate, rate * self.decrease)
+            pause = min(self.max_pause, self.cooldown * 2 ** (self.streak - 1))
+            self.backoff_until = time.time() + pause
+
+        sys.stderr.write(
+            "Throttled (%s): pausing %.1fs, rate now %.2f/sec\n" % (reason, pause, self.session.rate)
+        )
+        self.session.pause(pause)
+        if self.shared:
+            self.shared.pause(pause)
+
+    def observe(self, raw):
+        """Feeds one raw performance log message; backs off if it shows throttling."""
+        reason = throttle_reason(raw)
+        if reason:
+            self.throttled(reason)
+
+    def report(self):
+        pace = self.pace()
+        return {
+            "rate": round(self.session.rate, 3) if self.session.rate else None,
+            "pace": round(pace, 3) if pace else None,
+            "ceiling": self.ceiling,
+            "global_rate": self.shared.rate if self.shared else None,
+            "requests": dict(self.requests),
+            "waited_sec": round(self.waited, 3),
+            "throttled": dict(self.throttles),
+        }
@@ -0,0 +1,187 @@
+"""
+    In-page extraction scripts. Each one collects everything it needs with a
+    single execute_script round trip and returns a plain JSON object.
+"""
+
+_HELPERS = """
+    function text(e) { return e ? (e.innerText || "").trim() : null; }
+    function all(sel, root) {
+        return Array.prototype.slice.call((root || document).querySelectorAll(sel));
+    }
+    function one(sel, root) { return (root || document).querySelector(sel); }
+"""
+
+POST_MODAL = _HELPERS + """
+    var img = one("div._aagv img");
+    var time = one("time.x1p4m5qa");
+    var header = one("div._aaqt._aaqu");
+    var caption = one("div.xt0psk2 h1");
+    return {
+        img_url: img ? img.getAttribute("src") : null,
+        timestamp: time ? time.getAttribute("datetime") : null,
+        creators: header ? all("a", header).map(text).filter(Boolean) : [],
+        caption: caption ? caption.innerText : null,
+        mentions: caption ? all("a", caption).map(text).filter(function(t) {
+            return t && t.charAt(0) === "@";
+        }) : []
+    };
+"""
+
+# Poster, location and the caption (first comment) of a post page
+POST_DETAILS = _HELPERS + """
+    var first = one("ul.XQXOT .ZyFrc");
+    return {
+        username: text(one("a.ZIAjV")),
+        location: text(one("a.O4GlU")),
+        description: first ? text(one("span", first)) : null
+    };
+"""
+
+# Grid cells are matched by a container selector; a cell's link is its first
+# <a>, and a pinned post carries the pin icon the grid draws over it
+GRID_POSTS = """
+    return Array.prototype.map.call(
+        document.querySelectorAll(arguments[0]),
+        function(el) {
+            var a = el.querySelector("a");
+            return {
+                href: a ? a.href : null,
+                pinned: !!el.querySelector("svg[aria-label*='Pinned'], svg[aria-label*='pinned']")
+            };
+        }
+    );
+"""
+
+CLICK_LINK = """
+    var cells = document.querySelectorAll(arguments[0]);
+    for (var i = 0; i < cells.length; i++) {
+        var a = cells[i].querySelector("a");
+        if (a && a.href === arguments[1]) { a.click(); return true; }
+    }
+    return false;
+"""
+
+_COMMENT_HELPERS = """
+    function lastText(el) {
+        var value = null;
+        all("span", el).forEach(function(span) {
+            var t = span.innerText;
+            if (t && t !== "Verified") { value = t; }
+        });
+        return value;
+    }
+    function firstText(el) {
+        var spans = all("span", el);
+        for (var i = 0; i < spans.length; i++) {
+            var t = spans[i].innerText;
+            if (t && t !== "Verified") { return t; }
+        }
+        return null;
+    }
+"""
+
+# The first .gElp9 block of a post is the caption, the rest are comments
+POST_COMMENTS = _HELPERS + _COMMENT_HELPERS + """
+    var blocks = all(".eo2As .gElp9");
+    return {
+        caption: blocks.length ? firstText(blocks[0]) : null,
+        comments: blocks.slice(1).map(function(el) {
+            return {author: text(one(".FPmhX", el)), comment: lastText(el)};
+        })
+    };
+"""
+
+PROFILE_HEADER = _HELPERS + """
+    var photo = one("._6q-tv");
+    var stats = one(".xc3tme8");
+    return {
+        name: text(one("h2 span")),
+        desc: text(one(".-vDIg span")),
+        photo_url: photo ? photo.getAttribute("src") : null,
+        statistics: stats ? all("span", stats).map(text) : []
+    };
+"""
+
+# Async: returns the rows of arguments[0] not returned before (they get
+# marked), waiting up to arguments[1] ms for new ones to render, then
+# scrolls the last row into view so the next page starts loading
+NEW_ROWS = _HELPERS + """
+    var sel = arguments[0], timeout = arguments[1];
+    var done = arguments[arguments.length - 1];
+    var started = Date.now();
+    function harvest() {
+        var rows = [];
+        all(sel).forEach(function(a) {
+            if (a.getAttribute("data-ic-seen")) { return; }
+            a.setAttribute("data-ic-seen", "1");
+            var img = one("img", a);
+            rows.push({
+                href: a.getAttribute("href"),
+                title: a.getAttribute("title") || text(a),
+                img: img ? img.getAttribute("src") : null
+            });
+        });
+        return rows;
+    }
+    (function poll() {
+        var rows = harvest();
+        if (rows.length || Date.now() - started >= timeout) {
+            var last = all(sel).pop();
+            if (last) { last.scrollIntoView(); }
+            done(rows);
+        } else {
+            setTimeout(poll, 100);
+        }
+    })();
+"""
+
+# Async: returns the comments of the open post not returned before, with
+# their permalink id, timestamp and parent, then clicks every "load more"
+# and "view replies" button (arguments[1]) at once and waits up to
+# arguments[0] ms for what they load. A reply sits in the thread
+# (ul.Mr508) whose first block is its parent.
+COMMENTS_PAGE = _HELPERS + _COMMENT_HELPERS + """
+    var timeout = arguments[0], buttonsSel = arguments[1];
+    var done = arguments[arguments.length - 1];
+    var seq = window.__icCommentSeq || 0;
+    function idOf(el) {
+        if (!el.getAttribute("data-ic-id")) {
+            var link = one("a[href*='/c/']", el);
+            var match = link && link.getAttribute("href").match(/\/c\/([^\/]+)/);
+            // Made up when there is no permalink: CommentEngine matches it by content
+            el.setAttribute("data-ic-id", match ? match[1] : "dom" + (++seq));
+        }
+        return el.getAttribute("data-ic-id");
+    }
+    function parentOf(el) {
+        var thread = el.parentElement && el.parentElement.closest("ul.Mr508");
+        var first = thread ? one(".gElp9", thread) : null;
+        return first && first !== el ? idOf(first) : null;
+    }
+    var comments = [];
+    all(".eo2As .gElp9").slice(1).forEach(function(el) {
+        if (el.getAttribute("data-ic-seen")) { return; }
+        el.setAttribute("data-ic-seen", "1");
+        var time = one("time", el);
+        comments.push({
+            id: idOf(el),
+            author: text(one(".FPmhX", el)),
+            comment: lastText(el),
+            timestamp: time ? time.getAttribute("datetime") : null,
+            parent: parentOf(el)
+        });
+    });
+    window.__icCommentSeq = seq;
+
+    var buttons = all(buttonsSel);
+    if (!buttons.length) { done({comments: comments, more: false}); return; }
+    buttons.forEach(function(b) { (b.closest("button") || b).click(); });
+    var before = all(".eo2As .gElp9").length, started = Date.now();
+    (function wait() {
+        if (all(".eo2As .gElp9").length > before || Date.now() - started >= timeout) {
+            done({comments: comments, more: true});
+        } else {
+            setTimeout(wait, 50);
+        }
+    })();
+"""
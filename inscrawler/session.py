@@ -0,0 +1,69 @@
+import json
+import os
+import time
+
+from .utils import state_path
+
+AUTH_COOKIE = "sessionid"
+
+
+class SessionStore(object):
+    """
+        Persists the cookies and local storage of a logged-in browser so the
+        next run can skip InsCrawler.login().
+    """
+
+    def __init__(self, username, path=None):
+        self.username = username
+        self.path = path or state_path("sessions", "%s.json" % (username or "default"))
+
+    def load(self):
+        try:
+            with open(self.path, encoding="utf8") as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
+
+    def save(self, browser):
+        data = {
+            "saved_at": int(time.time()),
+            "cookies": browser.get_cookies(),
+            "local_storage": browser.get_local_storage(),
+        }
+        tmp_path = self.path + ".tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf8") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def has_valid_cookie(data, now=None):
+        """Cheap offline check: the auth cookie exists and has not expired."""
+        now = now or time.time()
+        for cookie in data.get("cookies", []):
+            if cookie.get("name") != AUTH_COOKIE or not cookie.get("value"):
+                continue
+            expiry = cookie.get("expiry")
+            return expiry is None or expiry > now
+        return False
+
+    def restore(self, browser, url):
+        """
+            Restores the saved session into the browser and loads `url` once.
+            Returns False if there is nothing usable to restore.
+        """
+        data = self.load()
+        if not data or not self.has_valid_cookie(data):
+            return False
+
+        # Cookies go in through CDP so we don't need to visit the domain first
+        browser.set_cookies(data["cookies"])
+        browser.get(url)
+        browser.set_local_storage(data.get("local_storage") or {})
+        return True
@@ -27,3 +27,12 @@ def override_settings(args):
 def prepare_override_settings(parser):
     for name in defaults.keys():
         parser.add_argument("--" + name, action="store_true")
+
+
+def dump_settings():
+    return {name: getattr(settings, name) for name in defaults.keys()}
+
+
+def load_settings(values):
+    for name, value in values.items():
+        setattr(settings, name, value)
@@ -0,0 +1,145 @@
+"""
+    A pool of tabs in the browser's one Chrome process.
+
+    WebDriver only talks to one tab at a time, but tabs load in parallel:
+    the pool starts a page in every free tab without waiting for it, then
+    goes round the tabs running one probe script in each, and hands a tab
+    its next page as soon as its probe is satisfied. The waits for N pages
+    overlap instead of adding up, for the memory of one browser.
+
+    Every use of a tab happens under the pool's lock, so fetch functions on
+    other threads can't switch the window under each other.
+"""
+import threading
+import time
+from collections import deque
+
+# Prepended to every probe: nothing is read before the tab's next page has
+# replaced the one it was sent away from
+_LOADED = """
+    if (window.__icPending || document.readyState === "loading") { return null; }
+"""
+
+
+class TabPool(object):
+    def __init__(self, browser, size=4, poll=0.1):
+        self.browser = browser
+        self.size = size
+        self.poll = poll
+        self.handles = []
+        self.home = None
+        self.stats = {"pages": 0, "timeouts": 0, "errors": 0, "busy_sec": 0.0, "load_sec": 0.0}
+        self._lock = threading.RLock()
+
+    @property
+    def driver(self):
+        return self.browser.driver
+
+    def _open(self):
+        """Opens the pool's tabs next to the browser's current one, once."""
+        if self.handles:
+            return
+        self.home = self.driver.current_window_handle
+        before = set(self.driver.window_handles)
+        for _ in range(self.size):
+            self.driver.execute_script("window.open('about:blank');")
+        self.handles = [h for h in self.driver.window_handles if h not in before]
+        self.prepare()
+
+    def prepare(self):
+        """Applies the browser's resource policy in every pool tab (CDP is per tab)."""
+        with self._lock:
+            if not self.handles:
+                return
+            try:
+                for handle in self.handles:
+                    self.driver.switch_to.window(handle)
+                    self.browser.prepare_tab()
+            finally:
+                self.driver.switch_to.window(self.home)
+
+    def _send(self, handle, url):
+        self.driver.switch_to.window(handle)
+        self.browser.pace("navigate")
+        # Doesn't wait for the load, unlike driver.get
+        self.driver.execute_script(
+            "window.__icPending = true; window.location.href = arguments[0];", url
+        )
+
+    def _probe(self, handle, script, args):
+        self.driver.switch_to.window(handle)
+        return self.driver.execute_script(_LOADED + script, *args)
+
+    def map(self, urls, script, *args, ready=bool, timeout=15):
+        """
+            Loads every url in a pool tab and yields (url, result) in the
+            order the pages get ready. `script` is an extractor (see
+            scripts) run in the tab until `ready(result)` holds, or once
+            more after `timeout` seconds; it gets `args`. The browser is
+            back on its own tab whenever a result is yielded.
+        """
+        queue = deque(urls)
+        if not queue:
+            return
+
+        with self._lock:
+            self._open()
+            free = list(self.handles)
+            # handle -> (url, sent at)
+            active = {}
+            started = time.time()
+            try:
+                while queue or active:
+                    while free and queue:
+                        handle, url = free.pop(), queue.popleft()
+                        self._send(handle, url)
+                        active[handle] = (url, time.time())
+
+                    finished = []
+                    for handle, (url, sent) in active.items():
+                        timed_out = time.time() - sent > timeout
+                        try:
+                            result = self._probe(handle, script, args)
+                        except Exception:
+                            if not timed_out:
+                                continue
+                            self.stats["errors"] += 1
+                            result = None
+                        if not ready(result) and not timed_out:
+                            continue
+                        if timed_out:
+                            self.stats["timeouts"] += 1
+                        self.stats["pages"] += 1
+                        self.stats["load_sec"] += time.time() - sent
+                        finished.append(handle)
+                        # The caller may use the browser before the next round
+                        self.driver.switch_to.window(self.home)
+                        yield url, result
+
+                    for handle in finished:
+                        del active[handle]
+                        free.append(handle)
+                    if not finished:
+                        time.sleep(self.poll)
+            finally:
+                self.stats["busy_sec"] += time.time() - started
+                self.driver.switch_to.window(self.home)
+
+    def close(self):
+        with self._lock:
+            for handle in self.handles:
+                self.driver.switch_to.window(handle)
+                self.driver.close()
+            self.handles = []
+            if self.home:
+                self.driver.switch_to.window(self.home)
+
+    def report(self):
+        """Pages loaded, and how much faster than one at a time (load time / wall time)."""
+        stats = dict(self.stats)
+        stats["overlap"] = (
+            round(stats["load_sec"] / stats["busy_sec"], 2) if stats["busy_sec"] else None
+        )
+        stats["busy_sec"] = round(stats["busy_sec"], 3)
+        stats["load_sec"] = round(stats["load_sec"], 3)
+        return stats
@@ -1,4 +1,6 @@
+import os
 import random
+import time
 from functools import wraps
 from time import sleep
 
@@ -9,24 +11,148 @@ def instagram_int(string):
     return int(string.replace(",", ""))
 
 
-def retry(attempt=10, wait=0.3):
-    def wrap(func):
-        @wraps(func)
-        def wrapped_f(*args, **kwargs):
+def _default_retryable():
+    # Imported late so modules that never touch a browser don't load selenium
+    from selenium.common.exceptions import StaleElementReferenceException
+    from selenium.common.exceptions import TimeoutException
+
+    return (RetryException, TimeoutException, StaleElementReferenceException)
+
+
+class RetryPolicy(object):
+    """
+        Retries a call on the exceptions in `retry_on` (by default
+        RetryException, selenium's TimeoutException and stale elements)
+        with exponential backoff and jitter. A call gives up after
+        `attempts` attempts or `timeout` seconds, whichever comes first, and
+        the calls since the last reset_budget() together may spend at most
+        `budget` seconds retrying, which bounds what a crawl loses to slow
+        pages. Giving up raises a RetryException whose __cause__ is the last
+        error.
+
+            policy = RetryPolicy(timeout=30, budget=600)
+
+            @policy.wrap()
+            def check_login():
+                ...
+    """
+
+    def __init__(
+        self,
+        attempts=10,
+        wait=0.3,
+        factor=2,
+        max_wait=5,
+        jitter=0.5,
+        timeout=None,
+        budget=None,
+        retry_on=None,
+    ):
+        self.attempts = attempts
+        self.wait = wait
+        self.factor = factor
+        self.max_wait = max_wait
+        self.jitter = jitter
+        self.timeout = timeout
+        self.budget = budget
+        self.retry_on = retry_on
+        # Seconds spent on attempts that failed and the waits after them,
+        # every call since the last reset_budget()
+        self.spent = 0.0
+        self.stats = {}
+
+    def reset_budget(self):
+        """Starts a new budget, at the start of every crawl; the stats keep counting."""
+        self.spent = 0.0
+
+    def backoff(self, attempt):
+        """Seconds to wait after the `attempt`-th failure."""
+        wait = min(self.max_wait, self.wait * self.factor ** (attempt - 1))
+        return wait * random.uniform(1 - self.jitter, 1)
+
+    def _stats(self, label):
+        stats = self.stats.get(label)
+        if stats is None:
+            stats = self.stats[label] = {
+                "calls": 0, "attempts": 0, "retries": 0, "failures": 0, "retry_sec": 0.0,
+            }
+        return stats
+
+    def call(self, func, *args, **kwargs):
+        return self.run(func, args, kwargs)
+
+    def run(self, func, args=(), kwargs=None, label=None, timeout=None):
+        retry_on = self.retry_on or _default_retryable()
+        label = label or func.__name__
+        timeout = timeout if timeout is not None else self.timeout
+        stats = self._stats(label)
+        stats["calls"] += 1
+        start = time.time()
+        deadline = start + timeout if timeout is not None else None
+        attempt = 0
+
+        while True:
+            attempt += 1
+            stats["attempts"] += 1
+            attempt_start = time.time()
             try:
-                return func(*args, **kwargs)
-            except RetryException:
-                if attempt > 1:
-                    sleep(wait)
-                    return retry(attempt - 1, wait)(func)(*args, **kwargs)
-                else:
-                    exc = RetryException()
-                    exc.__cause__ = None
-                    raise exc
+                return func(*args, **(kwargs or {}))
+            except retry_on as e:
+                error = e
+
+            wait = self.backoff(attempt)
+            now = time.time()
+            lost = now - attempt_start
+            self.spent += lost
+            stats["retry_sec"] += lost
+
+            reason = None
+            if attempt >= self.attempts:
+                reason = "its attempt limit"
+            elif deadline is not None and now + wait > deadline:
+                reason = "its %ss timeout" % timeout
+            elif self.budget is not None and self.spent + wait > self.budget:
+                reason = "the %ss retry budget" % self.budget
+            if reason:
+                stats["failures"] += 1
+                exc = RetryException(
+                    "%s gave up after %s (%d attempts, %.1fs): %r"
+                    % (label, reason, attempt, now - start, error)
+                )
+                raise exc from error
+
+            stats["retries"] += 1
+            sleep(wait)
+            self.spent += wait
+            stats["retry_sec"] += wait
+
+    def wrap(self, label=None, timeout=None):
+        """Decorator form of run(), with an optional per-call `timeout`."""
+
+        def wrap(func):
+            @wraps(func)
+            def wrapped_f(*args, **kwargs):
+                return self.run(func, args, kwargs, label, timeout)
+
+            return wrapped_f
 
-        return wrapped_f
+        return wrap
 
-    return wrap
+    def report(self):
+        return {
+            label: dict(stats, retry_sec=round(stats["retry_sec"], 3))
+            for label, stats in sorted(self.stats.items())
+        }
+
+
+def state_path(*parts):
+    """Path under the crawler's state directory ($INSCRAWLER_HOME or ~/.inscrawler)."""
+    base = os.environ.get("INSCRAWLER_HOME") or os.path.join(
+        os.path.expanduser("~"), ".inscrawler"
+    )
+    path = os.path.join(base, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
 
 
 def randmized_sleep(average=1):
@@ -34,6 +160,26 @@ def randmized_sleep(average=1):
     sleep(random.uniform(_min, _max))
 
 
+def merge_tag_posts(posts):
+    """
+        Posts of several tag feeds, each once and in first-seen order, with
+        `tags` listing every tag it was found under. Fields missing from the
+        first sighting are filled in from later ones.
+    """
+    merged = {}
+    for post in posts:
+        known = merged.get(post["key"])
+        if known is None:
+            merged[post["key"]] = dict(post, tags=list(post.get("tags") or []))
+            continue
+        for tag in post.get("tags") or []:
+            if tag not in known["tags"]:
+                known["tags"].append(tag)
+        for name, value in post.items():
+            known.setdefault(name, value)
+    return list(merged.values())
+
+
 def validate_posts(dict_posts):
     """
         The validator is to verify if the posts are fetched wrong.
@@ -0,0 +1,408 @@
+"""
+Crawl job queue in Postgres, shared by crawler workers on any number of machines.
+
+Jobs live in galvor.crawl_job. A worker claims the next queued job with
+SELECT ... FOR UPDATE SKIP LOCKED, so concurrent workers never block on or
+double-claim a job. A claimed job carries a lease that the worker's
+heartbeat keeps extending; a job whose lease runs out (its worker died or
+hung) goes back to the queue, or fails for good after max_attempts. Every
+job ends with a status and a JSON result summary.
+
+    docker-compose up -d postgres
+    python job_queue.py init
+    python job_queue.py add posts cal_foodie foodie_tw -n 100
+    python job_queue.py add hashtag taiwan -n 200
+    python job_queue.py work -o ./posts.ndjson          # on every crawler machine
+    python job_queue.py status
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextlib import redirect_stdout
+
+import psycopg2.extras
+
+from save_to_db import DB_SCHEMA
+from save_to_db import create_pool
+
+KINDS = ["posts", "posts_full", "profile", "hashtag"]
+DEFAULT_LEASE = 300
+DEFAULT_MAX_ATTEMPTS = 3
+# Seconds before a failed job is tried again, times its attempt number
+RETRY_DELAY = 60
+
+SCHEMA_SQL = """
+CREATE SCHEMA IF NOT EXISTS %(schema)s;
+CREATE TABLE IF NOT EXISTS %(schema)s.crawl_job (
+    id BIGSERIAL PRIMARY KEY,
+    kind TEXT NOT NULL,
+    target TEXT NOT NULL,
+    params JSONB NOT NULL DEFAULT '{}',
+    status TEXT NOT NULL DEFAULT 'queued'
+        CHECK (status IN ('queued', 'running', 'done', 'failed', 'cancelled')),
+    priority INT NOT NULL DEFAULT 0,
+    attempts INT NOT NULL DEFAULT 0,
+    max_attempts INT NOT NULL DEFAULT 3,
+    worker TEXT,
+    lease_until TIMESTAMPTZ,
+    heartbeat_at TIMESTAMPTZ,
+    run_after TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    created_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    started_at TIMESTAMPTZ,
+    finished_at TIMESTAMPTZ,
+    result JSONB,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS crawl_job_queued
+    ON %(schema)s.crawl_job (priority DESC, id) WHERE status = 'queued';
+CREATE INDEX IF NOT EXISTS crawl_job_leases
+    ON %(schema)s.crawl_job (lease_until) WHERE status = 'running';
+-- A target is queued or running at most once per kind
+CREATE UNIQUE INDEX IF NOT EXISTS crawl_job_active
+    ON %(schema)s.crawl_job (kind, target) WHERE status IN ('queued', 'running');
+"""
+
+CLAIM_SQL = """
+UPDATE crawl_job SET
+    status = 'running',
+    worker = %(worker)s,
+    attempts = attempts + 1,
+    lease_until = NOW() + %(lease)s * INTERVAL '1 second',
+    heartbeat_at = NOW(),
+    started_at = NOW(),
+    error = NULL
+WHERE id = (
+    SELECT id FROM crawl_job
+    WHERE status = 'queued' AND run_after <= NOW() AND kind = ANY(%(kinds)s)
+    ORDER BY priority DESC, id
+    FOR UPDATE SKIP LOCKED
+    LIMIT 1
+)
+RETURNING id, kind, target, params, attempts
+"""
+
+REQUEUE_EXPIRED_SQL = """
+UPDATE crawl_job SET
+    status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,
+    finished_at = CASE WHEN attempts >= max_attempts THEN NOW() END,
+    error = 'lease expired on worker ' || COALESCE(worker, '?'),
+    worker = NULL,
+    lease_until = NULL
+WHERE id IN (
+    SELECT id FROM crawl_job
+    WHERE status = 'running' AND lease_until < NOW()
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING id, status
+"""
+
+
+def worker_name():
+    return "%s:%d" % (socket.gethostname(), os.getpid())
+
+
+class JobQueue:
+    """Job table operations; every call is one short transaction on a pooled connection."""
+
+    def __init__(self, pool=None, lease=DEFAULT_LEASE):
+        self.pool = pool or create_pool(1, 2)
+        self.lease = lease
+
+    @contextmanager
+    def cursor(self):
+        conn = self.pool.getconn()
+        try:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+                yield cursor
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self.pool.putconn(conn)
+
+    def init(self):
+        with self.cursor() as cursor:
+            cursor.execute(SCHEMA_SQL % {"schema": DB_SCHEMA})
+
+    def add(self, kind, targets, params=None, priority=0, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        """Queues one job per target; targets already queued or running are skipped. Returns the new ids."""
+        rows = [
+            (kind, target, json.dumps(params or {}), priority, max_attempts)
+            for target in targets
+        ]
+        with self.cursor() as cursor:
+            ids = psycopg2.extras.execute_values(
+                cursor,
+                """
+                INSERT INTO crawl_job (kind, target, params, priority, max_attempts)
+                VALUES %s
+                ON CONFLICT (kind, target) WHERE status IN ('queued', 'running') DO NOTHING
+                RETURNING id
+                """,
+                rows,
+                fetch=True,
+            )
+        return [row["id"] for row in ids]
+
+    def requeue_expired(self):
+        """Puts the jobs of dead workers back in the queue (or fails them); returns the rows."""
+        with self.cursor() as cursor:
+            cursor.execute(REQUEUE_EXPIRED_SQL)
+            return cursor.fetchall()
+
+    def claim(self, worker, kinds=KINDS):
+        """The next job for `worker`, leased to it, or None if the queue is empty."""
+        with self.cursor() as cursor:
+            cursor.execute(CLAIM_SQL, {"worker": worker, "lease": self.lease, "kinds": list(kinds)})
+            return cursor.fetchone()
+
+    def heartbeat(self, job_id, worker):
+        """Extends the job's lease; False once the job is no longer this worker's."""
+        with self.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE crawl_job
+                SET lease_until = NOW() + %s * INTERVAL '1 second', heartbeat_at = NOW()
+                WHERE id = %s AND worker = %s AND status = 'running'
+                """,
+                (self.lease, job_id, worker),
+            )
+            return cursor.rowcount == 1
+
+    def complete(self, job_id, worker, result):
+        with self.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE crawl_job
+                SET status = 'done', result = %s, finished_at = NOW(), lease_until = NULL
+                WHERE id = %s AND worker = %s AND status = 'running'
+                """,
+                (json.dumps(result), job_id, worker),
+            )
+            return cursor.rowcount == 1
+
+    def fail(self, job_id, worker, error, result=None):
+        """Queues the job again after a delay, or fails it for good after max_attempts."""
+        with self.cursor() as cursor:
+            cursor.execute(
+                """
+                UPDATE crawl_job SET
+                    status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,
+                    finished_at = CASE WHEN attempts >= max_attempts THEN NOW() END,
+                    run_after = NOW() + attempts * %s * INTERVAL '1 second',
+                    error = %s,
+                    result = %s,
+                    worker = NULL,
+                    lease_until = NULL
+                WHERE id = %s AND worker = %s AND status = 'running'
+                RETURNING status
+                """,
+                (RETRY_DELAY, error, json.dumps(result) if result else None, job_id, worker),
+            )
+            row = cursor.fetchone()
+            return row["status"] if row else None
+
+    def status(self):
+        """Job counts per kind and status, plus the running jobs."""
+        with self.cursor() as cursor:
+            cursor.execute(
+                "SELECT kind, status, COUNT(*) AS jobs FROM crawl_job GROUP BY kind, status ORDER BY kind, status"
+            )
+            counts = cursor.fetchall()
+            cursor.execute(
+                """
+                SELECT id, kind, target, worker, attempts, heartbeat_at, lease_until
+                FROM crawl_job WHERE status = 'running' ORDER BY started_at
+                """
+            )
+            running = cursor.fetchall()
+        return counts, running
+
+
+class Heartbeat:
+    """Extends a claimed job's lease every lease/3 seconds on a background thread."""
+
+    def __init__(self, queue, job_id, worker):
+        self.queue = queue
+        self.job_id = job_id
+        self.worker = worker
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.queue.lease / 3.0):
+            try:
+                if not self.queue.heartbeat(self.job_id, self.worker):
+                    self.lost = True
+                    print(f"⚠️ Lost the lease on job {self.job_id}", file=sys.stderr)
+                    return
+            except Exception as e:
+                # A missed beat is fine as long as the next one lands before the lease ends
+                print(f"⚠️ Heartbeat for job {self.job_id} failed: {e}", file=sys.stderr)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+class JobWorker:
+    """
+    Claims and runs jobs with one long-lived InsCrawler. Posts go to `writer`
+    (anything with write(record)) as they are crawled; the job's result is a
+    summary of what it produced.
+    """
+
+    def __init__(self, queue, writer, kinds=KINDS, name=None, has_screen=False, **crawler_kwargs):
+        self.queue = queue
+        self.writer = writer
+        self.kinds = kinds
+        self.name = name or worker_name()
+        self.has_screen = has_screen
+        self.crawler_kwargs = crawler_kwargs
+        self._crawler = None
+
+    @property
+    def crawler(self):
+        # Started on the first job, so an idle worker holds no browser
+        if self._crawler is None:
+            from inscrawler import InsCrawler
+
+            self._crawler = InsCrawler(has_screen=self.has_screen, **self.crawler_kwargs)
+        return self._crawler
+
+    def execute(self, job):
+        kind, target, params = job["kind"], job["target"], job["params"] or {}
+        number = params.get("number")
+
+        if kind == "profile":
+            profile = self.crawler.get_user_profile(target, params.get("max_age"))
+            self.writer.write(dict(profile, handle=target))
+            return {"profile": profile}
+
+        if kind == "hashtag":
+            posts = self.crawler.iter_tag_posts(target, number or 100)
+        else:
+            posts = self.crawler.iter_user_posts(
+                target, number, kind == "posts_full", params.get("incremental", False)
+            )
+
+        count, first_key = 0, None
+        for post in posts:
+            self.writer.write(post)
+            count += 1
+            first_key = first_key or post["key"]
+        # A job is only done once what it produced is on disk
+        self.writer.sync()
+        return {"posts": count, "first_key": first_key}
+
+    def run_one(self):
+        """Claims and runs one job; returns False when there was nothing to claim."""
+        for row in self.queue.requeue_expired():
+            print(f"↩️ Job {row['id']} lease expired, now {row['status']}", file=sys.stderr)
+
+        job = self.queue.claim(self.name, self.kinds)
+        if job is None:
+            return False
+
+        print(f"🔄 Job {job['id']}: {job['kind']} {job['target']} (attempt {job['attempts']})", file=sys.stderr)
+        start = time.time()
+        with Heartbeat(self.queue, job["id"], self.name) as heartbeat:
+            try:
+                result = self.execute(job)
+            except Exception as e:
+                status = self.queue.fail(
+                    job["id"], self.name, "%s: %s" % (type(e).__name__, e),
+                    {"seconds": round(time.time() - start, 1)},
+                )
+                print(f"❌ Job {job['id']} failed ({status}): {e}", file=sys.stderr)
+                return True
+
+        result["seconds"] = round(time.time() - start, 1)
+        if heartbeat.lost or not self.queue.complete(job["id"], self.name, result):
+            print(f"⚠️ Job {job['id']} finished after its lease was lost, result dropped", file=sys.stderr)
+        else:
+            print(f"✅ Job {job['id']} done: {json.dumps(result)}", file=sys.stderr)
+        return True
+
+    def run(self, once=False, idle_sleep=10):
+        try:
+            while True:
+                if not self.run_one():
+                    if once:
+                        return
+                    time.sleep(idle_sleep)
+        finally:
+            if self._crawler is not None:
+                self._crawler.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Postgres-backed crawl job queue")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    commands.add_parser("init", help="create the job table in the galvor schema")
+
+    add = commands.add_parser("add", help="queue one job per target")
+    add.add_argument("kind", choices=KINDS)
+    add.add_argument("targets", nargs="+", help="usernames, or tags for hashtag jobs")
+    add.add_argument("-n", "--number", type=int, help="number of posts")
+    add.add_argument("--incremental", action="store_true")
+    add.add_argument("--max_age", type=int, help="seconds old a cached profile may be (profile jobs)")
+    add.add_argument("--priority", type=int, default=0)
+    add.add_argument("--max_attempts", type=int, default=DEFAULT_MAX_ATTEMPTS)
+
+    work = commands.add_parser("work", help="claim and run jobs until stopped")
+    work.add_argument("-o", "--output", help="append crawled records to this NDJSON file (default stdout)")
+    work.add_argument("--kinds", default=",".join(KINDS), help="comma separated job kinds to take")
+    work.add_argument("--lease", type=int, default=DEFAULT_LEASE, help="seconds a claim lasts without heartbeat")
+    work.add_argument("--once", action="store_true", help="exit once the queue is empty")
+    work.add_argument("--debug", action="store_true")
+
+    commands.add_parser("status", help="job counts per status and the running jobs")
+    commands.add_parser("requeue", help="requeue the jobs of workers whose lease expired")
+
+    args = parser.parse_args(argv)
+
+    queue = JobQueue(lease=getattr(args, "lease", DEFAULT_LEASE))
+    if args.command == "init":
+        queue.init()
+        print("✅ crawl_job table ready")
+    elif args.command == "add":
+        params = {"number": args.number, "incremental": args.incremental, "max_age": args.max_age}
+        ids = queue.add(args.kind, args.targets, params, args.priority, args.max_attempts)
+        print(f"✅ Queued {len(ids)} jobs ({len(args.targets) - len(ids)} already queued or running)")
+    elif args.command == "work":
+        from inscrawler.output import NdjsonWriter
+
+        # Keep progress messages out of the record stream when it goes to stdout
+        with NdjsonWriter(args.output) as writer, redirect_stdout(sys.stderr):
+            worker = JobWorker(queue, writer, args.kinds.split(","), has_screen=args.debug)
+            worker.run(once=args.once)
+    elif args.command == "status":
+        counts, running = queue.status()
+        for row in counts:
+            print(f"{row['kind']:<12} {row['status']:<10} {row['jobs']}")
+        for row in running:
+            print(
+                f"running #{row['id']} {row['kind']} {row['target']} on {row['worker']} "
+                f"(attempt {row['attempts']}, lease until {row['lease_until']:%H:%M:%S})"
+            )
+    elif args.command == "requeue":
+        rows = queue.requeue_expired()
+        print(f"↩️ {len(rows)} expired jobs handled")
+
+
+if __name__ == "__main__":
+    main()
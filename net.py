@@ -2,6 +2,7 @@ import json
 import time
 import os
 from inscrawler.browser import Browser
+from inscrawler.graphql import timeline_posts
 from inscrawler.secret import secret
 from selenium.webdriver.common.desired_capabilities import DesiredCapabilities
 
@@ -61,45 +62,17 @@ class InstagramScraper:
     def extract_graphql_data(self):
         """Captures Instagram GraphQL API response and extracts post data."""
         try:
-            logs = self.browser.get_network_logs()  # Capture Network Logs
+            responses = self.browser.get_network_logs(file_name=None)  # Capture GraphQL responses
             graphql_logs = []
 
-            if not logs:
+            if not responses:
                 print("⚠️ No GraphQL logs captured. The network logs might be empty.")
                 return []
 
-            for log_entry in logs:
-                log_message = json.loads(log_entry["message"])["message"]
-
-                # Check if it's a network response event
-                if "Network.responseReceived" in log_message.get("method", ""):
-                    params = log_message.get("params", {})
-                    response_url = params.get("response", {}).get("url", "")
-
-                    # Filter only GraphQL requests related to user timeline
-                    if "graphql/query" in response_url and "feed__user_timeline_graphql_connection" in response_url:
-                        request_id = params.get("requestId")
-
-                        # Fetch full response
-                        raw_response = self.browser.driver.execute_cdp_cmd("Network.getResponseBody", {"requestId": request_id})
-                        graphql_data = json.loads(raw_response.get("body", "{}"))
-
-                        # Extract timeline posts
-                        posts = graphql_data.get("data", {}).get("xdt_api__v1__feed__user_timeline_graphql_connection", {}).get("edges", [])
-
-                        for post in posts:
-                            node = post.get("node", {})
-
-                            post_details = {
-                                "post_id": node.get("id", "N/A"),
-                                "code": node.get("code", "N/A"),
-                                "media_pk": node.get("pk", "N/A"),
-                                "caption": node.get("caption", {}).get("text", "N/A"),
-                                "timestamp": time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(node.get("caption", {}).get("created_at", 0))),
-                                "mentions": [],  # To be extracted later
-                            }
-
-                            graphql_logs.append(post_details)
+            # Extract timeline posts with the same parser the crawler and replay use
+            for response in responses:
+                posts, _ = timeline_posts(response)
+                graphql_logs.extend(posts)
 
             if graphql_logs:
                 print("✅ Extracted GraphQL Post Data:")
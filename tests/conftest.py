@@ -0,0 +1,54 @@
+"""
+    Shared fixtures. Tests marked by the `pg` fixture run against the
+    postgres service of docker-compose.yml (or whatever the DB_* variables
+    of save_to_db.py point at) and are skipped when it isn't reachable.
+    Every test gets a schema of its own, dropped afterwards.
+"""
+import os
+import sys
+import uuid
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def pg(monkeypatch):
+    """A fresh schema; returns a function making connection pools that use it."""
+    psycopg2 = pytest.importorskip("psycopg2")
+    import save_to_db
+
+    try:
+        admin = psycopg2.connect(connect_timeout=3, **save_to_db.DB_CONFIG)
+    except psycopg2.OperationalError as e:
+        pytest.skip("needs the postgres service of docker-compose.yml: %s" % e)
+    admin.autocommit = True
+
+    schema = "test_%s" % uuid.uuid4().hex[:12]
+    # Every module reads the schema name at call time from these globals
+    monkeypatch.setattr(save_to_db, "DB_SCHEMA", schema)
+    if "job_queue" in sys.modules:
+        monkeypatch.setattr(sys.modules["job_queue"], "DB_SCHEMA", schema)
+
+    pools = []
+
+    def make_pool(maxconn=4):
+        pool = save_to_db.create_pool(1, maxconn)
+        pools.append(pool)
+        return pool
+
+    make_pool.schema = schema
+    make_pool.connect = lambda: psycopg2.connect(
+        options="-c search_path=%s" % schema, **save_to_db.DB_CONFIG
+    )
+    try:
+        yield make_pool
+    finally:
+        for pool in pools:
+            pool.closeall()
+        with admin.cursor() as cursor:
+            cursor.execute("DROP SCHEMA IF EXISTS %s CASCADE" % schema)
+        admin.close()
@@ -0,0 +1,176 @@
+import threading
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+
+import job_queue
+from job_queue import CLAIM_SQL
+from job_queue import JobQueue
+from job_queue import RETRY_DELAY
+
+
+@pytest.fixture
+def queue(pg):
+    queue = JobQueue(pg(), lease=60)
+    queue.init()
+    return queue
+
+
+def expire_lease(queue, job_id):
+    with queue.cursor() as cursor:
+        cursor.execute(
+            "UPDATE crawl_job SET lease_until = NOW() - INTERVAL '1 second' WHERE id = %s",
+            (job_id,),
+        )
+
+
+def job(queue, job_id):
+    with queue.cursor() as cursor:
+        cursor.execute("SELECT * FROM crawl_job WHERE id = %s", (job_id,))
+        return cursor.fetchone()
+
+
+def test_init_twice(queue):
+    queue.init()
+    assert queue.add("posts", ["cal_foodie"])
+
+
+def test_add_skips_targets_already_queued_or_running(queue):
+    first = queue.add("posts", ["a", "b"])
+    assert len(first) == 2
+    # Conflicts with the partial unique index: queued, then running
+    assert len(queue.add("posts", ["a", "b", "c"])) == 1
+    claimed = queue.claim("w1")
+    assert queue.add("posts", [claimed["target"]]) == []
+    # Another kind, or a finished job, doesn't conflict
+    assert len(queue.add("profile", ["a"])) == 1
+    assert queue.complete(claimed["id"], "w1", {"posts": 1})
+    assert len(queue.add("posts", [claimed["target"]])) == 1
+
+
+def test_claims_by_priority_then_age(queue):
+    low = queue.add("posts", ["low"])[0]
+    high = queue.add("posts", ["high"], priority=5)[0]
+    assert queue.claim("w1")["id"] == high
+    assert queue.claim("w1")["id"] == low
+    assert queue.claim("w1") is None
+
+
+def test_concurrent_claims_skip_locked_rows(queue, pg):
+    queue.add("posts", ["a", "b"])
+    params = {"worker": "w", "lease": 60, "kinds": job_queue.KINDS}
+
+    holder = pg.connect()
+    other = pg.connect()
+    try:
+        with holder.cursor() as cursor:
+            # Claimed but not committed yet: the row stays locked
+            cursor.execute(CLAIM_SQL, dict(params, worker="w1"))
+            held = cursor.fetchone()
+
+        result = {}
+
+        def claim():
+            with other.cursor() as cursor:
+                # A claim that waited for the lock would fail here instead of hanging
+                cursor.execute("SET statement_timeout = 5000")
+                cursor.execute(CLAIM_SQL, dict(params, worker="w2"))
+                result["row"] = cursor.fetchone()
+            other.commit()
+
+        thread = threading.Thread(target=claim)
+        thread.start()
+        thread.join(10)
+        holder.commit()
+    finally:
+        holder.close()
+        other.close()
+
+    assert result["row"] is not None
+    assert result["row"][0] != held[0]
+
+
+def test_expired_lease_is_requeued_then_failed(queue):
+    job_id = queue.add("posts", ["a"], max_attempts=2)[0]
+
+    queue.claim("w1")
+    expire_lease(queue, job_id)
+    assert [tuple(row.values()) for row in queue.requeue_expired()] == [(job_id, "queued")]
+    assert "w1" in job(queue, job_id)["error"]
+
+    assert queue.claim("w2")["attempts"] == 2
+    expire_lease(queue, job_id)
+    assert [tuple(row.values()) for row in queue.requeue_expired()] == [(job_id, "failed")]
+    assert job(queue, job_id)["finished_at"] is not None
+    assert queue.claim("w3") is None
+
+
+def test_live_lease_is_not_requeued(queue):
+    queue.add("posts", ["a"])
+    queue.claim("w1")
+    assert queue.requeue_expired() == []
+
+
+def test_fail_backs_off_by_attempt(queue):
+    job_id = queue.add("posts", ["a"], max_attempts=3)[0]
+
+    queue.claim("w1")
+    assert queue.fail(job_id, "w1", "boom") == "queued"
+    row = job(queue, job_id)
+    with queue.cursor() as cursor:
+        cursor.execute(
+            "SELECT EXTRACT(EPOCH FROM run_after - NOW()) AS delay FROM crawl_job WHERE id = %s",
+            (job_id,),
+        )
+        delay = float(cursor.fetchone()["delay"])
+    assert RETRY_DELAY - 5 < delay <= RETRY_DELAY
+    assert row["error"] == "boom" and row["worker"] is None
+    # Not runnable before the delay is over
+    assert queue.claim("w1") is None
+
+    with queue.cursor() as cursor:
+        cursor.execute("UPDATE crawl_job SET run_after = NOW() WHERE id = %s", (job_id,))
+    queue.claim("w1")
+    queue.fail(job_id, "w1", "boom")
+    with queue.cursor() as cursor:
+        cursor.execute(
+            "SELECT EXTRACT(EPOCH FROM run_after - NOW()) AS delay FROM crawl_job WHERE id = %s",
+            (job_id,),
+        )
+        assert float(cursor.fetchone()["delay"]) > 2 * RETRY_DELAY - 5
+
+    with queue.cursor() as cursor:
+        cursor.execute("UPDATE crawl_job SET run_after = NOW() WHERE id = %s", (job_id,))
+    queue.claim("w1")
+    assert queue.fail(job_id, "w1", "boom") == "failed"
+
+
+def test_complete_after_lost_lease_is_refused(queue):
+    job_id = queue.add("posts", ["a"])[0]
+    queue.claim("w1")
+    expire_lease(queue, job_id)
+    queue.requeue_expired()
+    assert queue.claim("w2")["id"] == job_id
+
+    assert not queue.heartbeat(job_id, "w1")
+    assert not queue.complete(job_id, "w1", {"posts": 1})
+    assert queue.fail(job_id, "w1", "late") is None
+    assert job(queue, job_id)["worker"] == "w2"
+
+    assert queue.heartbeat(job_id, "w2")
+    assert queue.complete(job_id, "w2", {"posts": 2})
+    row = job(queue, job_id)
+    assert row["status"] == "done" and row["result"] == {"posts": 2}
+
+
+def test_status_counts(queue):
+    queue.add("posts", ["a", "b"])
+    queue.add("hashtag", ["t"])
+    queue.claim("w1", kinds=["hashtag"])
+    counts, running = queue.status()
+    assert {(c["kind"], c["status"]): c["jobs"] for c in counts} == {
+        ("posts", "queued"): 2,
+        ("hashtag", "running"): 1,
+    }
+    assert [r["target"] for r in running] == ["t"]
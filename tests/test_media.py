@@ -0,0 +1,113 @@
+import os
+
+import pytest
+
+pytest.importorskip("requests")
+
+from bench.server import FixtureServer
+from bench.server import FixtureSite
+from inscrawler.media import cache_key
+from inscrawler.media import MediaDownloader
+from inscrawler.media import MediaStore
+
+
+@pytest.fixture(scope="module")
+def server():
+    server = FixtureServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def downloader(tmp_path):
+    downloader = MediaDownloader(str(tmp_path / "media"), workers=4, timeout=5, retries=2)
+    yield downloader
+    downloader.close()
+
+
+def media_url(server, name, key, signature="sig1"):
+    return "%s/static/%s?ig_cache_key=%s&oh=%s" % (server.url, name, key, signature)
+
+
+def read(downloader, entry):
+    with open(os.path.join(downloader.store.root, entry["path"]), "rb") as f:
+        return f.read()
+
+
+def test_download_stores_content_addressed_files(server, downloader):
+    entry = downloader.download(media_url(server, "a.gif", "k1"))
+    assert read(downloader, entry) == FixtureSite.media("a.gif")
+    assert entry["path"].startswith(os.path.join(entry["sha256"][:2], entry["sha256"][2:4]))
+    assert entry["path"].endswith(".gif")
+    assert downloader.stats["downloaded"] == 1
+    assert downloader.stats["bytes"] == entry["bytes"]
+
+
+def test_same_key_is_downloaded_once(server, downloader):
+    first = downloader.download(media_url(server, "a.gif", "k1"))
+    # Signed differently, same media
+    again = downloader.download(media_url(server, "a.gif", "k1", signature="sig2"))
+    assert again == first
+    assert downloader.stats["downloaded"] == 1 and downloader.stats["cached"] == 1
+
+    # Read back from the index by a later run
+    store = MediaStore(downloader.store.root)
+    assert store.get(cache_key(media_url(server, "a.gif", "k1"))) == first
+
+
+def test_same_content_shares_one_file(server, downloader):
+    first = downloader.download(media_url(server, "a.gif", "k1"))
+    second = downloader.download(media_url(server, "a.gif", "k2"))
+    assert downloader.stats["downloaded"] == 2
+    assert second["path"] == first["path"]
+    assert sorted(os.listdir(os.path.join(downloader.store.root, first["path"][:2]))) == [
+        first["path"][3:5]
+    ]
+
+
+def test_concurrent_requests_share_one_download(server, downloader):
+    url = media_url(server, "b.gif", "k3")
+    futures = [downloader.download_async(url) for _ in range(8)]
+    entries = [future.result() for future in futures]
+    assert all(entry == entries[0] for entry in entries)
+    assert downloader.stats["downloaded"] == 1
+
+
+def test_partial_download_resumes_with_a_range_request(server, downloader):
+    url = media_url(server, "c.gif", "k4")
+    body = FixtureSite.media("c.gif")
+    with open(downloader.store.partial_path(cache_key(url)), "wb") as f:
+        f.write(body[:10])
+
+    entry = downloader.download(url)
+    assert read(downloader, entry) == body
+    assert downloader.stats["resumed"] == 1
+    assert downloader.stats["bytes"] == len(body) - 10
+    assert not os.listdir(downloader.store.partial_dir)
+
+
+def test_complete_partial_download_is_kept(server, downloader):
+    url = media_url(server, "d.gif", "k5")
+    body = FixtureSite.media("d.gif")
+    with open(downloader.store.partial_path(cache_key(url)), "wb") as f:
+        f.write(body)
+
+    # The server answers 416: nothing is left to fetch
+    entry = downloader.download(url)
+    assert read(downloader, entry) == body
+    assert downloader.stats["bytes"] == 0
+
+
+def test_failed_download_leaves_the_post_without_media(server, downloader):
+    post = {
+        "key": "https://www.instagram.com/p/x/",
+        "img_urls": [media_url(server, "e.gif", "k6"), server.url + "/no/such/file.gif", "N/A"],
+    }
+    post = downloader.download_post(post)
+    assert [m["url"] for m in post["media"]] == [post["img_urls"][0]]
+    assert post["img_path"] == post["media"][0]["path"]
+    assert downloader.stats["failed"] == 1
+
+    post = downloader.download_post({"key": "k", "img_urls": [server.url + "/no/such/file.gif"]})
+    assert "media" not in post and "img_path" not in post
+    assert downloader.stats["failed"] == 2
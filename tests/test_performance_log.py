@@ -0,0 +1,297 @@
+"""
+    The performance log readers against a scripted chromedriver: every
+    response a post loads is logged the moment the post opens, and each
+    stream must only see the responses of the post it was made for.
+"""
+import json
+import threading
+import weakref
+
+import pytest
+
+pytest.importorskip("selenium")
+pytest.importorskip("tqdm")
+# The crawler reads the login from it, see the README
+pytest.importorskip("inscrawler.secret")
+
+from inscrawler.browser import Browser
+from inscrawler.crawler import InsCrawler
+from inscrawler.graphql import COMMENTS
+from inscrawler.metrics import Metrics
+from inscrawler.scheduler import Scheduler
+from inscrawler.settings import settings
+from inscrawler.utils import RetryPolicy
+
+URL = "https://www.instagram.com"
+
+
+class FakeDriver(object):
+    def __init__(self):
+        self.log = []
+        self.bodies = {}
+        self.requests = 0
+
+    def respond(self, url, body):
+        """Logs a whole request/response exchange for `url`."""
+        self.requests += 1
+        request_id = "r%d" % self.requests
+        self.bodies[request_id] = body
+        for method, params in (
+            ("Network.requestWillBeSent", {"request": {"url": url}}),
+            ("Network.responseReceived", {"response": {"status": 200}}),
+            ("Network.loadingFinished", {}),
+        ):
+            params = dict(params, requestId=request_id)
+            self.log.append(
+                {"message": json.dumps({"message": {"method": method, "params": params}})}
+            )
+
+    def get_log(self, kind):
+        entries, self.log = self.log, []
+        return entries
+
+    def execute_cdp_cmd(self, cmd, params):
+        return {"body": json.dumps(self.bodies[params["requestId"]])}
+
+    def implicitly_wait(self, t):
+        pass
+
+
+class Reader(object):
+    pass
+
+
+class Element(object):
+    def __init__(self, on_click=None, value=None):
+        self.on_click = on_click
+        self.value = value
+
+    def click(self):
+        if self.on_click:
+            self.on_click()
+
+    def get_attribute(self, name):
+        return self.value
+
+
+def likers_response(driver, usernames):
+    driver.respond(
+        URL + "/api/v1/media/1/likers/",
+        {"users": [{"username": name} for name in usernames]},
+    )
+
+
+def comments_response(driver, comments):
+    edges = [
+        {"node": {"pk": pk, "user": {"username": author}, "text": text, "created_at": 1}}
+        for pk, author, text in comments
+    ]
+    driver.respond(URL + "/graphql/query", {"data": {COMMENTS: {"edges": edges}}})
+
+
+class FakeBrowser(Browser):
+    """
+        A post modal over a FakeDriver. Opening a post logs its responses;
+        closing its likers dialog logs a late likers response; the next
+        post opens once the comments of the current one are read.
+    """
+
+    def __init__(self, posts):
+        self.driver = FakeDriver()
+        self.metrics = Metrics()
+        self.scheduler = Scheduler()
+        self.resource_policy = None
+        self.recorder = None
+        self._graphql = None
+        self._performance_backlog = []
+        self._performance_base = 0
+        self._performance_readers = weakref.WeakKeyDictionary()
+        self._performance_holds = []
+        self._performance_lock = threading.RLock()
+        self.posts = posts
+        self.post = None
+        self.done = False
+
+    def open(self, index):
+        self.post = index
+        self.done = False
+        post = self.posts[index]
+        likers_response(self.driver, post["likers"])
+        comments_response(self.driver, post["comments"])
+
+    def close_likers(self):
+        likers_response(self.driver, self.posts[self.post]["late_likers"])
+
+    def find_one(self, css_selector, elem=None, waittime=0):
+        if css_selector == ".v1Nh3 a":
+            return Element(lambda: self.open(0))
+        if css_selector == ".eo2As .c-Yi7":
+            if self.done and self.post + 1 < len(self.posts):
+                self.open(self.post + 1)
+            return Element(value=self.current_url)
+        if css_selector == ".eo2As .c-Yi7 ._1o9PC":
+            return Element(value="2020-01-01T00:00:00.000Z")
+        if css_selector == ".EDfFK ._0mzm-.sqdOP":
+            return Element()
+        if css_selector == ".WaOAr button":
+            return Element(self.close_likers)
+        return None
+
+    def pace(self, kind="request"):
+        pass
+
+    def scroll_down(self, wait=0.3, timeout=5):
+        pass
+
+    def wait_for(self, css_selector, timeout=None, label=None):
+        return False
+
+    def new_rows(self, css_selector, timeout=3):
+        return []
+
+    def comments_page(self, buttons_css, timeout=3):
+        self.done = True
+        return {"comments": [], "more": False}
+
+    def extract_comments(self):
+        return {"caption": None}
+
+    @property
+    def current_url(self):
+        return "%s/p/%s/" % (URL, self.posts[self.post]["key"])
+
+
+POSTS = [
+    {
+        "key": "first",
+        "likers": ["alice", "bob"],
+        "late_likers": ["dave"],
+        "comments": [("1", "alice", "nice")],
+    },
+    {
+        "key": "second",
+        "likers": ["carol"],
+        "late_likers": ["erin"],
+        "comments": [("2", "carol", "wow")],
+    },
+]
+
+
+@pytest.fixture
+def fetch_all(monkeypatch):
+    for name in ("fetch_likers", "fetch_comments"):
+        monkeypatch.setattr(settings, name, True)
+
+
+def crawl(browser, likers_writer=None, comments_writer=None):
+    crawler = object.__new__(InsCrawler)
+    crawler.log_disable = True
+    crawler.browser = browser
+    crawler.retry_policy = RetryPolicy(attempts=1)
+    crawler.likers_writer = likers_writer
+    crawler.comments_writer = comments_writer
+    crawler._get_posts = lambda num, handle, known=None: iter(
+        [{"key": "grid-%d" % i} for i in range(len(browser.posts))]
+    )
+    return list(crawler._get_posts_full(len(browser.posts), "someone"))
+
+
+def test_consecutive_posts_only_read_their_own_responses(fetch_all):
+    browser = FakeBrowser(POSTS)
+    posts = crawl(browser)
+
+    assert [post["key"] for post in posts] == [
+        "%s/p/%s/" % (URL, post["key"]) for post in POSTS
+    ]
+    assert posts[0]["likers"] == ["alice", "bob"]
+    assert posts[1]["likers"] == ["carol"]
+    assert [c["comment"] for c in posts[1]["comments"]] == ["wow"]
+    # Nothing is kept once the last post's readers are done
+    assert browser._performance_backlog == []
+    assert not browser._performance_holds
+
+
+def test_readers_start_at_the_newest_hold():
+    browser = FakeBrowser(POSTS)
+    likers_response(browser.driver, ["old"])
+    hold = browser.hold_performance_log()
+    likers_response(browser.driver, ["new"])
+    early = Reader()
+    browser.watch_performance_log(early, since=0)
+    # Created after more was logged, still reads from the hold
+    likers_response(browser.driver, ["newer"])
+    reader = Reader()
+    browser.watch_performance_log(reader)
+
+    assert len(browser.performance_log(reader)) == 6
+    browser.release_performance_log(hold)
+    # An explicit start reads whatever is still kept
+    assert len(browser.performance_log(early)) == 9
+    browser.release_performance_log(early)
+    browser.release_performance_log(reader)
+    assert browser._performance_backlog == []
+
+
+def test_reader_outside_a_hold_starts_at_the_end():
+    browser = FakeBrowser(POSTS)
+    likers_response(browser.driver, ["old"])
+    reader = Reader()
+    browser.watch_performance_log(reader)
+    assert browser.performance_log(reader) == []
+
+
+def many_posts(count):
+    return [
+        {
+            "key": "post%d" % i,
+            "likers": ["liker%d-%d" % (i, j) for j in range(i + 1)],
+            "late_likers": ["late%d" % i],
+            "comments": [(str(i), "author%d" % i, "comment %d" % i)],
+        }
+        for i in range(count)
+    ]
+
+
+class Rows(object):
+    def __init__(self):
+        self.rows = []
+
+    def write(self, row):
+        self.rows.append(row)
+
+
+def test_likers_only_come_from_their_own_post(fetch_all):
+    posts = many_posts(4)
+    browser = FakeBrowser(posts)
+    crawled = crawl(browser)
+    for post, crawled_post in zip(posts, crawled):
+        assert crawled_post["likers"] == post["likers"]
+
+    # Streamed, every row carries the post it was found on
+    writer = Rows()
+    crawl(FakeBrowser(posts), likers_writer=writer)
+    likers = {"%s/p/%s/" % (URL, post["key"]): post["likers"] for post in posts}
+    assert [row["username"] for row in writer.rows] == [
+        name for post in posts for name in post["likers"]
+    ]
+    for row in writer.rows:
+        assert row["username"] in likers[row["key"]]
+
+
+def test_comments_only_come_from_their_own_post(fetch_all):
+    posts = many_posts(4)
+    crawled = crawl(FakeBrowser(posts))
+    for post, crawled_post in zip(posts, crawled):
+        assert [(c["id"], c["author"], c["comment"]) for c in crawled_post["comments"]] == (
+            post["comments"]
+        )
+
+    # Different posts' comments have different ids: only the reader's
+    # position keeps them apart, not the dedup
+    writer = Rows()
+    crawl(FakeBrowser(posts), comments_writer=writer)
+    assert [(row["key"], row["comment"]) for row in writer.rows] == [
+        ("%s/p/%s/" % (URL, post["key"]), text)
+        for post in posts
+        for _, _, text in post["comments"]
+    ]
@@ -0,0 +1,65 @@
+import pytest
+
+from inscrawler.exceptions import RetryException
+from inscrawler.utils import RetryPolicy
+
+
+class Stop(Exception):
+    pass
+
+
+def failing(calls):
+    def func():
+        calls.append(1)
+        raise RetryException()
+
+    return func
+
+
+def exhaust(policy):
+    calls = []
+    with pytest.raises(RetryException, match="retry budget"):
+        policy.call(failing(calls))
+    return len(calls)
+
+
+def test_reset_budget_starts_a_new_crawl_budget():
+    policy = RetryPolicy(
+        attempts=100, wait=0.01, factor=1, jitter=0, budget=0.05, retry_on=(RetryException,)
+    )
+    assert exhaust(policy) > 1
+    # Spent: the next call gives up after its first attempt
+    assert exhaust(policy) == 1
+
+    policy.reset_budget()
+    assert exhaust(policy) > 1
+    assert policy.report()["func"]["calls"] == 3
+
+
+def test_every_user_crawl_gets_its_own_budget():
+    pytest.importorskip("selenium")
+    pytest.importorskip("tqdm")
+    pytest.importorskip("inscrawler.secret")
+    from inscrawler.crawler import InsCrawler
+
+    class Offline(object):
+        """Stops the crawl at its first browser use."""
+
+        def __getattr__(self, name):
+            raise Stop()
+
+    crawler = object.__new__(InsCrawler)
+    crawler.log_disable = True
+    crawler.browser = Offline()
+    crawler.retry_policy = RetryPolicy(
+        wait=0.01, factor=1, jitter=0, budget=0.05, retry_on=(RetryException,)
+    )
+    # A warm crawler (pool, daemon, job worker) starting its next handle or tag
+    for crawl in (
+        lambda: crawler.iter_user_posts("someone"),
+        lambda: crawler.iter_tag_posts("sometag", 10),
+    ):
+        exhaust(crawler.retry_policy)
+        with pytest.raises(Stop):
+            next(crawl())
+        assert crawler.retry_policy.spent == 0
@@ -0,0 +1,176 @@
+import json
+
+import pytest
+
+psycopg2 = pytest.importorskip("psycopg2")
+
+import save_to_db
+from save_to_db import batched
+from save_to_db import BulkLoader
+from save_to_db import iter_posts_file
+
+# Just the columns the loader writes; the real tables are managed elsewhere
+TABLES = """
+    CREATE TABLE creator (id SERIAL PRIMARY KEY, handle TEXT UNIQUE NOT NULL);
+    CREATE TABLE insta_post_info (
+        media_id TEXT PRIMARY KEY,
+        key TEXT,
+        timestamp TEXT,
+        caption TEXT,
+        media_url TEXT,
+        media_type TEXT,
+        created_at TIMESTAMPTZ,
+        is_deleted BOOLEAN,
+        views BIGINT,
+        likes BIGINT,
+        hashtag TEXT
+    );
+    CREATE TABLE comments (
+        media_id TEXT, author TEXT, comment TEXT, mentions JSONB, timestamp TEXT
+    );
+    CREATE TABLE collab (
+        media_id TEXT, author_id INTEGER, collaborator TEXT, collab_type TEXT
+    );
+"""
+
+
+def post(handle, media_id, **fields):
+    return dict(
+        {
+            "media_id": media_id,
+            "key": "https://www.instagram.com/%s/p/%s/" % (handle, media_id),
+            "timestamp": "2025-02-11T15:52:59.000Z",
+            "caption": "caption %s" % media_id,
+            "img_url": "https://example.com/%s.jpg" % media_id,
+        },
+        **fields
+    )
+
+
+@pytest.fixture
+def db(pg, monkeypatch):
+    pool = pg()
+    conn = pool.getconn()
+    with conn, conn.cursor() as cursor:
+        cursor.execute("CREATE SCHEMA %s" % pg.schema)
+        cursor.execute(TABLES)
+        cursor.execute("INSERT INTO creator (handle) VALUES ('cristiano'), ('messi')")
+    pool.putconn(conn)
+
+    monkeypatch.setattr(save_to_db, "CREATOR_CACHE", {})
+    requested = []
+
+    def request_creator(handle):
+        requested.append(handle)
+        return handle != "refused"
+
+    monkeypatch.setattr(save_to_db, "request_creator", request_creator)
+    pool.requested = requested
+    return pool
+
+
+def query(pool, sql, args=()):
+    conn = pool.getconn()
+    try:
+        with conn, conn.cursor() as cursor:
+            cursor.execute(sql, args)
+            return cursor.fetchall()
+    finally:
+        pool.putconn(conn)
+
+
+def test_batched():
+    assert list(batched(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(batched(range(4), 2)) == [[0, 1], [2, 3]]
+    assert list(batched([], 2)) == []
+
+
+def test_iter_posts_file_reads_json_arrays(tmp_path):
+    path = tmp_path / "posts.json"
+    path.write_text("\n  " + json.dumps([{"key": "a"}, {"key": "b"}]), encoding="utf-8")
+    assert [p["key"] for p in iter_posts_file(str(path))] == ["a", "b"]
+
+
+def test_iter_posts_file_reads_ndjson(tmp_path):
+    path = tmp_path / "posts.ndjson"
+    path.write_text('{"key": "a"}\n\n{"key": "ü"}\n', encoding="utf-8")
+    assert [p["key"] for p in iter_posts_file(str(path))] == ["a", "ü"]
+
+
+def test_load_upserts_posts_with_comments_and_collabs(db):
+    loader = BulkLoader(db, batch_size=2)
+    stats = loader.load(
+        [
+            post(
+                "cristiano",
+                "m1",
+                collaborators="@piersmorgan, ufc",
+                comments=[{"author": "fan", "comment": "wow", "mentions": ["@x"]}],
+            ),
+            post("cristiano", "m2", collaborators=["@ufc"]),
+            post("messi", "m3"),
+        ]
+    )
+    assert stats["posts"] == 3 and stats["comments"] == 1 and stats["collabs"] == 3
+    assert stats["batches"] == 2
+
+    # Loaded again, posts are updated in place; comments and collabs are appended
+    loader.load([post("cristiano", "m1", caption="edited", likes=7)])
+    assert query(db, "SELECT media_id, caption, likes FROM insta_post_info ORDER BY media_id") == [
+        ("m1", "edited", 7),
+        ("m2", "caption m2", 0),
+        ("m3", "caption m3", 0),
+    ]
+    assert query(db, "SELECT mentions FROM comments") == [(["@x"],)]
+    creator_id = query(db, "SELECT id FROM creator WHERE handle = 'cristiano'")[0][0]
+    assert sorted(query(db, "SELECT author_id, collaborator, collab_type FROM collab")) == [
+        (creator_id, "@piersmorgan", "collab"),
+        (creator_id, "@ufc", "collab"),
+        (creator_id, "ufc", "tag"),
+    ]
+
+
+def test_batch_keeps_the_last_copy_and_skips_posts_without_media_id(db):
+    loader = BulkLoader(db)
+    stats = loader.load(
+        [
+            post("messi", "m1", caption="first"),
+            post("messi", "m1", caption="second"),
+            post("messi", None),
+        ]
+    )
+    assert stats["posts"] == 1 and stats["skipped"] == 1
+    assert query(db, "SELECT caption FROM insta_post_info") == [("second",)]
+
+
+def test_creators_are_looked_up_once(db):
+    loader = BulkLoader(db, batch_size=1)
+    loader.prefetch_creators(["cristiano", "messi", "cristiano"])
+    loader.load([post("cristiano", "m1"), post("messi", "m2"), post("cristiano", "m3")])
+    assert loader.resolver.queries == 1
+    assert db.requested == []
+
+
+def test_posts_wait_for_their_creator(db):
+    loader = BulkLoader(db, creator_timeout=5)
+    loader.resolver.poll_interval = 0.1
+    loader.add([post("newcomer", "m1"), post("messi", "m2"), post("refused", "m3")])
+    assert sorted(db.requested) == ["newcomer", "refused"]
+    assert [p["media_id"] for p in loader.parked] == ["m1"]
+    assert loader.stats["posts"] == 1 and loader.stats["skipped"] == 1
+
+    # The creator service answers
+    query(db, "INSERT INTO creator (handle) VALUES ('newcomer') RETURNING id")
+    loader.finish()
+    assert loader.parked == []
+    assert loader.stats["posts"] == 2
+    assert query(db, "SELECT media_id FROM insta_post_info ORDER BY media_id") == [("m1",), ("m2",)]
+
+
+def test_gives_up_on_creators_that_never_appear(db):
+    loader = BulkLoader(db, creator_timeout=0.2)
+    loader.resolver.poll_interval = 0.05
+    loader.add([post("newcomer", "m1")])
+    loader.finish()
+    assert loader.parked == [] and loader.stats["skipped"] == 1
+    assert query(db, "SELECT COUNT(*) FROM insta_post_info") == [(0,)]
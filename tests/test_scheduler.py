@@ -0,0 +1,24 @@
+from inscrawler.scheduler import Scheduler
+
+
+def test_no_limit_until_throttled():
+    scheduler = Scheduler(jitter=0)
+    assert sum(scheduler.acquire() for _ in range(100)) == 0
+    assert scheduler.report()["rate"] is None
+
+    pace = scheduler.pace()
+    scheduler.throttled("HTTP 429")
+    # Backs off from the pace it was keeping, after the pause
+    assert scheduler.rate == max(scheduler.min_rate, pace * scheduler.decrease)
+    assert scheduler.session.take() > scheduler.cooldown - 1
+
+
+def test_recovers_without_a_ceiling():
+    scheduler = Scheduler(jitter=0, cooldown=0, recovery=2)
+    scheduler.throttled("HTTP 429")
+    # Nothing paced yet: backs off from the fallback rate
+    assert scheduler.rate == 0.5
+    scheduler.session.rate = 1000
+    for _ in range(4):
+        scheduler.acquire()
+    assert scheduler.rate == 1000 + 2 * scheduler.increase